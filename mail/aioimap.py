@@ -0,0 +1,323 @@
+import asyncio
+import imaplib
+import random
+import re
+import ssl
+from collections import deque
+from typing import Union
+from datetime import date, datetime
+from mail.config import Config
+from mail.imap import (
+    Imap, Mail, LoginException, SelectException, SearchException,
+    FetchException, StoreException, ListException
+)
+from mail.imapdata import to_msg_set, iter_chunks, parse_fetch, first_literal
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+re_tagged = re.compile(rb'^(?P<tag>[A-Z]+\d+) (?P<type>[A-Z]+) ?(?P<data>.*)$')
+re_untagged_status = re.compile(
+    rb'^\* (?P<data>\d+) (?P<type>[A-Z-]+)( (?P<data2>.*))?$')
+re_untagged = re.compile(rb'^\* (?P<type>[A-Z-]+)( (?P<data>.*))?$')
+re_response_code = re.compile(rb'\[(?P<type>[A-Z-]+)( (?P<data>[^\]]*))?\]')
+re_literal = re.compile(rb'\{(?P<size>\d+)\}$')
+
+
+class _Command:
+    def __init__(self, tag: bytes, future: asyncio.Future):
+        self.tag = tag
+        self.future = future
+        self.untagged: dict[str, list] = {}
+
+    def append(self, typ: str, dat):
+        self.untagged.setdefault(typ, []).append(dat)
+
+
+class AsyncImap:
+    EXC = {
+        "LOGIN": LoginException,
+        "SELECT": SelectException,
+        "EXAMINE": SelectException,
+        "SEARCH": SearchException,
+        "FETCH": FetchException,
+        "STORE": StoreException,
+        "LIST": ListException
+    }
+
+    def __init__(self, config: Config, ssl_context: ssl.SSLContext = None):
+        if not isinstance(config, Config):
+            raise ValueError("Invalid Config")
+        self.__config = config
+        self.__ssl = ssl_context or ssl.create_default_context()
+        self.__reader: asyncio.StreamReader = None
+        self.__writer: asyncio.StreamWriter = None
+        self.__task: asyncio.Task = None
+        self.__pending: deque[_Command] = deque()
+        self.__tagnum = 0
+        self.__prefix = imaplib.Int2AP(random.randint(4096, 65535))
+        self.state = "LOGOUT"
+
+    async def connect(self):
+        if self.__writer is not None:
+            return
+        self.__reader, self.__writer = await asyncio.open_connection(
+            self.__config.host,
+            self.__config.port,
+            ssl=self.__ssl
+        )
+        greeting = await self.__reader.readline()
+        if not greeting.startswith((b'* OK', b'* PREAUTH')):
+            raise imaplib.IMAP4.error(greeting.decode(errors='replace'))
+        self.state = "AUTH" if greeting.startswith(b'* PREAUTH') else "NONAUTH"
+        self.__task = asyncio.create_task(self.__read_loop())
+
+    async def __read_response(self):
+        line = await self.__reader.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("socket error: EOF")
+        line = line.rstrip(b'\r\n')
+        parts: list = []
+        m = re_literal.search(line)
+        while m:
+            literal = await self.__reader.readexactly(int(m.group('size')))
+            parts.append((line, literal))
+            line = await self.__reader.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("socket error: EOF")
+            line = line.rstrip(b'\r\n')
+            m = re_literal.search(line)
+        parts.append(line)
+        return parts
+
+    async def __read_loop(self):
+        try:
+            while True:
+                parts = await self.__read_response()
+                self.__dispatch(parts)
+        except (asyncio.CancelledError, GeneratorExit):
+            raise
+        except Exception as e:
+            if not isinstance(e, imaplib.IMAP4.abort):
+                e = imaplib.IMAP4.abort(str(e))
+            while self.__pending:
+                cmd = self.__pending.popleft()
+                if not cmd.future.done():
+                    cmd.future.set_exception(e)
+
+    def __dispatch(self, parts: list):
+        head = parts[0][0] if isinstance(parts[0], tuple) else parts[0]
+        if head.startswith(b'+'):
+            return
+        m = re_tagged.match(head)
+        if m and not head.startswith(b'*'):
+            cmd = self.__pending.popleft() if self.__pending else None
+            if cmd is None or cmd.tag != m.group('tag'):
+                raise imaplib.IMAP4.abort(
+                    "unexpected tagged response: %r" % head)
+            if cmd.future.done():
+                return
+            cmd.future.set_result((
+                m.group('type').decode(),
+                [m.group('data')],
+                cmd.untagged
+            ))
+            return
+        # Las respuestas sin etiqueta se asignan al comando más antiguo
+        # pendiente ya que el servidor las procesa en orden
+        cmd = self.__pending[0] if self.__pending else None
+        m = re_untagged_status.match(head) or re_untagged.match(head)
+        if m is None or cmd is None:
+            return
+        typ = m.group('type').decode()
+        dat = m.group('data')
+        if m.re is re_untagged_status and m.group('data2'):
+            dat = dat + b' ' + m.group('data2')
+        if typ in ('OK', 'NO', 'BAD') and dat:
+            rc = re_response_code.match(dat)
+            if rc:
+                cmd.append(rc.group('type').decode(), rc.group('data'))
+        if isinstance(parts[0], tuple):
+            parts = [(dat, parts[0][1])] + parts[1:]
+        else:
+            parts = [dat] + parts[1:]
+        for p in parts:
+            cmd.append(typ, p)
+
+    async def _command(self, name: str, *args: Union[str, bytes]):
+        await self.connect()
+        self.__tagnum = self.__tagnum + 1
+        tag = self.__prefix + str(self.__tagnum).encode()
+        data = tag + b' ' + name.encode()
+        for arg in args:
+            if arg is None:
+                continue
+            if isinstance(arg, str):
+                arg = arg.encode()
+            data = data + b' ' + arg
+        future = asyncio.get_running_loop().create_future()
+        self.__pending.append(_Command(tag, future))
+        self.__writer.write(data + b'\r\n')
+        await self.__writer.drain()
+        typ, data, untagged = await future
+        cmd = name.split()[-1] if name.startswith("UID") else name
+        if typ != 'OK':
+            exc = AsyncImap.EXC.get(cmd, imaplib.IMAP4.error)
+            raise exc(str(data[0], 'utf-8', 'replace'))
+        return typ, data, untagged
+
+    @staticmethod
+    def _quote(arg: str):
+        arg = arg.replace('\\', '\\\\').replace('"', '\\"')
+        return '"' + arg + '"'
+
+    async def login(self):
+        typ, data, untagged = await self._command(
+            'LOGIN',
+            AsyncImap._quote(self.__config.user),
+            AsyncImap._quote(self.__config.pssw)
+        )
+        self.state = "AUTH"
+        return typ, data
+
+    async def list(self):
+        typ, data, untagged = await self._command('LIST', '""', '*')
+        return tuple(i.decode() for i in untagged.get('LIST', []))
+
+    async def select(self, folder, readonly=False):
+        typ, data, untagged = await self._command(
+            'EXAMINE' if readonly else 'SELECT',
+            folder
+        )
+        self.state = "SELECTED"
+        return typ, untagged.get('EXISTS', [None])
+
+    async def get_ids(self, *criteria: str):
+        typ, data, untagged = await self._command('SEARCH', *criteria)
+        ids: list[bytes] = []
+        for dat in untagged.get('SEARCH', []):
+            if dat:
+                ids.extend(dat.split())
+        return tuple(ids)
+
+    async def fetch(self, msgId, fetch='(RFC822)'):
+        mails = await self.__pop_fetch(deque([(
+            (msgId, ),
+            asyncio.create_task(self._command('FETCH', msgId, fetch))
+        )]))
+        if mails:
+            return mails[0]
+
+    async def fetch_many(
+        self,
+        msgIds,
+        fetch='(RFC822)',
+        chunk_size=200,
+        window=4
+    ):
+        # Se envían hasta `window` FETCH seguidos sin esperar la respuesta
+        # del anterior (pipelining) y se devuelven en el mismo orden
+        chunks = iter_chunks(msgIds, chunk_size)
+        tasks: deque[tuple[tuple, asyncio.Task]] = deque()
+        try:
+            for chunk in chunks:
+                tasks.append((chunk, asyncio.create_task(
+                    self._command('FETCH', to_msg_set(chunk), fetch)
+                )))
+                if len(tasks) < window:
+                    continue
+                for mail in await self.__pop_fetch(tasks):
+                    yield mail
+            while tasks:
+                for mail in await self.__pop_fetch(tasks):
+                    yield mail
+        finally:
+            for chunk, task in tasks:
+                task.cancel()
+
+    async def __pop_fetch(self, tasks: deque) -> tuple[Mail, ...]:
+        chunk, task = tasks.popleft()
+        typ, data, untagged = await task
+        rsp: dict[int, dict] = {}
+        for num, values in parse_fetch(untagged.get('FETCH', [])):
+            rsp.setdefault(num, {}).update(values)
+        mails: list[Mail] = []
+        for msgId in chunk:
+            values = rsp.get(int(msgId), {})
+            body = first_literal(values)
+            if body is None:
+                logger.warning(f"Message {msgId} not found in FETCH")
+                continue
+            uid = values.get('UID')
+            mails.append(Mail.from_bytes(
+                body,
+                id=msgId,
+                uid=int(uid) if uid is not None else None
+            ))
+        return tuple(mails)
+
+    async def search(self, *criteria: str, fetch='(RFC822)', chunk_size=200):
+        ids = await self.get_ids(*criteria)
+        async for mail in self.fetch_many(ids, fetch=fetch,
+                                          chunk_size=chunk_size):
+            yield mail
+
+    async def store(self, msgId, command: str, flags: str):
+        if isinstance(msgId, (tuple, list)):
+            msgId = to_msg_set(msgId)
+        typ, data, untagged = await self._command(
+            'STORE', msgId, command, flags)
+        return typ, untagged.get('FETCH', [])
+
+    async def seen(self, *msgId: str):
+        if msgId:
+            await self.store(msgId, '+FLAGS', '\\Seen')
+
+    async def unseen(self, *msgId: str):
+        if msgId:
+            await self.store(msgId, '-FLAGS', '\\Seen')
+
+    async def delete(self, *msgId: str):
+        if msgId:
+            await self.store(msgId, '+FLAGS', '\\Deleted')
+
+    async def close(self):
+        if self.__writer is None:
+            return
+        try:
+            if self.state == "SELECTED":
+                await self._command('CLOSE')
+                self.state = "AUTH"
+            if self.state in ("AUTH", "NONAUTH"):
+                await self._command('LOGOUT')
+                self.state = "LOGOUT"
+        except imaplib.IMAP4.abort:
+            pass
+        finally:
+            self.__task.cancel()
+            self.__writer.close()
+            self.__writer = None
+
+    async def __aenter__(self):
+        await self.login()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    @staticmethod
+    def dt_search(dt: Union[date, datetime, None] = None):
+        return Imap.dt_search(dt)
+
+    @property
+    def host(self):
+        return self.__config.host
+
+    @property
+    def port(self):
+        return self.__config.port
+
+    @property
+    def user(self):
+        return self.__config.user
@@ -0,0 +1,144 @@
+import sqlite3
+import threading
+import time
+from os import makedirs
+from os.path import dirname
+from typing import Iterable
+
+
+class MailCache:
+    def __init__(self, path: str, max_bytes: int = 1024 * 1024 * 1024):
+        fdir = dirname(path)
+        if fdir:
+            makedirs(fdir, exist_ok=True)
+        self.__max_bytes = max_bytes
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        self.__db.executescript('''
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS mail (
+                account TEXT NOT NULL,
+                folder TEXT NOT NULL,
+                uidvalidity INTEGER NOT NULL,
+                uid INTEGER NOT NULL,
+                fetch TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                atime REAL NOT NULL,
+                data BLOB NOT NULL,
+                PRIMARY KEY (account, folder, uidvalidity, uid, fetch)
+            );
+            CREATE INDEX IF NOT EXISTS mail_atime ON mail (atime);
+        ''')
+        self.__size = self.__db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM mail').fetchone()[0]
+
+    @property
+    def size(self):
+        return self.__size
+
+    def get_many(
+        self,
+        account: str,
+        folder: str,
+        uidvalidity: int,
+        uids: Iterable[int],
+        fetch: str
+    ) -> dict[int, bytes]:
+        uids = tuple(int(u) for u in uids)
+        if len(uids) == 0:
+            return {}
+        sql = '''
+            SELECT uid, data FROM mail
+            WHERE account=? AND folder=? AND uidvalidity=? AND fetch=?
+            AND uid IN ({})
+        '''.format(",".join("?" * len(uids)))
+        with self.__lock:
+            rows = self.__db.execute(
+                sql, (account, folder, uidvalidity, fetch) + uids
+            ).fetchall()
+            if rows:
+                self.__db.execute('''
+                    UPDATE mail SET atime=?
+                    WHERE account=? AND folder=? AND uidvalidity=? AND fetch=?
+                    AND uid IN ({})
+                '''.format(",".join("?" * len(rows))), (
+                    time.time(), account, folder, uidvalidity, fetch
+                ) + tuple(r[0] for r in rows))
+                self.__db.commit()
+        return {uid: data for uid, data in rows}
+
+    def get(self, account, folder, uidvalidity, uid, fetch):
+        return self.get_many(account, folder, uidvalidity, (uid, ), fetch).get(
+            int(uid))
+
+    def put_many(
+        self,
+        account: str,
+        folder: str,
+        uidvalidity: int,
+        items: dict[int, bytes],
+        fetch: str
+    ):
+        if len(items) == 0:
+            return
+        now = time.time()
+        with self.__lock:
+            for uid, data in items.items():
+                old = self.__db.execute('''
+                    SELECT size FROM mail WHERE account=? AND folder=?
+                    AND uidvalidity=? AND uid=? AND fetch=?
+                ''', (
+                    account, folder, uidvalidity, int(uid), fetch
+                )).fetchone()
+                if old:
+                    self.__size = self.__size - old[0]
+                self.__db.execute('''
+                    INSERT OR REPLACE INTO mail
+                    (account, folder, uidvalidity, uid, fetch, size, atime,
+                    data)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    account, folder, uidvalidity, int(uid), fetch,
+                    len(data), now, sqlite3.Binary(data)
+                ))
+                self.__size = self.__size + len(data)
+            self.__evict()
+            self.__db.commit()
+
+    def put(self, account, folder, uidvalidity, uid, fetch, data: bytes):
+        self.put_many(account, folder, uidvalidity, {uid: data}, fetch)
+
+    def __evict(self):
+        if self.__size <= self.__max_bytes:
+            return
+        # Se libera hasta el 90% para no desalojar en cada inserción
+        target = int(self.__max_bytes * 0.9)
+        rows = self.__db.execute(
+            'SELECT rowid, size FROM mail ORDER BY atime').fetchall()
+        ids: list[int] = []
+        for rowid, size in rows:
+            if self.__size <= target:
+                break
+            ids.append(rowid)
+            self.__size = self.__size - size
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            self.__db.execute(
+                'DELETE FROM mail WHERE rowid IN ({})'.format(
+                    ",".join("?" * len(chunk))), chunk)
+
+    def clear(self):
+        with self.__lock:
+            self.__db.execute('DELETE FROM mail')
+            self.__db.commit()
+            self.__size = 0
+
+    def close(self):
+        with self.__lock:
+            self.__db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
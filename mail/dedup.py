@@ -0,0 +1,94 @@
+import hashlib
+import sqlite3
+import threading
+from os import makedirs
+from os.path import dirname
+from typing import Iterable, Union
+
+
+class SeenMessages:
+    BATCH = 1000
+
+    def __init__(self, path: str = None):
+        # Se guarda un hash de 64 bits por Message-ID en lugar del
+        # Message-ID completo para que el conjunto quepa en memoria
+        # incluso con millones de mensajes
+        self.__seen: set[int] = set()
+        self.__pending: list[int] = []
+        self.__lock = threading.Lock()
+        self.__db = None
+        if path is None:
+            return
+        fdir = dirname(path)
+        if fdir:
+            makedirs(fdir, exist_ok=True)
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        self.__db.executescript('''
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS seen (
+                digest INTEGER PRIMARY KEY
+            );
+        ''')
+        for digest, in self.__db.execute('SELECT digest FROM seen'):
+            self.__seen.add(digest)
+
+    @staticmethod
+    def digest(message_id: Union[str, bytes]) -> int:
+        if isinstance(message_id, str):
+            message_id = message_id.encode('utf-8', 'surrogateescape')
+        message_id = message_id.strip()
+        h = hashlib.blake2b(message_id, digest_size=8).digest()
+        # INTEGER de SQLite es de 64 bits con signo
+        return int.from_bytes(h, 'big', signed=True)
+
+    def __contains__(self, message_id: Union[str, bytes]):
+        if not message_id:
+            return False
+        return SeenMessages.digest(message_id) in self.__seen
+
+    def __len__(self):
+        return len(self.__seen)
+
+    def add(self, message_id: Union[str, bytes]):
+        self.add_many((message_id, ))
+
+    def add_many(self, message_ids: Iterable[Union[str, bytes]]):
+        with self.__lock:
+            for message_id in message_ids:
+                if not message_id:
+                    continue
+                digest = SeenMessages.digest(message_id)
+                if digest in self.__seen:
+                    continue
+                self.__seen.add(digest)
+                self.__pending.append(digest)
+            if len(self.__pending) >= SeenMessages.BATCH:
+                self.__flush()
+
+    def flush(self):
+        with self.__lock:
+            self.__flush()
+
+    def __flush(self):
+        if self.__db is None or len(self.__pending) == 0:
+            self.__pending = []
+            return
+        self.__db.executemany(
+            'INSERT OR IGNORE INTO seen (digest) VALUES (?)',
+            ((d, ) for d in self.__pending)
+        )
+        self.__db.commit()
+        self.__pending = []
+
+    def close(self):
+        with self.__lock:
+            self.__flush()
+            if self.__db is not None:
+                self.__db.close()
+                self.__db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -104,22 +104,30 @@ class FetchMail:
                         )
         return tuple(pls)
 
+    def search_items(
+            self,
+            match: FetchMailItem = None) -> Tuple[FetchMailItem]:
+        itm = []
+        for item in self.items:
+            if match is None or match == item.subset(match.fields_filled()):
+                itm.append(item)
+        return tuple(itm)
+
     def search_credentials(
             self,
             match: FetchMailItem = None) -> Tuple[FetchCredentials]:
         crd = []
-        for item in self.items:
-            if match is None or match == item.subset(match.fields_filled()):
-                arr_append(
-                    crd,
-                    FetchCredentials(
-                        protocol=item.protocol,
-                        host=item.host,
-                        port=item.port,
-                        user=item.user,
-                        password=item.password,
-                    )
+        for item in self.search_items(match):
+            arr_append(
+                crd,
+                FetchCredentials(
+                    protocol=item.protocol,
+                    host=item.host,
+                    port=item.port,
+                    user=item.user,
+                    password=item.password,
                 )
+            )
         return tuple(crd)
 
     def get_credential(self, match: FetchMailItem = None) -> FetchCredentials:
@@ -1,25 +1,46 @@
 import imaplib
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from functools import cached_property
 from email import message_from_bytes
+from email.parser import BytesHeaderParser
 from email.header import decode_header
 from email.utils import parseaddr
 from email.message import Message
+import io
 import json
-from typing import Union, Any
-from datetime import datetime, date
+import select
+import zlib
+import ssl
+import time
+from typing import Union, Any, NamedTuple, Iterator, TYPE_CHECKING
+from datetime import datetime, date, timedelta, timezone
 import functools
 import re
-from os.path import join, dirname, isdir
-from os import makedirs
+from os.path import join, dirname, isdir, isfile
+from os import makedirs, replace
 from mail.config import Config
+from mail.imapdata import (
+    to_msg_set, from_msg_set, iter_chunks, parse_fetch, first_literal,
+    parse_bodystructure, BodyPart, StreamDecoder
+)
+from mail.syncstate import SyncState
+from mail.cache import MailCache
+from mail.dedup import SeenMessages
+from mail.readahead import read_ahead
 import logging
 from email.utils import parsedate_to_datetime
 from datetime import datetime
 
+if TYPE_CHECKING:
+    from mail.mimepool import MimePool
+
 
 logger = logging.getLogger(__name__)
 
+imaplib.Commands.setdefault('COMPRESS', ('AUTH', 'SELECTED'))
+
+re_blank = re.compile(r"[^\S\n ]")
+
 
 class SelectException(imaplib.IMAP4.error):
     pass
@@ -49,11 +70,28 @@ class GMailFolderException(imaplib.IMAP4.error):
     pass
 
 
-@dataclass(frozen=True)
-class Attachment:
-    name: str
-    bytes: Any
+class IdleException(imaplib.IMAP4.error):
+    pass
+
 
+class Resync(NamedTuple):
+    flags: dict[int, tuple[str, ...]]
+    vanished: tuple[int, ...]
+    full: bool
+    modseq: int = None
+
+
+class IdleEvent(NamedTuple):
+    type: str
+    num: int
+    data: bytes = None
+
+
+re_idle_event = re.compile(
+    rb'^\* (?P<num>\d+) (?P<type>[A-Z-]+)( (?P<data>.*))?$')
+
+
+class _AttachmentMixin:
     @cached_property
     def content(self):
         ext = self.name.rsplit(".")[-1].lower()
@@ -62,26 +100,62 @@ class Attachment:
             return json.loads(content)
         return self.bytes
 
-    def save(self, target):
+    def _target(self, target):
         if target[-1] in ("/", "\\"):
             target = join(target, self.name)
         fdir = dirname(target)
         if fdir and not isdir(fdir):
             makedirs(fdir)
+        return target
+
+    def save(self, target):
+        target = self._target(target)
         with open(target, "wb") as f:
             f.write(self.bytes)
         return target
 
 
+@dataclass(frozen=True)
+class Attachment(_AttachmentMixin):
+    name: str
+    bytes: Any
+
+
+@dataclass(frozen=True)
+class LazyAttachment(_AttachmentMixin):
+    name: str
+    part: BodyPart = field(repr=False)
+    mail: 'LazyMail' = field(repr=False, compare=False)
+
+    @cached_property
+    def bytes(self):
+        return self.mail.fetch_part(self.part)
+
+    def save(self, target, chunk_size=1024 * 1024):
+        if 'bytes' in self.__dict__:
+            return super().save(target)
+        # Se descarga por trozos y se escribe directamente
+        # en disco para no tener el adjunto entero en memoria
+        target = self._target(target)
+        with open(target, "wb") as f:
+            for data in self.mail.iter_part(self.part, chunk_size):
+                f.write(data)
+        return target
+
+
 @dataclass(frozen=True)
 class Mail:
     msg: Message
     id: str = None
+    uid: int = None
 
     @staticmethod
     def from_bytes(body, *args, **kwargs):
-        mail = message_from_bytes(body)
-        return Mail(mail, *args, **kwargs)
+        return RawMail(*args, raw=body, **kwargs)
+
+    @cached_property
+    def headers(self) -> Message:
+        return self.msg
 
     @cached_property
     def attachments(self):
@@ -106,17 +180,7 @@ class Mail:
 
     @cached_property
     def body(self):
-        body = self.__get_body()
-        if body is None:
-            return None
-        fake_br = re.escape("%$%&·%$·$··&%%$&%$&/")
-        body = body.replace("\n", fake_br)
-        body = re.sub(r"\s", " ", body)
-        body = body.replace(fake_br, "\n")
-        body = body.strip()
-        if len(body) == 0:
-            return None
-        return body
+        return _clean_body(self.__get_body())
 
     def __get_body(self) -> Union[str, None]:
         if not self.msg.is_multipart():
@@ -142,27 +206,260 @@ class Mail:
 
     @cached_property
     def subject(self) -> str:
-        raw_subject = self.msg['Subject']
-        if raw_subject is None:
-            return ""
-        decoded_parts = decode_header(raw_subject)
-        subject_parts = []
-        for part, charset in decoded_parts:
-            if isinstance(part, bytes):
-                part = part.decode(charset or 'utf-8', errors='ignore')
-            subject_parts.append(part)
-        return ''.join(subject_parts)
+        return decode_subject(self.headers['Subject'])
 
     @cached_property
     def sender(self) -> str:
-        return parseaddr(self.msg['From'])[1]
+        return parseaddr(self.headers['From'])[1]
 
     @cached_property
     def sent_date(self) -> datetime | None:
-        raw_date = self.msg['Date']
-        if raw_date is None:
+        return parse_date(self.headers['Date'])
+
+
+def decode_subject(raw_subject: Union[str, None]) -> str:
+    if raw_subject is None:
+        return ""
+    decoded_parts = decode_header(raw_subject)
+    subject_parts = []
+    for part, charset in decoded_parts:
+        if isinstance(part, bytes):
+            part = part.decode(charset or 'utf-8', errors='ignore')
+        subject_parts.append(part)
+    return ''.join(subject_parts)
+
+
+def parse_date(raw_date: Union[str, None]) -> datetime | None:
+    if raw_date is None:
+        return None
+    return parsedate_to_datetime(raw_date)
+
+
+re_header_end = re.compile(rb'\r?\n\r?\n')
+
+
+@dataclass(frozen=True)
+class RawMail(Mail):
+    # Se guardan los bytes y el arbol MIME solo se construye
+    # cuando se accede a msg (body, attachments...)
+    msg: Message = field(init=False, repr=False, compare=False)
+    raw: bytes = field(default=None, repr=False)
+
+    def __getattr__(self, name):
+        if name != 'msg':
+            raise AttributeError(name)
+        msg = message_from_bytes(self.raw)
+        object.__setattr__(self, 'msg', msg)
+        return msg
+
+    @cached_property
+    def headers(self) -> Message:
+        if 'msg' in self.__dict__:
+            return self.msg
+        # Solo el bloque de cabeceras, el cuerpo puede ser enorme
+        end = re_header_end.search(self.raw)
+        head = self.raw if end is None else self.raw[:end.end()]
+        return BytesHeaderParser().parsebytes(head)
+
+
+@dataclass(frozen=True, slots=True)
+class Envelope:
+    FETCH = '(UID ENVELOPE FLAGS RFC822.SIZE INTERNALDATE)'
+
+    id: str = None
+    uid: int = None
+    sender: str = ""
+    subject: str = ""
+    date: datetime = None
+    size: int = None
+    flags: tuple[str, ...] = tuple()
+    message_id: str = None
+
+    @staticmethod
+    def from_fetch(values: dict[str, Any], id=None):
+        env = values.get('ENVELOPE') or []
+        env = env + [None] * (10 - len(env))
+        date = None
+        try:
+            date = parse_date(env[0])
+        except (TypeError, ValueError):
+            pass
+        if date is None and values.get('INTERNALDATE'):
+            date = Envelope.__internaldate(values['INTERNALDATE'])
+        uid = values.get('UID')
+        size = values.get('RFC822.SIZE')
+        return Envelope(
+            id=id,
+            uid=int(uid) if uid is not None else None,
+            sender=Envelope.__address(env[2]),
+            subject=decode_subject(env[1]),
+            date=date,
+            size=int(size) if size is not None else None,
+            flags=tuple(values.get('FLAGS') or ()),
+            message_id=env[9]
+        )
+
+    @staticmethod
+    def __internaldate(value: str):
+        # strptime("%b") depende del locale, los meses de IMAP no
+        m = imaplib.InternalDate.match(f'INTERNALDATE "{value}"'.encode())
+        if m is None:
             return None
-        return parsedate_to_datetime(raw_date)
+        zone = timedelta(
+            hours=int(m.group('zoneh')),
+            minutes=int(m.group('zonem'))
+        )
+        if m.group('zonen') == b'-':
+            zone = -zone
+        try:
+            return datetime(
+                int(m.group('year')),
+                imaplib.Mon2num[m.group('mon')],
+                int(m.group('day')),
+                int(m.group('hour')),
+                int(m.group('min')),
+                int(m.group('sec')),
+                tzinfo=timezone(zone)
+            )
+        except (KeyError, ValueError):
+            return None
+
+    @staticmethod
+    def __address(addrs: list):
+        if not isinstance(addrs, list) or len(addrs) == 0:
+            return ""
+        name, adl, mailbox, host = (addrs[0] + [None] * 4)[:4]
+        if mailbox is None:
+            return ""
+        if host is None:
+            return mailbox
+        return parseaddr(f"{mailbox}@{host}")[1]
+
+
+def _raw_size(mail: Mail):
+    return len(getattr(mail, 'raw', None) or b'')
+
+
+def _parse(mail: Mail):
+    return mail.msg
+
+
+def _clean_body(body: Union[str, None]):
+    if body is None:
+        return None
+    # Cualquier espacio en blanco salvo el salto de linea pasa a ser
+    # un espacio, en una sola pasada y sin tocar los que ya lo son
+    body = re_blank.sub(" ", body)
+    body = body.strip()
+    if len(body) == 0:
+        return None
+    return body
+
+
+@dataclass(frozen=True)
+class LazyMail(Mail):
+    # Solo se descargan las cabeceras y la estructura,
+    # el resto de partes se piden bajo demanda
+    FETCH = '(UID BODY.PEEK[HEADER] BODYSTRUCTURE)'
+
+    structure: BodyPart = field(default=None, repr=False, compare=False)
+    imap: 'Imap' = field(default=None, repr=False, compare=False)
+
+    def fetch_part(self, part: BodyPart, offset=None, length=None) -> bytes:
+        if self.uid is not None:
+            data = self.imap.fetch_section(
+                self.uid, part.section, uid=True,
+                offset=offset, length=length)
+        else:
+            data = self.imap.fetch_section(
+                self.id, part.section,
+                offset=offset, length=length)
+        if offset is not None:
+            return data or b''
+        return part.decode(data or b'')
+
+    def iter_part(self, part: BodyPart, chunk_size=1024 * 1024):
+        decoder = StreamDecoder(part.encoding)
+        offset = 0
+        while True:
+            data = self.fetch_part(part, offset=offset, length=chunk_size)
+            dec = decoder.feed(data)
+            if dec:
+                yield dec
+            if len(data) < chunk_size:
+                break
+            offset = offset + len(data)
+        dec = decoder.flush()
+        if dec:
+            yield dec
+
+    @cached_property
+    def attachments(self):
+        atts: list[LazyAttachment] = []
+        for part in self.structure.walk():
+            if part.is_multipart or part.disposition is None:
+                continue
+            file_name = part.filename
+            if bool(file_name):
+                file_name = decode_header(file_name)[0][0]
+                if not isinstance(file_name, str):
+                    file_name = str(file_name, 'utf-8', 'ignore')
+                atts.append(LazyAttachment(
+                    name=file_name,
+                    part=part,
+                    mail=self
+                ))
+        return tuple(atts)
+
+    @cached_property
+    def body(self):
+        return _clean_body(self.__get_body())
+
+    def __get_body(self) -> Union[str, None]:
+        for part in self.structure.walk():
+            if part.content_type != "text/plain":
+                continue
+            if part.disposition == "attachment":
+                continue
+            body = self.fetch_part(part)
+            if body is None:
+                continue
+            body = body.decode(part.charset or 'utf-8')
+            return body.rstrip()
+
+
+class Traffic(NamedTuple):
+    wire_in: int = 0
+    wire_out: int = 0
+    data_in: int = 0
+    data_out: int = 0
+
+
+class _InflateReader(io.RawIOBase):
+    def __init__(self, file, counter):
+        self.__file = file
+        self.__counter = counter
+        self.__inflate = zlib.decompressobj(-zlib.MAX_WBITS)
+        self.__pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.__pending:
+            raw = self.__file.read1(64 * 1024)
+            if not raw:
+                return 0
+            self.__counter(len(raw))
+            self.__pending = self.__inflate.decompress(raw)
+        size = min(len(b), len(self.__pending))
+        b[:size] = self.__pending[:size]
+        self.__pending = self.__pending[size:]
+        return size
+
+    def close(self):
+        self.__file.close()
+        super().close()
 
 
 def raise_deco(func, exc):
@@ -189,30 +486,165 @@ class IMAP4_SSL(imaplib.IMAP4_SSL):
     }
 
     def __init__(self, *args, **kwargs):
+        self.__traffic = [0, 0, 0, 0]
+        self.__deflate = None
         super().__init__(*args, **kwargs)
         for name, exc in IMAP4_SSL.EXC.items():
             mth = getattr(self, name)
             mth = raise_deco(mth, exc)
             setattr(self, name, mth)
 
+    UID_EXC = {
+        "SEARCH": SearchException,
+        "FETCH": FetchException,
+        "STORE": StoreException
+    }
+
+    def uid(self, command, *args):
+        exc = IMAP4_SSL.UID_EXC.get(command.upper(), imaplib.IMAP4.error)
+        return raise_deco(super().uid, exc)(command, *args)
+
+    @property
+    def traffic(self):
+        return Traffic(*self.__traffic)
+
+    @property
+    def compressed(self):
+        return self.__deflate is not None
+
+    def read(self, size):
+        data = super().read(size)
+        self.__count_in(len(data))
+        return data
+
+    def readline(self):
+        line = super().readline()
+        self.__count_in(len(line))
+        return line
+
+    def __count_in(self, size: int):
+        self.__traffic[2] = self.__traffic[2] + size
+        if self.__deflate is None:
+            self.__traffic[0] = self.__traffic[0] + size
+
+    def __count_wire_in(self, size: int):
+        self.__traffic[0] = self.__traffic[0] + size
+
+    def send(self, data):
+        self.__traffic[3] = self.__traffic[3] + len(data)
+        if self.__deflate is not None:
+            data = self.__deflate.compress(data)
+            data = data + self.__deflate.flush(zlib.Z_SYNC_FLUSH)
+        self.__traffic[1] = self.__traffic[1] + len(data)
+        super().send(data)
+
+    def get_capabilities(self) -> tuple[str, ...]:
+        # Tras el login el servidor puede anunciar más extensiones
+        typ, dat = self.capability()
+        caps = (dat[-1] or b'').decode().upper().split()
+        self.capabilities = tuple(caps)
+        return self.capabilities
+
+    def compress(self, level=zlib.Z_DEFAULT_COMPRESSION):
+        # RFC 4978: a partir del OK todo el tráfico va comprimido
+        # con deflate sin cabeceras zlib
+        if self.__deflate is not None:
+            return True
+        if 'COMPRESS=DEFLATE' not in self.get_capabilities():
+            return False
+        typ, dat = self._simple_command('COMPRESS', 'DEFLATE')
+        if typ != 'OK':
+            logger.warning(f"COMPRESS DEFLATE rejected: {dat}")
+            return False
+        self.__deflate = zlib.compressobj(
+            level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self.file = io.BufferedReader(
+            _InflateReader(self.file, self.__count_wire_in))
+        return True
+
+    def idle_start(self) -> bytes:
+        tag = self._new_tag()
+        self.send(tag + b' IDLE\r\n')
+        while True:
+            line = self._get_line()
+            if line.startswith(b'+'):
+                return tag
+            if line.startswith(tag):
+                raise IdleException(line.decode(errors='replace'))
+
+    def idle_done(self, tag: bytes) -> list[bytes]:
+        self.send(b'DONE\r\n')
+        lines: list[bytes] = []
+        while True:
+            line = self._get_line()
+            if line.startswith(tag):
+                if not line.startswith(tag + b' OK'):
+                    raise IdleException(line.decode(errors='replace'))
+                return lines
+            lines.append(line)
+
+    def idle_wait(self, timeout: float) -> Union[bytes, None]:
+        # No se usa el timeout del socket porque deja inservible
+        # el fichero bufferizado de imaplib
+        end = time.monotonic() + max(timeout, 0)
+        while not self.__has_data():
+            wait = end - time.monotonic()
+            if wait <= 0:
+                return None
+            select.select([self.sock], [], [], wait)
+        return self._get_line()
+
+    def __has_data(self):
+        timeout = self.sock.gettimeout()
+        self.sock.setblocking(False)
+        try:
+            return len(self.file.peek(1)) > 0
+        except (ssl.SSLWantReadError, BlockingIOError):
+            return False
+        finally:
+            self.sock.settimeout(timeout)
+
 
 class Imap:
-    def __init__(self, config: Config):
+    MESSAGE_ID_FETCH = '(UID BODY.PEEK[HEADER.FIELDS (MESSAGE-ID)])'
+
+    def __init__(
+        self,
+        config: Config,
+        cache: MailCache = None,
+        compress=False,
+        ssl_context: ssl.SSLContext = None
+    ):
         if not isinstance(config, Config):
             raise ValueError("Invalid Config")
         self.__config = config
+        self.__ssl_context = ssl_context
+        self.__cache = cache
+        self.__compress = compress
+        self.__folder = None
+        self.__readonly = None
+        self.__uidvalidity = None
+        self.__enabled: set[str] = set()
 
     def login(self):
-        return self.session.login(
+        rt = self.session.login(
             self.__config.user,
             self.__config.pssw
         )
+        if self.__compress and not self.session.compress():
+            logger.info(f"{self.host} does not support COMPRESS=DEFLATE")
+        return rt
+
+    @property
+    def traffic(self) -> Traffic:
+        return self.session.traffic
 
     @cached_property
     def session(self):
         return IMAP4_SSL(
             self.__config.host,
-            self.__config.port
+            self.__config.port,
+            ssl_context=self.__ssl_context
         )
 
     def list(self):
@@ -222,12 +654,120 @@ class Imap:
             arr.append(item.decode())
         return tuple(arr)
 
-    def select(self, folder, readonly=False):
-        return self.session.select(folder, readonly=readonly)
+    def select(self, folder, readonly=False, params: str = None):
+        mailbox = folder if params is None else f'{folder} {params}'
+        rt = self.session.select(mailbox, readonly=readonly)
+        typ, data = self.session.response('UIDVALIDITY')
+        self.__folder = folder
+        self.__readonly = readonly
+        self.__uidvalidity = int(data[-1]) if data[-1] else None
+        return rt
+
+    def resolve_folder(self, folder):
+        return folder
+
+    def is_selected(self, folder, readonly=False):
+        if self.session.state != "SELECTED":
+            return False
+        folder = self.resolve_folder(folder)
+        return (self.__folder, self.__readonly) == (folder, readonly)
+
+    def noop(self):
+        return self.session.noop()
+
+    def idle(self, timeout: float = None, renew: float = 28 * 60, poll=60):
+        end = None if timeout is None else time.monotonic() + timeout
+        # Las capacidades del saludo son las de antes del login
+        if 'IDLE' not in self.capabilities():
+            yield from self.__noop_poll(end, poll)
+            return
+        while end is None or time.monotonic() < end:
+            tag = self.session.idle_start()
+            # Los servidores cortan IDLE a los 29 minutos,
+            # así que se renueva antes
+            renew_at = time.monotonic() + renew
+            lines: list[bytes] = []
+            try:
+                while True:
+                    limit = renew_at if end is None else min(renew_at, end)
+                    line = self.session.idle_wait(limit - time.monotonic())
+                    if line is None:
+                        break
+                    if line.startswith(b'* BYE'):
+                        raise imaplib.IMAP4.abort(
+                            line.decode(errors='replace'))
+                    evt = Imap.__to_idle_event(line)
+                    if evt is not None:
+                        yield evt
+            finally:
+                if self.session.state != 'LOGOUT':
+                    lines = self.session.idle_done(tag)
+            for line in lines:
+                evt = Imap.__to_idle_event(line)
+                if evt is not None:
+                    yield evt
+
+    @staticmethod
+    def __to_idle_event(line: bytes):
+        m = re_idle_event.match(line)
+        if m is None:
+            return None
+        return IdleEvent(
+            type=m.group('type').decode(),
+            num=int(m.group('num')),
+            data=m.group('data')
+        )
+
+    def __noop_poll(self, end: float, poll: float):
+        types = ('EXISTS', 'RECENT', 'EXPUNGE', 'FETCH')
+        # Lo que quedó del SELECT o de comandos anteriores no es nuevo
+        for typ in types:
+            self.session.untagged_responses.pop(typ, None)
+        while True:
+            self.noop()
+            for typ in types:
+                for dat in self.session.untagged_responses.pop(typ, []):
+                    if isinstance(dat, tuple):
+                        dat = dat[0]
+                    num, _, data = dat.partition(b' ')
+                    if num.isdigit():
+                        yield IdleEvent(
+                            type=typ, num=int(num), data=data or None)
+            wait = poll
+            if end is not None:
+                wait = min(wait, end - time.monotonic())
+                if wait <= 0:
+                    return
+            time.sleep(wait)
 
-    def search(self, *criteria: str, fetch='(RFC822)'):
-        for msgId in self.get_ids(*criteria, fetch=fetch):
-            yield self.fetch(msgId, fetch=fetch)
+    def search(
+        self,
+        *criteria: str,
+        fetch='(RFC822)',
+        chunk_size=200,
+        lazy=False,
+        max_buffered_bytes: int = None,
+        pool: 'MimePool' = None
+    ):
+        if lazy:
+            fetch = LazyMail.FETCH
+        ids = self.get_ids(*criteria, fetch=fetch)
+        mails = self.fetch_many(ids, fetch=fetch, chunk_size=chunk_size)
+        if pool is not None:
+            mails = pool.decode(mails)
+        if max_buffered_bytes is None:
+            yield from mails
+            return
+        # Con read-ahead la sesión la usa otro hilo mientras se consume,
+        # así que no se puede ir pidiendo partes bajo demanda
+        if 'BODYSTRUCTURE' in fetch.upper():
+            raise ValueError("read-ahead is not compatible with lazy mails")
+        yield from read_ahead(
+            mails,
+            max_buffered_bytes,
+            size=_raw_size,
+            prepare=_parse if pool is None else None
+        )
 
     def get_ids(self, *criteria: str, fetch='(RFC822)'):
         typ, data = self.session.search(None, *criteria)
@@ -238,20 +778,363 @@ class Imap:
         mail = Mail.from_bytes(messageParts[0][1], id=msgId)
         return mail
 
+    def fetch_many(self, msgIds, fetch='(RFC822)', chunk_size=200, uid=False):
+        for chunk in iter_chunks(msgIds, chunk_size):
+            if self.__use_cache(fetch):
+                yield from self.__fetch_cached(chunk, fetch, uid=uid)
+                continue
+            rsp = self.__fetch_chunk(chunk, fetch, uid=uid)
+            for msgId in chunk:
+                values = rsp.get(int(msgId), {})
+                body = first_literal(values)
+                if body is None:
+                    logger.warning(f"Message {msgId} not found in FETCH")
+                    continue
+                yield self.__to_mail(
+                    body,
+                    values,
+                    id=None if uid else msgId
+                )
+
+    def __use_cache(self, fetch: str):
+        if self.__cache is None or self.__uidvalidity is None:
+            return False
+        return 'BODYSTRUCTURE' not in fetch.upper()
+
+    def __fetch_cached(self, chunk, fetch, uid=False):
+        # El contenido de un mensaje no cambia para un mismo
+        # (UIDVALIDITY, UID) así que se puede servir desde disco
+        if uid:
+            uids = {int(i): int(i) for i in chunk}
+        else:
+            uids = {
+                num: int(values['UID'])
+                for num, values in self.__fetch_chunk(chunk, '(UID)').items()
+                if values.get('UID') is not None
+            }
+        key = (self.account, self.__folder, self.__uidvalidity)
+        cached = self.__cache.get_many(*key, uids.values(), fetch)
+        misses = tuple(u for u in uids.values() if u not in cached)
+        if misses:
+            rsp = self.__fetch_chunk(misses, fetch, uid=True)
+            news: dict[int, bytes] = {}
+            for u, values in rsp.items():
+                body = first_literal(values)
+                if body is not None:
+                    news[u] = body
+            self.__cache.put_many(*key, news, fetch)
+            cached.update(news)
+        for msgId in chunk:
+            msgUid = uids.get(int(msgId))
+            body = cached.get(msgUid)
+            if body is None:
+                logger.warning(f"Message {msgId} not found in FETCH")
+                continue
+            yield self.__to_mail(
+                body,
+                {'UID': msgUid},
+                id=None if uid else msgId
+            )
+
+    def __to_mail(self, body: bytes, values: dict, id=None):
+        uid = values.get('UID')
+        if uid is not None:
+            uid = int(uid)
+        if values.get('BODYSTRUCTURE') is not None:
+            return LazyMail(
+                message_from_bytes(body),
+                id=id,
+                uid=uid,
+                structure=parse_bodystructure(values['BODYSTRUCTURE']),
+                imap=self
+            )
+        return Mail.from_bytes(body, id=id, uid=uid)
+
+    def fetch_section(
+        self,
+        msgId,
+        section: str,
+        uid=False,
+        offset: int = None,
+        length: int = None
+    ):
+        item = f'BODY[{section}]'
+        fetch = f'(BODY.PEEK[{section}])'
+        if offset is not None:
+            item = item + f'<{offset}>'
+            fetch = f'(BODY.PEEK[{section}]<{offset}.{length}>)'
+        if uid:
+            typ, data = self.session.uid('FETCH', str(msgId), fetch)
+        else:
+            typ, data = self.session.fetch(msgId, fetch)
+        for num, values in parse_fetch(data):
+            body = values.get(item)
+            if isinstance(body, str):
+                body = body.encode()
+            if body is not None:
+                return bytes(body)
+
+    def __fetch_chunk(self, chunk, fetch, uid=False):
+        rsp: dict[int, dict] = {}
+        if uid:
+            typ, data = self.session.uid('FETCH', to_msg_set(chunk), fetch)
+        else:
+            typ, data = self.session.fetch(to_msg_set(chunk), fetch)
+        for num, values in parse_fetch(data):
+            if uid:
+                if values.get('UID') is None:
+                    continue
+                num = int(values['UID'])
+            rsp.setdefault(num, {}).update(values)
+        return rsp
+
+    def envelopes(self, *criteria: str, chunk_size=1000):
+        ids = self.get_ids(*criteria)
+        yield from self.fetch_envelopes(ids, chunk_size=chunk_size)
+
+    def fetch_envelopes(self, msgIds, chunk_size=1000, uid=False):
+        for msgId, values in self.fetch_items(
+            msgIds,
+            Envelope.FETCH,
+            chunk_size=chunk_size,
+            uid=uid
+        ):
+            yield Envelope.from_fetch(values, id=None if uid else msgId)
+
+    def fetch_items(self, msgIds, fetch: str, chunk_size=1000, uid=False):
+        for chunk in iter_chunks(msgIds, chunk_size):
+            rsp = self.__fetch_chunk(chunk, fetch, uid=uid)
+            for msgId in chunk:
+                values = rsp.get(int(msgId))
+                if values is None:
+                    logger.warning(f"Message {msgId} not found in FETCH")
+                    continue
+                yield msgId, values
+
+    def search_unique(
+        self,
+        *criteria: str,
+        seen: SeenMessages,
+        fetch='(RFC822)',
+        chunk_size=200,
+        lazy=False
+    ):
+        if lazy:
+            fetch = LazyMail.FETCH
+        ids = self.get_ids(*criteria, fetch=fetch)
+        yield from self.fetch_unique(ids, seen, fetch=fetch,
+                                     chunk_size=chunk_size)
+
+    def fetch_unique(
+        self,
+        msgIds,
+        seen: SeenMessages,
+        fetch='(RFC822)',
+        chunk_size=200,
+        uid=False
+    ):
+        # Primero se pide solo el Message-ID (unos pocos bytes por mensaje)
+        # y se descargan enteros únicamente los que no se han visto antes,
+        # en esta carpeta, en otra o en una ejecución anterior
+        try:
+            for chunk in iter_chunks(msgIds, chunk_size):
+                mids: dict[int, str] = {}
+                batch: set[str] = set()
+                news = []
+                for msgId, values in self.fetch_items(
+                    chunk,
+                    Imap.MESSAGE_ID_FETCH,
+                    chunk_size=chunk_size,
+                    uid=uid
+                ):
+                    mid = Imap.__message_id(values)
+                    if mid is not None:
+                        if mid in batch or mid in seen:
+                            continue
+                        batch.add(mid)
+                        mids[int(msgId)] = mid
+                    news.append(msgId)
+                for mail in self.fetch_many(news, fetch=fetch,
+                                            chunk_size=chunk_size, uid=uid):
+                    yield mail
+                    seen.add(mids.get(int(mail.uid if uid else mail.id)))
+        finally:
+            seen.flush()
+
+    @staticmethod
+    def __message_id(values: dict[str, Any]):
+        hdr = first_literal(values)
+        if not hdr:
+            return None
+        mid = BytesHeaderParser().parsebytes(hdr).get('Message-ID')
+        if mid is None:
+            return None
+        mid = str(mid).strip()
+        return mid or None
+
+    def get_uids(self, *criteria: str):
+        typ, data = self.session.uid('SEARCH', *criteria)
+        return tuple(data[0].split())
+
+    def sync(
+        self,
+        state: SyncState,
+        folder: str = 'INBOX',
+        *criteria: str,
+        fetch='(RFC822)',
+        chunk_size=200,
+        readonly=False,
+        lazy=False
+    ):
+        if lazy:
+            fetch = LazyMail.FETCH
+        self.select(folder, readonly=readonly)
+        last = state.get(self.account, folder)
+        uid = last.uid
+        if last.uidvalidity != self.uidvalidity:
+            uid = 0
+            state.set(self.account, folder, uidvalidity=self.uidvalidity,
+                      uid=0, modseq=None)
+        # UID n:* siempre devuelve al menos el último mensaje
+        # aunque su UID sea menor que n
+        uids = tuple(u for u in self.get_uids(
+            'UID', f'{uid + 1}:*', *criteria) if int(u) > uid)
+        for chunk in iter_chunks(uids, chunk_size):
+            yield from self.fetch_many(chunk, fetch=fetch, uid=True,
+                                       chunk_size=chunk_size)
+            uid = max(uid, *map(int, chunk))
+            state.set(self.account, folder,
+                      uidvalidity=self.uidvalidity, uid=uid)
+            state.save()
+        if len(uids) == 0:
+            state.set(self.account, folder,
+                      uidvalidity=self.uidvalidity, uid=uid)
+            state.save()
+
+    def resync(self, state: SyncState, folder: str = 'INBOX', readonly=True):
+        caps = self.capabilities()
+        qresync = 'QRESYNC' in caps
+        condstore = qresync or 'CONDSTORE' in caps
+        last = state.get(self.account, folder)
+        params = None
+        if qresync and 'QRESYNC' not in self.__enabled:
+            qresync = self.__enable('QRESYNC', caps)
+        if qresync:
+            if last.uidvalidity is not None and last.modseq is not None:
+                params = f'(QRESYNC ({last.uidvalidity} {last.modseq}))'
+        if params is None and condstore:
+            params = '(CONDSTORE)'
+        self.select(folder, readonly=readonly, params=params)
+        typ, data = self.session.response('HIGHESTMODSEQ')
+        modseq = int(data[-1]) if data[-1] else None
+        full = last.uidvalidity != self.uidvalidity or last.modseq is None
+        flags: dict[int, tuple[str, ...]] = {}
+        vanished: tuple[int, ...] = tuple()
+        if full or not condstore:
+            # Sin punto de partida fiable se piden todos los flags
+            full = True
+            typ, data = self.session.uid('FETCH', '1:*', '(FLAGS)')
+        elif params.startswith('(QRESYNC'):
+            # Con QRESYNC los cambios llegan en la propia respuesta al SELECT
+            typ, data = self.session.response('FETCH')
+            typ, van = self.session.response('VANISHED')
+            vanished = Imap.__parse_vanished(van)
+        else:
+            typ, data = self.session.uid(
+                'FETCH', '1:*', '(FLAGS)', f'(CHANGEDSINCE {last.modseq})')
+        for num, values in parse_fetch(data):
+            if values.get('UID') is not None:
+                flags[int(values['UID'])] = tuple(values.get('FLAGS') or ())
+        if full:
+            state.set(self.account, folder, uidvalidity=self.uidvalidity,
+                      uid=0 if last.uidvalidity != self.uidvalidity
+                      else last.uid, modseq=modseq)
+        else:
+            state.set(self.account, folder, modseq=modseq)
+        state.save()
+        return Resync(
+            flags=flags,
+            vanished=vanished,
+            full=full,
+            modseq=modseq
+        )
+
+    def __enable(self, extension: str, caps: tuple[str, ...]):
+        # ENABLE solo es válido en estado AUTH, si hay carpeta
+        # seleccionada hay que salir de ella sin borrar nada
+        if self.session.state == 'SELECTED':
+            if 'UNSELECT' in caps:
+                self.session.unselect()
+            elif self.__readonly:
+                # Abierta con EXAMINE, CLOSE no borra los \Deleted
+                self.session.close()
+            else:
+                logger.info(f"{self.host} can not ENABLE {extension} "
+                            "without UNSELECT")
+                return False
+        self.session.enable(extension)
+        self.__enabled.add(extension)
+        return True
+
+    @staticmethod
+    def __parse_vanished(data: list):
+        uids: list[int] = []
+        for dat in data:
+            if not dat:
+                continue
+            if isinstance(dat, tuple):
+                dat = dat[0]
+            dat = dat.decode().replace('(EARLIER)', '').strip()
+            uids.extend(from_msg_set(dat))
+        return tuple(uids)
+
+    def capabilities(self) -> tuple[str, ...]:
+        return self.session.get_capabilities()
+
     def store(self, *args, **kwargs):
         return self.session.store(*args, **kwargs)
 
-    def seen(self, *msgId: str):
-        for id in msgId:
-            self.store(id, '+FLAGS', '\\Seen')
+    def store_many(
+        self,
+        msgIds,
+        command: str,
+        flags: str,
+        uid=False,
+        silent=False,
+        chunk_size=500,
+        raise_errors=True
+    ):
+        if silent and not command.upper().endswith('.SILENT'):
+            command = command + '.SILENT'
+        failures: list[tuple[str, imaplib.IMAP4.error]] = []
+        for chunk in iter_chunks(msgIds, chunk_size):
+            msg_set = to_msg_set(chunk)
+            try:
+                if uid:
+                    self.session.uid('STORE', msg_set, command, flags)
+                else:
+                    self.session.store(msg_set, command, flags)
+            except StoreException as e:
+                # Se sigue con el resto de trozos y se informa al final
+                logger.warning(f"STORE {msg_set} {command} {flags}: {e}")
+                failures.append((msg_set, e))
+        if failures and raise_errors:
+            exc = StoreException("; ".join(
+                f"{msg_set}: {e}" for msg_set, e in failures
+            ))
+            exc.failures = tuple(failures)
+            raise exc
+        return tuple(failures)
+
+    def seen(self, *msgId: str, uid=False):
+        return self.store_many(msgId, '+FLAGS', '\\Seen', uid=uid, silent=True)
 
-    def unseen(self, *msgId: str):
-        for id in msgId:
-            self.store(id, '-FLAGS', '\\Seen')
+    def unseen(self, *msgId: str, uid=False):
+        return self.store_many(msgId, '-FLAGS', '\\Seen', uid=uid, silent=True)
 
-    def delete(self, *msgId: str):
-        for id in msgId:
-            self.store(id, '+FLAGS', '\\Deleted')
+    def delete(self, *msgId: str, uid=False):
+        return self.store_many(
+            msgId, '+FLAGS', '\\Deleted', uid=uid, silent=True)
 
     def close(self):
         if self.session.state == "SELECTED":
@@ -273,6 +1156,10 @@ class Imap:
         if isinstance(dt, (datetime, date)):
             return dt.strftime("%d-%b-%Y")
 
+    @property
+    def config(self):
+        return self.__config
+
     @property
     def host(self):
         return self.__config.host
@@ -285,27 +1172,60 @@ class Imap:
     def user(self):
         return self.__config.user
 
+    @property
+    def account(self):
+        return f"{self.user}@{self.host}:{self.port}"
+
+    @property
+    def folder(self):
+        return self.__folder
+
+    @property
+    def readonly(self):
+        return self.__readonly
+
+    @property
+    def uidvalidity(self):
+        return self.__uidvalidity
+
 
 class GMail(Imap):
+    ALIAS = ('ALL', 'TRASH')
+
     def __init__(
         self,
-        config: Config
+        config: Config,
+        folders: str = None,
+        **kwargs
     ):
-        super().__init__(config)
+        super().__init__(config, **kwargs)
+        self.__folders = folders
+        self.__cached = False
         if (self.host, self.port) != ('imap.gmail.com', 993):
             logger.warning(
                 "GMail config should have host=imap.gmail.com and port=993")
 
     @cached_property
-    def gmfolders(self):
+    def gmfolders(self) -> dict[str, str]:
+        # Los nombres de [Gmail]/... dependen del idioma de la cuenta
+        # pero no cambian, así que se guardan en disco para no hacer
+        # un LIST en cada arranque
+        data = self.__read_folders()
+        if self.account in data:
+            self.__cached = True
+            return data[self.account]
+        al_folder = self.__list_gmfolders()
+        if self.__folders is not None:
+            data[self.account] = al_folder
+            self.__write_folders(data)
+        return al_folder
+
+    def __list_gmfolders(self):
         def mk_re(flag):
             # _ r'.*(?:\(| )\\All\b.*"/" "([^"]+)"$')
             return re.compile(
                 r'.*(?:\(| )\\' + flag + r'\b.*"/" "(\[Gmail\]/[^"]+)"$')
-        re_folder = {
-            'ALL': mk_re('All'),
-            'TRASH': mk_re('Trash'),
-        }
+        re_folder = {a: mk_re(a.capitalize()) for a in GMail.ALIAS}
         al_folder = {k: set() for k in re_folder.keys()}
         for folder in self.list():
             for alias, re_alias in re_folder.items():
@@ -321,14 +1241,148 @@ class GMail(Imap):
             al_folder[alias] = folders.pop()
         return al_folder
 
+    def __read_folders(self) -> dict[str, dict[str, str]]:
+        if self.__folders is None or not isfile(self.__folders):
+            return {}
+        try:
+            with open(self.__folders, "r") as f:
+                return json.load(f)
+        except ValueError as e:
+            logger.warning(f"Ignoring {self.__folders}: {e}")
+            return {}
+
+    def __write_folders(self, data: dict[str, dict[str, str]]):
+        fdir = dirname(self.__folders)
+        if fdir:
+            makedirs(fdir, exist_ok=True)
+        tmp = self.__folders + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        replace(tmp, self.__folders)
+
+    def forget_gmfolders(self):
+        self.__dict__.pop('gmfolders', None)
+        self.__cached = False
+        data = self.__read_folders()
+        if data.pop(self.account, None) is not None:
+            self.__write_folders(data)
+
     def get_ids(self, search: str, fetch='(RFC822)'):
         search = search.replace('"', r'\"')
         return super().get_ids('X-GM-RAW', '"' + search + '"', fetch=fetch)
 
-    def select(self, folder, readonly=False):
-        folder = self.gmfolders.get(folder, folder)
-        return super().select(folder, readonly=readonly)
+    def resolve_folder(self, folder):
+        return self.gmfolders.get(folder, folder)
+
+    def select(self, folder, readonly=False, params: str = None):
+        try:
+            return super().select(
+                self.resolve_folder(folder),
+                readonly=readonly,
+                params=params
+            )
+        except SelectException:
+            if folder not in GMail.ALIAS or not self.__cached:
+                raise
+            # La carpeta cacheada ya no existe (renombrada o cambio de idioma)
+            self.forget_gmfolders()
+            return super().select(
+                self.resolve_folder(folder),
+                readonly=readonly,
+                params=params
+            )
+
+    def delete(self, *msgId: str, uid=False):
+        return self.store_many(msgId, '+X-GM-LABELS', '\\Trash', uid=uid)
+
+    def fetch_gmids(self, msgIds, chunk_size=1000, uid=False):
+        for msgId, values in self.fetch_items(
+            msgIds,
+            GMailId.FETCH,
+            chunk_size=chunk_size,
+            uid=uid
+        ):
+            yield GMailId.from_fetch(values, id=None if uid else msgId)
+
+    def get_thread_ids(self, thrid: int):
+        return Imap.get_ids(self, 'X-GM-THRID', str(int(thrid)))
+
+    def get_label_ids(self, label: str):
+        label = label.replace('\\', '\\\\').replace('"', r'\"')
+        return Imap.get_ids(self, 'X-GM-LABELS', '"' + label + '"')
+
+    def thread(
+        self,
+        thrid: int,
+        fetch='(RFC822)',
+        chunk_size=200,
+        lazy=False,
+        known: set[int] = None
+    ):
+        ids = self.get_thread_ids(thrid)
+        yield from self.fetch_new(ids, fetch=fetch, chunk_size=chunk_size,
+                                  lazy=lazy, known=known)
+
+    def label(
+        self,
+        label: str,
+        fetch='(RFC822)',
+        chunk_size=200,
+        lazy=False,
+        known: set[int] = None
+    ):
+        ids = self.get_label_ids(label)
+        yield from self.fetch_new(ids, fetch=fetch, chunk_size=chunk_size,
+                                  lazy=lazy, known=known)
+
+    def fetch_new(
+        self,
+        msgIds,
+        fetch='(RFC822)',
+        chunk_size=200,
+        lazy=False,
+        known: set[int] = None
+    ) -> Iterator[tuple['GMailId', Mail]]:
+        # X-GM-MSGID es el mismo en [Gmail]/All Mail y en todas las
+        # etiquetas, así que permite saltar los mensajes que ya tenemos
+        # sin descargarlos
+        if lazy:
+            fetch = LazyMail.FETCH
+        if known is None:
+            known = set()
+        for chunk in iter_chunks(msgIds, chunk_size):
+            gmids: dict[int, GMailId] = {}
+            for gm in self.fetch_gmids(chunk, chunk_size=chunk_size):
+                if gm.msgid in known:
+                    continue
+                known.add(gm.msgid)
+                gmids[int(gm.id)] = gm
+            if len(gmids) == 0:
+                continue
+            news = tuple(i for i in chunk if int(i) in gmids)
+            for mail in self.fetch_many(news, fetch=fetch,
+                                        chunk_size=chunk_size):
+                yield gmids[int(mail.id)], mail
+
 
-    def delete(self, *msgId: str):
-        for id in msgId:
-            self.store(id, '+X-GM-LABELS', '\\Trash')
+class GMailId(NamedTuple):
+    FETCH = '(UID X-GM-MSGID X-GM-THRID X-GM-LABELS)'
+
+    id: str = None
+    uid: int = None
+    msgid: int = None
+    thrid: int = None
+    labels: tuple[str, ...] = tuple()
+
+    @staticmethod
+    def from_fetch(values: dict[str, Any], id=None):
+        def to_int(k):
+            v = values.get(k)
+            return int(v) if v is not None else None
+        return GMailId(
+            id=id,
+            uid=to_int('UID'),
+            msgid=to_int('X-GM-MSGID'),
+            thrid=to_int('X-GM-THRID'),
+            labels=tuple(values.get('X-GM-LABELS') or ())
+        )
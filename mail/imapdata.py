@@ -0,0 +1,305 @@
+import re
+from binascii import a2b_base64, a2b_qp
+from dataclasses import dataclass, field
+from email.utils import collapse_rfc2231_value, decode_rfc2231
+from typing import Iterable, Union, Any
+
+
+re_token = re.compile(
+    rb'\s*(?:'
+    rb'(?P<open>\()|(?P<close>\))|'
+    rb'"(?P<quoted>(?:\\.|[^"\\])*)"|'
+    rb'(?P<atom>(?:[^\s()"\[]+|\[[^\]]*\])+(?:<\d+>)?)'
+    rb')'
+)
+re_literal = re.compile(rb'\{(\d+)\}$')
+re_unquote = re.compile(rb'\\(.)')
+re_no_base64 = re.compile(rb'[^A-Za-z0-9+/=]')
+
+
+_OPEN = object()
+_CLOSE = object()
+
+
+class Literal(bytes):
+    pass
+
+
+def to_msg_set(ids: Iterable[Union[str, bytes, int]]) -> str:
+    nums: list[int] = []
+    for i in ids:
+        if isinstance(i, bytes):
+            i = i.decode()
+        nums.append(int(i))
+    nums = sorted(set(nums))
+    rngs: list[str] = []
+    ini = None
+    prev = None
+    for n in nums:
+        if prev is not None and n == prev + 1:
+            prev = n
+            continue
+        if ini is not None:
+            rngs.append(_rng(ini, prev))
+        ini = prev = n
+    if ini is not None:
+        rngs.append(_rng(ini, prev))
+    return ",".join(rngs)
+
+
+def from_msg_set(msg_set: Union[str, bytes]) -> tuple[int, ...]:
+    if isinstance(msg_set, bytes):
+        msg_set = msg_set.decode()
+    nums: list[int] = []
+    for rng in msg_set.split(","):
+        rng = rng.strip()
+        if not rng:
+            continue
+        ini, _, end = rng.partition(":")
+        ini, end = int(ini), int(end or ini)
+        if ini > end:
+            ini, end = end, ini
+        nums.extend(range(ini, end + 1))
+    return tuple(nums)
+
+
+def _rng(ini: int, end: int):
+    if ini == end:
+        return str(ini)
+    return f"{ini}:{end}"
+
+
+def iter_chunks(ids: Iterable, size: int):
+    if size is None or size < 1:
+        raise ValueError("chunk size must be > 0")
+    chunk = []
+    for i in ids:
+        chunk.append(i)
+        if len(chunk) == size:
+            yield tuple(chunk)
+            chunk = []
+    if chunk:
+        yield tuple(chunk)
+
+
+def _iter_tokens(data: list):
+    for item in data:
+        if item is None:
+            continue
+        if isinstance(item, tuple):
+            text, literal = item
+            m = re_literal.search(text)
+            if m:
+                text = text[:m.start()]
+            yield from _iter_text_tokens(text)
+            yield Literal(literal)
+            continue
+        yield from _iter_text_tokens(item)
+
+
+def _iter_text_tokens(text: bytes):
+    pos = 0
+    size = len(text)
+    while pos < size:
+        m = re_token.match(text, pos)
+        if m is None:
+            if text[pos:].strip():
+                raise ValueError("Unparseable IMAP data: %r" % text[pos:])
+            return
+        pos = m.end()
+        if m.group('open'):
+            yield _OPEN
+        elif m.group('close'):
+            yield _CLOSE
+        elif m.group('quoted') is not None:
+            yield re_unquote.sub(rb'\1', m.group('quoted')).decode(
+                'utf-8', errors='replace')
+        elif m.group('atom') is not None:
+            atom = m.group('atom').decode('utf-8', errors='replace')
+            yield None if atom.upper() == 'NIL' else atom
+
+
+def _build(tokens) -> list:
+    stack: list[list] = [[]]
+    for tk in tokens:
+        if tk is _OPEN:
+            stack.append([])
+        elif tk is _CLOSE:
+            if len(stack) == 1:
+                raise ValueError("Unbalanced IMAP data")
+            lst = stack.pop()
+            stack[-1].append(lst)
+        else:
+            stack[-1].append(tk)
+    if len(stack) != 1:
+        raise ValueError("Unbalanced IMAP data")
+    return stack[0]
+
+
+def parse_data(data: Union[bytes, list]) -> list:
+    if isinstance(data, bytes):
+        data = [data]
+    return _build(_iter_tokens(data))
+
+
+def parse_fetch(data: list) -> list[tuple[int, dict[str, Any]]]:
+    # Convierte la respuesta de imaplib.fetch en
+    # una lista de (numero_secuencia, {ITEM: valor})
+    items = parse_data(data)
+    rsp: list[tuple[int, dict[str, Any]]] = []
+    for i in range(0, len(items) - 1, 2):
+        num, values = items[i], items[i + 1]
+        if not isinstance(values, list):
+            raise ValueError("Unexpected FETCH data: %r" % (values, ))
+        dct = {}
+        for k, v in zip(values[0::2], values[1::2]):
+            dct[k.upper()] = v
+        rsp.append((int(num), dct))
+    return rsp
+
+
+def first_literal(values: dict[str, Any]):
+    for v in values.values():
+        if isinstance(v, Literal):
+            return bytes(v)
+
+
+@dataclass(frozen=True)
+class BodyPart:
+    section: str
+    type: str
+    subtype: str
+    params: dict[str, str] = field(default_factory=dict)
+    encoding: str = None
+    size: int = None
+    disposition: str = None
+    disposition_params: dict[str, str] = field(default_factory=dict)
+    parts: tuple['BodyPart', ...] = tuple()
+
+    @property
+    def content_type(self):
+        return f"{self.type}/{self.subtype}"
+
+    @property
+    def is_multipart(self):
+        return self.type == "multipart"
+
+    @property
+    def charset(self):
+        return self.params.get('charset')
+
+    @property
+    def filename(self):
+        for params, key in (
+            (self.disposition_params, 'filename'),
+            (self.params, 'name')
+        ):
+            if params.get(key + '*'):
+                return collapse_rfc2231_value(
+                    decode_rfc2231(params[key + '*']))
+            if params.get(key):
+                return params[key]
+
+    def walk(self):
+        yield self
+        for p in self.parts:
+            yield from p.walk()
+
+    def decode(self, data: bytes):
+        enc = (self.encoding or '').lower()
+        if enc == 'base64':
+            return a2b_base64(data)
+        if enc == 'quoted-printable':
+            return a2b_qp(data)
+        return data
+
+
+def _params(lst) -> dict[str, str]:
+    if not isinstance(lst, list):
+        return {}
+    return {
+        str(k).lower(): v for k, v in zip(lst[0::2], lst[1::2])
+    }
+
+
+def _disposition(lst):
+    if not isinstance(lst, list) or len(lst) == 0 or lst[0] is None:
+        return None, {}
+    return lst[0].lower(), _params(lst[1] if len(lst) > 1 else None)
+
+
+def _get(lst: list, i: int):
+    if i < len(lst):
+        return lst[i]
+
+
+def parse_bodystructure(lst: list, section: str = None) -> BodyPart:
+    if len(lst) > 0 and isinstance(lst[0], list):
+        parts: list[BodyPart] = []
+        for i, p in enumerate(lst):
+            if not isinstance(p, list):
+                break
+            sub = str(i + 1) if section is None else f"{section}.{i + 1}"
+            parts.append(parse_bodystructure(p, sub))
+        i = len(parts)
+        disp, disp_params = _disposition(_get(lst, i + 2))
+        return BodyPart(
+            section=section or "",
+            type="multipart",
+            subtype=(_get(lst, i) or "mixed").lower(),
+            params=_params(_get(lst, i + 1)),
+            disposition=disp,
+            disposition_params=disp_params,
+            parts=tuple(parts)
+        )
+    typ = (lst[0] or "text").lower()
+    subtype = (lst[1] or "plain").lower()
+    ext = 7
+    if typ == "text":
+        ext = 8
+    elif (typ, subtype) == ("message", "rfc822"):
+        ext = 10
+    disp, disp_params = _disposition(_get(lst, ext + 1))
+    size = _get(lst, 6)
+    return BodyPart(
+        section=section or "1",
+        type=typ,
+        subtype=subtype,
+        params=_params(lst[2]),
+        encoding=(lst[5] or "7bit").lower(),
+        size=int(size) if size is not None else None,
+        disposition=disp,
+        disposition_params=disp_params
+    )
+
+
+class StreamDecoder:
+    def __init__(self, encoding: str = None):
+        self.__encoding = (encoding or '').lower()
+        self.__buffer = b''
+
+    def feed(self, data: bytes) -> bytes:
+        if self.__encoding == 'base64':
+            data = self.__buffer + re_no_base64.sub(b'', data)
+            cut = len(data) - (len(data) % 4)
+            self.__buffer = data[cut:]
+            return a2b_base64(data[:cut])
+        if self.__encoding == 'quoted-printable':
+            # quoted-printable se decodifica por lineas completas
+            # para no partir secuencias =XX ni saltos suaves
+            data = self.__buffer + data
+            cut = data.rfind(b'\n') + 1
+            self.__buffer = data[cut:]
+            return a2b_qp(data[:cut])
+        return data
+
+    def flush(self) -> bytes:
+        data = self.__buffer
+        self.__buffer = b''
+        if self.__encoding == 'base64':
+            if not data:
+                return b''
+            return a2b_base64(data + b'=' * (-len(data) % 4))
+        if self.__encoding == 'quoted-printable':
+            return a2b_qp(data)
+        return data
@@ -0,0 +1,239 @@
+import re
+import sqlite3
+import threading
+import unicodedata
+from datetime import date, datetime, time
+from os import makedirs
+from os.path import dirname
+from typing import Iterable, NamedTuple, Union
+from mail.imap import Imap, Mail
+from mail.syncstate import SyncState
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+re_word = re.compile(r"\w{2,}")
+
+
+def tokenize(text: Union[str, None]) -> set[str]:
+    if not text:
+        return set()
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return set(re_word.findall(text))
+
+
+def _timestamp(dt: Union[date, datetime, None]):
+    if dt is None:
+        return None
+    if not isinstance(dt, datetime):
+        dt = datetime.combine(dt, time.min)
+    return dt.timestamp()
+
+
+class IndexHit(NamedTuple):
+    account: str
+    folder: str
+    uid: int
+
+
+class MailIndex:
+    FIELDS = ('subject', 'body', 'attachment')
+
+    def __init__(self, path: str):
+        fdir = dirname(path)
+        if fdir:
+            makedirs(fdir, exist_ok=True)
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        self.__db.executescript('''
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS mail (
+                id INTEGER PRIMARY KEY,
+                account TEXT NOT NULL,
+                folder TEXT NOT NULL,
+                uidvalidity INTEGER NOT NULL,
+                uid INTEGER NOT NULL,
+                sender TEXT,
+                subject TEXT,
+                date REAL,
+                UNIQUE (account, folder, uidvalidity, uid)
+            );
+            CREATE INDEX IF NOT EXISTS mail_date ON mail (date);
+            CREATE TABLE IF NOT EXISTS token (
+                token TEXT NOT NULL,
+                field TEXT NOT NULL,
+                mail INTEGER NOT NULL,
+                PRIMARY KEY (token, field, mail)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS token_mail ON token (mail);
+        ''')
+
+    def add(
+        self,
+        mail: Mail,
+        account: str,
+        folder: str,
+        uidvalidity: int = None
+    ):
+        self.add_many((mail, ), account, folder, uidvalidity)
+
+    def add_many(
+        self,
+        mails: Iterable[Mail],
+        account: str,
+        folder: str,
+        uidvalidity: int = None
+    ):
+        with self.__lock:
+            self.__purge(account, folder, uidvalidity)
+            for mail in mails:
+                self.__add(mail, account, folder, uidvalidity)
+            self.__db.commit()
+
+    def __purge(self, account: str, folder: str, uidvalidity: int):
+        # Con otro UIDVALIDITY los UID antiguos ya no son válidos
+        self.__db.execute('''
+            DELETE FROM token WHERE mail IN (
+                SELECT id FROM mail WHERE account=? AND folder=?
+                AND uidvalidity != ?
+            )
+        ''', (account, folder, uidvalidity or 0))
+        self.__db.execute('''
+            DELETE FROM mail WHERE account=? AND folder=?
+            AND uidvalidity != ?
+        ''', (account, folder, uidvalidity or 0))
+
+    def __add(self, mail: Mail, account: str, folder: str, uidvalidity: int):
+        if mail.uid is None:
+            raise ValueError("Only mails fetched with UID can be indexed")
+        key = (account, folder, uidvalidity or 0, mail.uid)
+        values = (
+            (mail.sender or "").lower(),
+            mail.subject,
+            _timestamp(mail.sent_date)
+        )
+        row = self.__db.execute('''
+            SELECT id FROM mail
+            WHERE account=? AND folder=? AND uidvalidity=? AND uid=?
+        ''', key).fetchone()
+        if row is None:
+            rowid = self.__db.execute('''
+                INSERT INTO mail
+                (account, folder, uidvalidity, uid, sender, subject, date)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', key + values).lastrowid
+        else:
+            rowid = row[0]
+            self.__db.execute(
+                'UPDATE mail SET sender=?, subject=?, date=? WHERE id=?',
+                values + (rowid, )
+            )
+            self.__db.execute('DELETE FROM token WHERE mail=?', (rowid, ))
+        tokens = {
+            'subject': tokenize(mail.subject),
+            'body': tokenize(mail.body),
+            'attachment': set().union(
+                *(tokenize(a.name) for a in mail.attachments)
+            )
+        }
+        self.__db.executemany(
+            'INSERT OR IGNORE INTO token (token, field, mail) '
+            'VALUES (?, ?, ?)',
+            (
+                (tk, field, rowid)
+                for field, tks in tokens.items() for tk in tks
+            )
+        )
+
+    def search(
+        self,
+        text: str = None,
+        subject: str = None,
+        attachment: str = None,
+        sender: str = None,
+        since: Union[date, datetime] = None,
+        before: Union[date, datetime] = None,
+        account: str = None,
+        folder: str = None
+    ) -> tuple[IndexHit, ...]:
+        where: list[str] = []
+        args: list = []
+        for value, fields in (
+            (text, MailIndex.FIELDS),
+            (subject, ('subject', )),
+            (attachment, ('attachment', )),
+        ):
+            for tk in sorted(tokenize(value)):
+                where.append('''id IN (
+                    SELECT mail FROM token WHERE token=? AND field IN ({})
+                )'''.format(",".join("?" * len(fields))))
+                args.extend((tk, ) + fields)
+        for column, value in (('account', account), ('folder', folder)):
+            if value is not None:
+                where.append(f'{column}=?')
+                args.append(value)
+        if sender:
+            where.append("sender LIKE ? ESCAPE '\\'")
+            value = re.sub(r"([%_\\])", r"\\\1", sender.lower())
+            args.append(f"%{value}%")
+        if since is not None:
+            where.append('date >= ?')
+            args.append(_timestamp(since))
+        if before is not None:
+            where.append('date < ?')
+            args.append(_timestamp(before))
+        sql = 'SELECT account, folder, uid FROM mail'
+        if where:
+            sql = sql + ' WHERE ' + ' AND '.join(where)
+        sql = sql + ' ORDER BY account, folder, uid'
+        with self.__lock:
+            rows = self.__db.execute(sql, args).fetchall()
+        return tuple(IndexHit(*r) for r in rows)
+
+    def update(
+        self,
+        imap: Imap,
+        state: SyncState,
+        folder: str = 'INBOX',
+        *criteria: str,
+        chunk_size=200
+    ):
+        # Solo se piden al servidor los mensajes nuevos (UID > último),
+        # completos y por lotes de chunk_size (con lazy=True el texto
+        # costaría una petición por mensaje). Cada mensaje se confirma
+        # antes de pasar al siguiente para que el estado de SyncState
+        # nunca vaya por delante del indice
+        total = 0
+        for mail in imap.sync(
+            state,
+            folder,
+            *criteria,
+            chunk_size=chunk_size,
+            readonly=True
+        ):
+            with self.__lock:
+                if total == 0:
+                    self.__purge(imap.account, folder, imap.uidvalidity)
+                self.__add(mail, imap.account, folder, imap.uidvalidity)
+                self.__db.commit()
+            total = total + 1
+        if total == 0:
+            # Aunque no haya nada nuevo puede haber cambiado UIDVALIDITY
+            with self.__lock:
+                self.__purge(imap.account, folder, imap.uidvalidity)
+                self.__db.commit()
+        logger.info(f"{total} mails indexed from {imap.account} {folder}")
+        return total
+
+    def close(self):
+        with self.__lock:
+            self.__db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,94 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count
+from typing import Iterable, Iterator, Union
+from mail.imap import Mail, RawMail, Attachment
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('body', 'subject', 'sender', 'sent_date')
+
+
+def _decode(raw: bytes):
+    # Se ejecuta en otro proceso, solo devuelve tipos que se pueden
+    # serializar con pickle
+    try:
+        mail = RawMail(raw=raw)
+        rec = {k: getattr(mail, k) for k in FIELDS}
+        rec['attachments'] = tuple((a.name, a.bytes) for a in mail.attachments)
+        return rec
+    except Exception as e:
+        # En el proceso principal se volverá a intentar al acceder
+        # a la propiedad y ahí saltará el error
+        logger.debug(f"MimePool decode: {e}")
+        return None
+
+
+def _decode_batch(raws: tuple[Union[bytes, None], ...]):
+    return tuple(None if raw is None else _decode(raw) for raw in raws)
+
+
+def _fill(mail: Mail, rec: dict):
+    # Son cached_property, así que basta con rellenar __dict__
+    rec = dict(rec)
+    rec['attachments'] = tuple(
+        Attachment(name=name, bytes=data) for name, data in rec['attachments']
+    )
+    mail.__dict__.update(rec)
+
+
+class MimePool:
+    def __init__(self, workers: int = None, batch: int = 32):
+        if batch < 1:
+            raise ValueError("batch must be > 0")
+        self.__workers = workers or cpu_count() or 1
+        self.__batch = batch
+        self.__executor = ProcessPoolExecutor(max_workers=self.__workers)
+
+    @property
+    def workers(self):
+        return self.__workers
+
+    def decode(self, mails: Iterable[Mail]) -> Iterator[Mail]:
+        # Se mantienen 2 lotes por proceso en vuelo para que ninguno
+        # se quede parado mientras se consume el resultado
+        pending: deque = deque()
+        batch: list[Mail] = []
+        for mail in mails:
+            batch.append(mail)
+            if len(batch) < self.__batch:
+                continue
+            pending.append(self.__submit(batch))
+            batch = []
+            while len(pending) > self.__workers * 2:
+                yield from self.__collect(*pending.popleft())
+        if batch:
+            pending.append(self.__submit(batch))
+        while pending:
+            yield from self.__collect(*pending.popleft())
+
+    def __submit(self, batch: list[Mail]):
+        raws = tuple(
+            m.raw if isinstance(m, RawMail) and 'msg' not in m.__dict__
+            else None
+            for m in batch
+        )
+        return batch, self.__executor.submit(_decode_batch, raws)
+
+    @staticmethod
+    def __collect(batch: list[Mail], future):
+        for mail, rec in zip(batch, future.result()):
+            if rec is not None:
+                _fill(mail, rec)
+            yield mail
+
+    def close(self):
+        self.__executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,114 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Type, Tuple, Iterator
+from mail.config import Config
+from mail.fetchmail import FetchMail, FetchMailItem
+from mail.imap import Imap, Mail
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+
+class MultiPoll:
+    def __init__(
+        self,
+        fetchmail: FetchMail,
+        match: FetchMailItem = None,
+        workers: int = 8,
+        cls: Type[Imap] = Imap,
+        **kwargs
+    ):
+        if workers < 1:
+            raise ValueError("workers must be > 0")
+        self.__fetchmail = fetchmail
+        self.__match = match
+        self.__workers = workers
+        self.__cls = cls
+        self.__kwargs = kwargs
+        self.errors: dict[FetchMailItem, Exception] = {}
+
+    @property
+    def items(self) -> Tuple[FetchMailItem]:
+        itm: dict[tuple, FetchMailItem] = {}
+        for item in self.__fetchmail.search_items(self.__match):
+            if item.protocol != "IMAP":
+                logger.debug(f"Skip {item.protocol} {item.user}@{item.host}")
+                continue
+            # Varios localname pueden apuntar a la misma cuenta
+            key = (item.host, item.port, item.user, item.mailbox)
+            itm.setdefault(key, item)
+        return tuple(itm.values())
+
+    @staticmethod
+    def to_config(item: FetchMailItem):
+        return Config(
+            host=item.host,
+            port=item.port,
+            user=item.user,
+            pssw=item.password
+        )
+
+    def search(
+        self,
+        *criteria: str,
+        fetch='(RFC822)',
+        chunk_size=200,
+        readonly=True,
+        buffer=1000
+    ) -> Iterator[tuple[FetchMailItem, Mail]]:
+        items = self.items
+        self.errors = {}
+        if len(items) == 0:
+            return
+        qu: queue.Queue = queue.Queue(maxsize=buffer)
+        stop = threading.Event()
+
+        def put(obj):
+            while not stop.is_set():
+                try:
+                    qu.put(obj, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def poll(item: FetchMailItem):
+            if stop.is_set():
+                return
+            try:
+                with self.__cls(
+                    self.to_config(item), **self.__kwargs
+                ) as imap:
+                    imap.select(item.mailbox or 'INBOX', readonly=readonly)
+                    for mail in imap.search(
+                        *criteria,
+                        fetch=fetch,
+                        chunk_size=chunk_size
+                    ):
+                        if not put((item, mail)):
+                            return
+            except Exception as e:
+                logger.warning(f"{item.user}@{item.host}: {e}")
+                self.errors[item] = e
+            finally:
+                put(_END)
+
+        workers = min(self.__workers, len(items))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for item in items:
+                executor.submit(poll, item)
+            pending = len(items)
+            try:
+                while pending > 0:
+                    obj = qu.get()
+                    if obj is _END:
+                        pending = pending - 1
+                        continue
+                    yield obj
+            finally:
+                stop.set()
+                executor.shutdown(wait=True, cancel_futures=True)
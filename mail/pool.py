@@ -0,0 +1,176 @@
+import imaplib
+import threading
+import time
+from contextlib import contextmanager
+from typing import Type
+from mail.config import Config
+from mail.imap import Imap
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class _Idle:
+    def __init__(self, imap: Imap):
+        self.imap = imap
+        self.since = time.monotonic()
+
+
+class ImapPool:
+    def __init__(
+        self,
+        max_connections: int = 4,
+        keepalive: float = 300,
+        cls: Type[Imap] = Imap,
+        **kwargs
+    ):
+        if max_connections < 1:
+            raise ValueError("max_connections must be > 0")
+        self.__max = max_connections
+        self.__keepalive = keepalive
+        self.__cls = cls
+        self.__kwargs = kwargs
+        self.__cond = threading.Condition()
+        self.__idle: dict[Config, list[_Idle]] = {}
+        self.__count: dict[Config, int] = {}
+        self.__closed = threading.Event()
+        self.__thread = None
+        if keepalive:
+            self.__thread = threading.Thread(
+                target=self.__keepalive_loop,
+                name="ImapPool-keepalive",
+                daemon=True
+            )
+            self.__thread.start()
+
+    def acquire(self, config: Config, timeout: float = None) -> Imap:
+        if not isinstance(config, Config):
+            raise ValueError("Invalid Config")
+        end = None if timeout is None else time.monotonic() + timeout
+        with self.__cond:
+            while True:
+                if self.__closed.is_set():
+                    raise imaplib.IMAP4.error("ImapPool is closed")
+                idle = self.__idle.get(config)
+                if idle:
+                    item = idle.pop()
+                    break
+                # Gmail y otros rechazan demasiados logins simultáneos
+                if self.__count.get(config, 0) < self.__max:
+                    self.__count[config] = self.__count.get(config, 0) + 1
+                    item = None
+                    break
+                wait = None if end is None else end - time.monotonic()
+                if wait is not None and wait <= 0:
+                    raise TimeoutError(
+                        f"No IMAP session available for {config.user}")
+                self.__cond.wait(wait)
+        if item is not None:
+            if time.monotonic() - item.since < (self.__keepalive or 0):
+                return item.imap
+            if self.__is_alive(item.imap):
+                return item.imap
+            self.__dispose(item.imap)
+        try:
+            imap = self.__cls(config, **self.__kwargs)
+            imap.login()
+            return imap
+        except BaseException:
+            self.__discount(config)
+            raise
+
+    def release(self, imap: Imap, discard=False):
+        config = imap.config
+        if discard or self.__closed.is_set():
+            self.__dispose(imap)
+            self.__discount(config)
+            return
+        with self.__cond:
+            self.__idle.setdefault(config, []).append(_Idle(imap))
+            self.__cond.notify()
+
+    @contextmanager
+    def session(
+        self,
+        config: Config,
+        folder: str = None,
+        readonly=False,
+        timeout: float = None
+    ):
+        imap = self.acquire(config, timeout=timeout)
+        try:
+            if folder is not None and not imap.is_selected(folder, readonly):
+                imap.select(folder, readonly=readonly)
+            yield imap
+        except (imaplib.IMAP4.abort, OSError):
+            self.release(imap, discard=True)
+            raise
+        except BaseException:
+            self.release(imap)
+            raise
+        else:
+            self.release(imap)
+
+    def __discount(self, config: Config):
+        with self.__cond:
+            self.__count[config] = self.__count.get(config, 1) - 1
+            self.__cond.notify()
+
+    @staticmethod
+    def __is_alive(imap: Imap):
+        try:
+            imap.noop()
+            return True
+        except (imaplib.IMAP4.error, OSError) as e:
+            logger.info(f"Dead IMAP session {imap.user}@{imap.host}: {e}")
+            return False
+
+    @staticmethod
+    def __dispose(imap: Imap):
+        try:
+            imap.close()
+        except (imaplib.IMAP4.error, OSError):
+            pass
+        try:
+            imap.session.shutdown()
+        except (imaplib.IMAP4.error, OSError):
+            pass
+
+    def keepalive(self):
+        now = time.monotonic()
+        todo: list[_Idle] = []
+        with self.__cond:
+            for idle in self.__idle.values():
+                for item in list(idle):
+                    if now - item.since >= self.__keepalive:
+                        idle.remove(item)
+                        todo.append(item)
+        for item in todo:
+            if self.__is_alive(item.imap):
+                self.release(item.imap)
+            else:
+                self.release(item.imap, discard=True)
+
+    def __keepalive_loop(self):
+        while not self.__closed.wait(self.__keepalive / 2):
+            try:
+                self.keepalive()
+            except Exception as e:
+                logger.warning(f"ImapPool keepalive: {e}")
+
+    def close(self):
+        self.__closed.set()
+        with self.__cond:
+            items = [i for idle in self.__idle.values() for i in idle]
+            self.__idle.clear()
+            self.__cond.notify_all()
+        for item in items:
+            self.__dispose(item.imap)
+            self.__discount(item.imap.config)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
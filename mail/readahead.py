@@ -0,0 +1,128 @@
+import queue
+import threading
+from typing import Callable, Iterable, Iterator, TypeVar
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+_END = object()
+
+
+class _Error:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class _Budget:
+    def __init__(self, max_bytes: int, stop: threading.Event):
+        self.__max = max_bytes
+        self.__stop = stop
+        self.__used = 0
+        self.__cond = threading.Condition()
+
+    def acquire(self, size: int):
+        with self.__cond:
+            # Siempre se deja pasar al menos un elemento para no
+            # bloquearse con mensajes más grandes que el límite
+            while self.__used > 0 and self.__used + size > self.__max:
+                if self.__stop.is_set():
+                    return False
+                self.__cond.wait(0.5)
+            self.__used = self.__used + size
+            return not self.__stop.is_set()
+
+    def release(self, size: int):
+        with self.__cond:
+            self.__used = self.__used - size
+            self.__cond.notify_all()
+
+    def wake(self):
+        with self.__cond:
+            self.__cond.notify_all()
+
+    def wait_room(self):
+        with self.__cond:
+            while self.__used >= self.__max:
+                if self.__stop.is_set():
+                    return False
+                self.__cond.wait(0.5)
+            return not self.__stop.is_set()
+
+
+def read_ahead(
+    source: Iterable[T],
+    max_buffered_bytes: int,
+    size: Callable[[T], int] = len,
+    prepare: Callable[[T], object] = None
+) -> Iterator[T]:
+    # Un hilo descarga (source), otro prepara (prepare) y el consumidor
+    # recibe los elementos ya preparados. La descarga se detiene cuando
+    # lo pendiente de consumir supera max_buffered_bytes
+    if max_buffered_bytes < 1:
+        raise ValueError("max_buffered_bytes must be > 0")
+    stop = threading.Event()
+    budget = _Budget(max_buffered_bytes, stop)
+    fetched: queue.Queue = queue.Queue()
+    ready: queue.Queue = queue.Queue()
+
+    def produce():
+        it = iter(source)
+        try:
+            while budget.wait_room():
+                obj = next(it, _END)
+                if obj is _END:
+                    break
+                sz = size(obj)
+                if not budget.acquire(sz):
+                    break
+                fetched.put((obj, sz))
+        except BaseException as e:
+            fetched.put(_Error(e))
+        finally:
+            close = getattr(it, 'close', None)
+            if close is not None:
+                close()
+            fetched.put(_END)
+
+    def consume():
+        while True:
+            obj = fetched.get()
+            if obj is _END or isinstance(obj, _Error):
+                ready.put(obj)
+                if obj is _END:
+                    return
+                continue
+            item, sz = obj
+            if prepare is not None and not stop.is_set():
+                try:
+                    prepare(item)
+                except Exception as e:
+                    # El error se repetirá cuando el consumidor
+                    # acceda al elemento, aquí no se pierde nada
+                    logger.debug(f"read_ahead prepare: {e}")
+            ready.put(obj)
+
+    threads = (
+        threading.Thread(target=produce, name="read_ahead-fetch", daemon=True),
+        threading.Thread(target=consume, name="read_ahead-parse", daemon=True),
+    )
+    for t in threads:
+        t.start()
+    try:
+        while True:
+            obj = ready.get()
+            if obj is _END:
+                return
+            if isinstance(obj, _Error):
+                raise obj.error
+            item, sz = obj
+            budget.release(sz)
+            yield item
+    finally:
+        stop.set()
+        budget.wake()
+        for t in threads:
+            t.join()
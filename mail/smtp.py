@@ -1,4 +1,7 @@
+import base64
+import secrets
 import smtplib
+import ssl
 from dataclasses import dataclass
 from os.path import basename
 from email.mime.application import MIMEApplication
@@ -6,12 +9,17 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.utils import COMMASPACE, formatdate
 from functools import cached_property
-from typing import Union, Any
+from typing import Union, Any, Iterable, NamedTuple, Callable
 import json
 from os.path import isfile
 import re
 from mail.config import Config
+import logging
 
+
+logger = logging.getLogger(__name__)
+
+re_dot = re.compile(rb"^\.", re.MULTILINE)
 re_mail = re.compile(r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}")
 
 
@@ -49,6 +57,12 @@ class Mail:
         ))
 
     def to_multipart(self):
+        msg = self.__head()
+        for att in self.iter_attachments():
+            msg.attach(att)
+        return msg
+
+    def __head(self):
         msg = MIMEMultipart()
         if self.frm:
             msg['From'] = self.frm
@@ -62,59 +76,243 @@ class Mail:
 
         if self.body:
             msg.attach(MIMEText(self.body))
-
-        for att in self.iter_attachments():
-            msg.attach(att)
         return msg
 
+    @property
+    def files(self) -> tuple[str, ...]:
+        if not isinstance(self.attachments, tuple):
+            return tuple()
+        return tuple(f for f in self.attachments if isfile(f))
+
     def iter_attachments(self):
-        c_disposition = 'attachment; filename="{}"'
         if isinstance(self.attachments, dict):
             for k, v in self.attachments.items():
-                name = k + ".json"
-                att = MIMEApplication(
-                    json.dumps(v).encode(),
-                    Name=name
-                )
-                att['Content-Disposition'] = c_disposition.format(name)
-                yield att
-        if isinstance(self.attachments, tuple):
-            for att in self.attachments:
-                if isfile(att):
-                    name = basename(att)
-                    with open(att, "rb") as fil:
-                        content = fil.read()
-                    att = MIMEApplication(
-                        content,
-                        Name=name
-                    )
-                    att['Content-Disposition'] = c_disposition.format(name)
-                    yield att
+                yield Mail.__attachment(k + ".json", json.dumps(v).encode())
+        for att in self.files:
+            with open(att, "rb") as fil:
+                content = fil.read()
+            yield Mail.__attachment(basename(att), content)
+
+    @staticmethod
+    def __attachment(name: str, content: bytes):
+        att = MIMEApplication(
+            content,
+            Name=name
+        )
+        att['Content-Disposition'] = 'attachment; filename="{}"'.format(name)
+        return att
+
+    def iter_bytes(self, frm: str = None, chunk_size: int = 57 * 16384):
+        # Igual que to_multipart().as_bytes() pero los ficheros adjuntos
+        # se leen y codifican en base64 por trozos, así nunca están
+        # enteros en memoria
+        msg = self.__head()
+        if msg['From'] is None and frm:
+            msg['From'] = frm
+        if isinstance(self.attachments, dict):
+            for k, v in self.attachments.items():
+                msg.attach(Mail.__attachment(
+                    k + ".json", json.dumps(v).encode()))
+        boundary = "=" * 15 + secrets.token_hex(16) + "=="
+        msg.set_boundary(boundary)
+        policy = msg.policy.clone(linesep="\r\n")
+        head = msg.as_bytes(policy=policy)
+        files = self.files
+        if len(files) == 0:
+            yield head
+            return
+        delimiter = b"--" + boundary.encode()
+        if msg.get_payload():
+            yield head[:head.rindex(delimiter + b"--")]
+        else:
+            yield head[:head.index(b"\r\n\r\n") + 4]
+        # múltiplo de 57 para que cada trozo sean líneas completas de base64
+        chunk_size = max(57, chunk_size - chunk_size % 57)
+        for att in files:
+            part = Mail.__attachment(basename(att), b"")
+            part = part.as_bytes(policy=policy)
+            yield delimiter + b"\r\n" + part[:part.index(b"\r\n\r\n") + 4]
+            empty = True
+            with open(att, "rb") as fil:
+                while True:
+                    data = fil.read(chunk_size)
+                    if not data:
+                        break
+                    empty = False
+                    yield base64.encodebytes(data).replace(b"\n", b"\r\n")
+            if empty:
+                yield b"\r\n"
+        yield delimiter + b"--\r\n"
+
+
+class SendResult(NamedTuple):
+    msg: Union[MIMEMultipart, Mail]
+    refused: dict = {}
+    error: Exception = None
+    # El error fue al conectar, en EHLO o en AUTH, no en el envío
+    connect: bool = False
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def transient(self):
+        # 4xx: el servidor pide que se reintente más tarde
+        if self.error is None:
+            return False
+        if isinstance(self.error, smtplib.SMTPRecipientsRefused):
+            codes = [c for c, m in self.refused.values()]
+            return len(codes) > 0 and all(400 <= c < 500 for c in codes)
+        if isinstance(self.error, smtplib.SMTPResponseException):
+            return 400 <= self.error.smtp_code < 500
+        if isinstance(self.error, smtplib.SMTPServerDisconnected):
+            return True
+        return isinstance(self.error, OSError) and not isinstance(
+            self.error, smtplib.SMTPException)
 
 
 class Smtp:
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, ssl_context: ssl.SSLContext = None):
         if not isinstance(config, Config):
             raise ValueError("Invalid Config")
         self.__config = config
+        self.__ssl_context = ssl_context
+        self.__sent = 0
+        self.__limit = None
+        self.__logged = False
 
     def login(self):
         self.session.login(
             self.__config.user,
             self.__config.pssw
         )
+        self.__logged = True
 
     @cached_property
     def session(self):
         return smtplib.SMTP_SSL(
             self.__config.host,
-            self.__config.port
+            self.__config.port,
+            context=self.__ssl_context
         )
 
     def close(self):
         self.session.close()
 
+    def __session(self):
+        # Tras un 421 la sesión se descarta y, si ya se había hecho
+        # login, el siguiente envío abre otra autenticada
+        if self.__logged and 'session' not in self.__dict__:
+            self.reconnect()
+        return self.session
+
+    def __drop(self):
+        old = self.__dict__.pop('session', None)
+        if old is not None:
+            old.close()
+
     def send(self, msg: Union[MIMEMultipart, Mail]):
+        if isinstance(msg, Mail) and msg.files:
+            return self.send_stream(msg)
+        to_addrs, msg = self.prepare(msg)
+        self.__session()
+        return self.__sendmail(msg['From'], to_addrs, msg.as_string())
+
+    def __sendmail(self, frm: str, to_addrs, data: Union[str, bytes]):
+        session = self.session
+        try:
+            refused = session.sendmail(frm, to_addrs, data)
+        except smtplib.SMTPException:
+            # sendmail cierra la conexión si recibe 421
+            if session.sock is None:
+                self.__drop()
+            raise
+        self.__sent = self.__sent + 1
+        return refused
+
+    def send_stream(self, msg: Mail, chunk_size: int = 1024 * 1024):
+        # Como sendmail pero el mensaje se va generando y enviando por
+        # trozos (BDAT si el servidor anuncia CHUNKING, si no DATA)
+        to_addrs = msg.to_addrs
+        if len(to_addrs) == 0:
+            raise ValueError("to_addrs is empty")
+        frm = msg.frm or self.__config.user
+        session = self.__session()
+        session.ehlo_or_helo_if_needed()
+        code, resp = session.mail(frm)
+        if code != 250:
+            self.__abort(code)
+            raise smtplib.SMTPSenderRefused(code, resp, frm)
+        refused = {}
+        for addr in to_addrs:
+            code, resp = session.rcpt(addr)
+            if code not in (250, 251):
+                refused[addr] = (code, resp)
+            if code == 421:
+                self.__abort(code)
+                raise smtplib.SMTPRecipientsRefused(refused)
+        if len(refused) == len(to_addrs):
+            self.__rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+        chunks = msg.iter_bytes(frm=frm, chunk_size=chunk_size)
+        if session.has_extn('chunking'):
+            code, resp = self.__bdat(chunks, chunk_size)
+        else:
+            code, resp = self.__data(chunks)
+        if code != 250:
+            self.__abort(code)
+            raise smtplib.SMTPDataError(code, resp)
+        self.__sent = self.__sent + 1
+        return refused
+
+    def __abort(self, code: int):
+        if code == 421:
+            self.__drop()
+        else:
+            self.__rset()
+
+    def __bdat(self, chunks: Iterable[bytes], chunk_size: int):
+        session = self.session
+        buf: list[bytes] = []
+        size = 0
+        for data in chunks:
+            buf.append(data)
+            size = size + len(data)
+            if size < chunk_size:
+                continue
+            session.send(b"BDAT %d\r\n" % size + b"".join(buf))
+            code, resp = session.getreply()
+            if code != 250:
+                return code, resp
+            buf = []
+            size = 0
+        session.send(b"BDAT %d LAST\r\n" % size + b"".join(buf))
+        return session.getreply()
+
+    def __data(self, chunks: Iterable[bytes]):
+        session = self.session
+        session.putcmd("data")
+        code, resp = session.getreply()
+        if code != 354:
+            return code, resp
+        bol = True
+        last = b""
+        for data in chunks:
+            if not data:
+                continue
+            out = re_dot.sub(b"..", data)
+            if not bol and data[:1] == b".":
+                out = out[1:]
+            bol = data.endswith(b"\n")
+            last = data[-2:]
+            session.send(out)
+        if last != b"\r\n":
+            session.send(b"\r\n")
+        session.send(b".\r\n")
+        return session.getreply()
+
+    def prepare(self, msg: Union[MIMEMultipart, Mail]):
         to_addrs, msg = self.__prepare_mail(msg)
 
         if len(to_addrs) == 0:
@@ -122,13 +320,132 @@ class Smtp:
 
         if msg['From'] is None:
             msg['From'] = self.__config.user
+        return to_addrs, msg
+
+    def reconnect(self):
+        old = self.__dict__.pop('session', None)
+        if old is not None:
+            try:
+                old.quit()
+            except (smtplib.SMTPException, OSError):
+                old.close()
+        self.__sent = 0
+        try:
+            self.login()
+        except BaseException:
+            self.__dict__.pop('session', None)
+            raise
+
+    def send_many(
+        self,
+        msgs: Iterable[Union[MIMEMultipart, Mail]],
+        max_per_connection: int = None,
+        retries: int = 1
+    ) -> tuple['SendResult', ...]:
+        # Todos los mensajes van por la misma conexión autenticada,
+        # un error en un mensaje no impide enviar los siguientes
+        if max_per_connection is not None:
+            self.__limit = max_per_connection
+        return tuple(self.try_send(msg, retries=retries) for msg in msgs)
 
-        self.session.sendmail(
-            msg['From'],
-            to_addrs,
-            msg.as_string()
+    def try_send(
+        self,
+        msg: Union[MIMEMultipart, Mail],
+        retries: int = 1
+    ) -> 'SendResult':
+        if isinstance(msg, Mail) and msg.files:
+            # Con adjuntos en disco se envía por trozos, sin montar
+            # el mensaje entero en memoria
+            if len(msg.to_addrs) == 0:
+                return SendResult(msg, error=ValueError("to_addrs is empty"))
+            return self.__send_one(msg, lambda: self.send_stream(msg),
+                                   retries)
+        try:
+            to_addrs, mime = self.prepare(msg)
+            data = mime.as_string()
+        except (ValueError, TypeError) as e:
+            return SendResult(msg, error=e)
+        return self.__send_one(
+            msg,
+            lambda: self.__sendmail(mime['From'], to_addrs, data),
+            retries
         )
 
+    def try_send_raw(
+        self,
+        frm: str,
+        to_addrs: tuple[str, ...],
+        data: Union[str, bytes],
+        retries: int = 1
+    ) -> 'SendResult':
+        return self.__send_one(
+            data,
+            lambda: self.__sendmail(frm, to_addrs, data),
+            retries
+        )
+
+    def __send_one(
+        self,
+        msg: Union[MIMEMultipart, Mail, str, bytes],
+        send: Callable[[], dict],
+        retries: int
+    ):
+        error = None
+        for attempt in range(retries + 1):
+            connect = False
+            if 'session' not in self.__dict__ or (
+                self.__limit and self.__sent >= self.__limit
+            ):
+                try:
+                    self.reconnect()
+                except smtplib.SMTPAuthenticationError as e:
+                    return SendResult(msg, error=e, connect=True)
+                except (smtplib.SMTPException, OSError) as e:
+                    logger.info(f"SMTP {self.host} connect: {e}")
+                    error = e
+                    connect = True
+                    continue
+            limited = False
+            try:
+                return SendResult(msg, refused=send())
+            except smtplib.SMTPServerDisconnected as e:
+                error = e
+            except smtplib.SMTPResponseException as e:
+                if e.smtp_code != 421:
+                    self.__rset()
+                    return SendResult(msg, error=e)
+                error = e
+                limited = True
+            except smtplib.SMTPRecipientsRefused as e:
+                self.__rset()
+                return SendResult(msg, refused=e.recipients, error=e)
+            except smtplib.SMTPException as e:
+                self.__rset()
+                return SendResult(msg, error=e)
+            except OSError as e:
+                error = e
+            # 421 o conexión cerrada: se reintenta en una conexión nueva.
+            # Si el servidor respondió 421 tras enviar mensajes por esta
+            # conexión se asume que es su límite y se respeta en adelante
+            self.__drop()
+            if limited and self.__sent > 0 and not (
+                self.__limit and self.__limit <= self.__sent
+            ):
+                self.__limit = self.__sent
+                logger.info(
+                    f"SMTP {self.host} limit {self.__limit} msgs/connection")
+            logger.info(f"SMTP {self.host} reconnect: {error}")
+            self.__sent = 0
+        return SendResult(msg, error=error, connect=connect)
+
+    def __rset(self):
+        if 'session' not in self.__dict__:
+            return
+        try:
+            self.session.rset()
+        except smtplib.SMTPServerDisconnected:
+            self.__dict__.pop('session', None)
+
     def __prepare_mail(self,  msg: Union[MIMEMultipart, Mail]) -> tuple[tuple[str, ...], MIMEMultipart]:
         if isinstance(msg, Mail):
             return msg.to_addrs, msg.to_multipart()
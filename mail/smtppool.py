@@ -0,0 +1,197 @@
+import queue
+import threading
+import time
+from typing import Iterable, Type, Union
+from email.mime.multipart import MIMEMultipart
+from mail.config import Config
+from mail.smtp import Smtp, Mail, SendResult
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, burst: int = 1):
+        if per_minute <= 0:
+            raise ValueError("per_minute must be > 0")
+        self.__max_rate = per_minute / 60
+        self.__min_rate = self.__max_rate / 64
+        self.__rate = self.__max_rate
+        self.__burst = max(1, burst)
+        self.__tokens = float(self.__burst)
+        self.__last = time.monotonic()
+        self.__cond = threading.Condition()
+
+    @property
+    def per_minute(self):
+        return self.__rate * 60
+
+    def __refill(self):
+        now = time.monotonic()
+        self.__tokens = min(
+            self.__burst,
+            self.__tokens + (now - self.__last) * self.__rate
+        )
+        self.__last = now
+
+    def acquire(self, stop: threading.Event = None):
+        with self.__cond:
+            while True:
+                if stop is not None and stop.is_set():
+                    return False
+                self.__refill()
+                if self.__tokens >= 1:
+                    self.__tokens = self.__tokens - 1
+                    return True
+                self.__cond.wait(min(1, (1 - self.__tokens) / self.__rate))
+
+    def penalize(self):
+        # AIMD: ante un 4xx se reduce el ritmo a la mitad...
+        with self.__cond:
+            self.__refill()
+            self.__rate = max(self.__min_rate, self.__rate / 2)
+            self.__tokens = min(self.__tokens, 0)
+
+    def reward(self):
+        # ... y con cada envío correcto se recupera poco a poco
+        with self.__cond:
+            self.__refill()
+            self.__rate = min(
+                self.__max_rate,
+                self.__rate + self.__max_rate / 100
+            )
+
+
+class SmtpPool:
+    def __init__(
+        self,
+        config: Config,
+        connections: int = 4,
+        per_minute: float = None,
+        burst: int = 1,
+        bucket: TokenBucket = None,
+        max_per_connection: int = None,
+        retries: int = 3,
+        backoff: float = 5,
+        max_backoff: float = 300,
+        cls: Type[Smtp] = Smtp,
+        **kwargs
+    ):
+        if not isinstance(config, Config):
+            raise ValueError("Invalid Config")
+        if connections < 1:
+            raise ValueError("connections must be > 0")
+        if bucket is not None and per_minute is not None:
+            raise ValueError("Use per_minute or bucket, not both")
+        self.__config = config
+        self.__connections = connections
+        self.__max_per_connection = max_per_connection
+        self.__retries = retries
+        self.__backoff = backoff
+        self.__max_backoff = max_backoff
+        # Para que varios pools de la misma cuenta no se salten el
+        # límite del servidor se les pasa el mismo bucket
+        self.__bucket = bucket
+        if per_minute is not None:
+            self.__bucket = TokenBucket(per_minute, burst)
+        self.__sessions = [
+            cls(config, **kwargs) for _ in range(connections)
+        ]
+        self.__stop = threading.Event()
+
+    @property
+    def config(self):
+        return self.__config
+
+    @property
+    def bucket(self) -> Union[TokenBucket, None]:
+        return self.__bucket
+
+    @property
+    def per_minute(self) -> Union[float, None]:
+        if self.__bucket is None:
+            return None
+        return self.__bucket.per_minute
+
+    def send_many(
+        self,
+        msgs: Iterable[Union[MIMEMultipart, Mail]]
+    ) -> tuple[SendResult, ...]:
+        msgs = tuple(msgs)
+        results: list[SendResult] = [None] * len(msgs)
+        qu: queue.Queue = queue.Queue()
+        for i, msg in enumerate(msgs):
+            qu.put((i, msg, 0))
+        workers = [
+            threading.Thread(
+                target=self.__work,
+                args=(smtp, qu, results),
+                name=f"SmtpPool-{n}",
+                daemon=True
+            )
+            for n, smtp in enumerate(self.__sessions[:len(msgs)])
+        ]
+        for w in workers:
+            w.start()
+        qu.join()
+        for w in workers:
+            qu.put(_END)
+        for w in workers:
+            w.join()
+        return tuple(results)
+
+    def __work(self, smtp: Smtp, qu: queue.Queue, results: list[SendResult]):
+        while True:
+            item = qu.get()
+            if item is _END:
+                return
+            i, msg, attempt = item
+            try:
+                if self.__stop.is_set() or (
+                    self.__bucket is not None and
+                    not self.__bucket.acquire(self.__stop)
+                ):
+                    results[i] = SendResult(
+                        msg, error=OSError("SmtpPool is closed"))
+                    continue
+                rs = smtp.send_many(
+                    (msg, ), max_per_connection=self.__max_per_connection)[0]
+                results[i] = rs
+                if rs.ok:
+                    if self.__bucket is not None:
+                        self.__bucket.reward()
+                    continue
+                if not rs.transient or attempt >= self.__retries:
+                    continue
+                # 4xx: el servidor está limitando, se baja el ritmo de
+                # todas las sesiones y esta espera antes de reintentar
+                if self.__bucket is not None:
+                    self.__bucket.penalize()
+                wait = min(self.__max_backoff, self.__backoff * 2 ** attempt)
+                logger.info(
+                    f"SMTP {self.__config.host} {rs.error}, retry in {wait}s")
+                if not self.__stop.wait(wait):
+                    qu.put((i, msg, attempt + 1))
+            except Exception as e:
+                results[i] = SendResult(msg, error=e)
+            finally:
+                qu.task_done()
+
+    def close(self):
+        self.__stop.set()
+        for smtp in self.__sessions:
+            if 'session' not in smtp.__dict__:
+                continue
+            try:
+                smtp.close()
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
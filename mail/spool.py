@@ -0,0 +1,313 @@
+import fcntl
+import json
+import threading
+import time
+from os import listdir, makedirs, remove, replace, fsync, getpid
+from os.path import join, isfile, getmtime
+from typing import Iterable, Type, Union
+from email.mime.multipart import MIMEMultipart
+from mail.config import Config
+from mail.smtp import Smtp, Mail, SendResult
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class Spool:
+    def __init__(
+        self,
+        path: str,
+        config: Config,
+        max_attempts: int = 10,
+        backoff: float = 30,
+        max_backoff: float = 3600,
+        poll: float = 60,
+        fsync: bool = False,
+        start: bool = True,
+        cls: Type[Smtp] = Smtp,
+        **kwargs
+    ):
+        # Estructura tipo maildir: se escribe en tmp/ y se mueve a new/
+        # de forma atómica, así un proceso que muere nunca deja un
+        # mensaje a medias en la cola. Los que agotan los intentos o
+        # tienen un error permanente pasan a dead/
+        self.__path = path
+        for d in ('tmp', 'new', 'dead'):
+            makedirs(join(path, d), exist_ok=True)
+        self.__smtp = cls(config, **kwargs)
+        self.__max_attempts = max_attempts
+        self.__backoff = backoff
+        self.__max_backoff = max_backoff
+        self.__poll = poll
+        self.__fsync = fsync
+        self.__seq = 0
+        # Fallos seguidos al conectar y hasta cuándo no se reintenta
+        self.__offline = 0
+        self.__retry_at = 0.0
+        self.__lock = threading.Lock()
+        self.__wake = threading.Event()
+        self.__stop = threading.Event()
+        self.__thread = None
+        self.__lockfile = None
+        self.__clean_tmp()
+        if start:
+            self.start()
+
+    @property
+    def path(self):
+        return self.__path
+
+    def __clean_tmp(self, age: float = 3600):
+        tmp = join(self.__path, 'tmp')
+        for name in listdir(tmp):
+            f = join(tmp, name)
+            try:
+                if time.time() - getmtime(f) > age:
+                    remove(f)
+            except FileNotFoundError:
+                pass
+
+    def __new_id(self):
+        with self.__lock:
+            self.__seq = self.__seq + 1
+            return f"{time.time_ns()}.{getpid()}.{self.__seq}"
+
+    def __write(
+        self,
+        folder: str,
+        name: str,
+        data: Union[bytes, Iterable[bytes]]
+    ):
+        tmp = join(self.__path, 'tmp', name)
+        if isinstance(data, bytes):
+            data = (data, )
+        with open(tmp, "wb") as f:
+            for chunk in data:
+                f.write(chunk)
+            if self.__fsync:
+                f.flush()
+                fsync(f.fileno())
+        replace(tmp, join(self.__path, folder, name))
+
+    def enqueue(self, msg: Union[MIMEMultipart, Mail]) -> str:
+        msg_id = self.__new_id()
+        if isinstance(msg, Mail) and msg.files:
+            # Con ficheros adjuntos se escribe por trozos
+            to_addrs = msg.to_addrs
+            if len(to_addrs) == 0:
+                raise ValueError("to_addrs is empty")
+            frm = msg.frm or self.__smtp.user
+            self.__write('new', msg_id + '.eml', msg.iter_bytes(frm=frm))
+        else:
+            to_addrs, mime = self.__smtp.prepare(msg)
+            frm = mime['From']
+            # as_bytes usa \n, y smtplib solo corrige los finales de
+            # línea cuando el mensaje es str
+            policy = mime.policy.clone(linesep="\r\n")
+            self.__write('new', msg_id + '.eml', mime.as_bytes(policy=policy))
+        # El .json se escribe el último y es el que da el mensaje por
+        # encolado, un .eml sin .json se ignora
+        self.__write_meta('new', msg_id, {
+            'from': frm,
+            'to': list(to_addrs),
+            'attempts': 0,
+            'next': time.time(),
+            'error': None
+        })
+        self.__wake.set()
+        return msg_id
+
+    def __write_meta(self, folder: str, msg_id: str, meta: dict):
+        self.__write(folder, msg_id + '.json', json.dumps(meta).encode())
+
+    def __read_meta(self, folder: str, msg_id: str):
+        with open(join(self.__path, folder, msg_id + '.json'), "r") as f:
+            return json.load(f)
+
+    def __ids(self, folder: str):
+        return tuple(sorted(
+            n[:-5] for n in listdir(join(self.__path, folder))
+            if n.endswith('.json')
+        ))
+
+    @property
+    def pending(self) -> tuple[str, ...]:
+        return self.__ids('new')
+
+    @property
+    def dead(self) -> tuple[str, ...]:
+        return self.__ids('dead')
+
+    def error(self, msg_id: str) -> Union[str, None]:
+        for folder in ('dead', 'new'):
+            if isfile(join(self.__path, folder, msg_id + '.json')):
+                return self.__read_meta(folder, msg_id).get('error')
+
+    def requeue(self, msg_id: str):
+        # Como al encolar, el .json se quita el primero y se escribe
+        # el último: si el proceso muere a medias solo queda un .eml
+        # suelto que se ignora
+        meta = self.__read_meta('dead', msg_id)
+        meta.update(attempts=0, next=time.time())
+        remove(join(self.__path, 'dead', msg_id + '.json'))
+        replace(
+            join(self.__path, 'dead', msg_id + '.eml'),
+            join(self.__path, 'new', msg_id + '.eml')
+        )
+        self.__write_meta('new', msg_id, meta)
+        self.__wake.set()
+
+    def deliver(self) -> Union[float, None]:
+        # Intenta enviar todo lo que toca ahora. Devuelve los segundos
+        # que faltan para el siguiente reintento (None si no queda nada)
+        due: list[tuple[float, str, dict]] = []
+        wait = None
+        now = time.time()
+        if now < self.__retry_at:
+            return self.__retry_at - now
+        for msg_id in self.pending:
+            try:
+                meta = self.__read_meta('new', msg_id)
+            except (FileNotFoundError, ValueError):
+                continue
+            if meta['next'] <= now:
+                due.append((meta['next'], msg_id, meta))
+            else:
+                wait = min(wait or meta['next'], meta['next'])
+        for nxt, msg_id, meta in sorted(due):
+            if self.__stop.is_set():
+                break
+            eml = join(self.__path, 'new', msg_id + '.eml')
+            try:
+                with open(eml, "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                # Restos de un proceso que murió a medias
+                logger.warning(f"Spool {msg_id} has no .eml, dropped")
+                self.__remove('new', msg_id + '.json')
+                continue
+            rs = self.__smtp.try_send_raw(meta['from'], meta['to'], data)
+            if rs.connect:
+                return self.__down(msg_id, meta, rs)
+            self.__offline = 0
+            nxt = self.__done(msg_id, meta, rs)
+            if nxt is not None:
+                wait = min(wait or nxt, nxt)
+        if wait is None and 'session' in self.__smtp.__dict__:
+            # Cola vacía: no se mantiene la conexión abierta
+            try:
+                self.__smtp.close()
+            except OSError:
+                pass
+            self.__smtp.__dict__.pop('session', None)
+        if wait is None:
+            return None
+        return max(0, wait - time.time())
+
+    def __down(self, msg_id: str, meta: dict, rs: SendResult):
+        # Fallo al conectar, en EHLO o en AUTH: el mensaje no tiene la
+        # culpa, así que se queda en new/ sin gastar intentos y se
+        # espera antes de volver a probar con toda la cola
+        self.__offline = self.__offline + 1
+        delay = min(
+            self.__max_backoff,
+            self.__backoff * 2 ** (self.__offline - 1)
+        )
+        self.__retry_at = time.time() + delay
+        meta['error'] = str(rs.error)
+        self.__write_meta('new', msg_id, meta)
+        logger.warning(
+            f"Spool {self.__path} retry in {delay}s: {rs.error}")
+        return delay
+
+    def __done(self, msg_id: str, meta: dict, rs: SendResult):
+        if rs.ok:
+            if rs.refused:
+                logger.warning(f"Spool {msg_id} refused {rs.refused}")
+            remove(join(self.__path, 'new', msg_id + '.json'))
+            remove(join(self.__path, 'new', msg_id + '.eml'))
+            return None
+        meta['attempts'] = meta['attempts'] + 1
+        meta['error'] = str(rs.error)
+        if rs.transient and meta['attempts'] < self.__max_attempts:
+            delay = min(
+                self.__max_backoff,
+                self.__backoff * 2 ** (meta['attempts'] - 1)
+            )
+            meta['next'] = time.time() + delay
+            self.__write_meta('new', msg_id, meta)
+            logger.info(f"Spool {msg_id} retry in {delay}s: {rs.error}")
+            return meta['next']
+        logger.warning(f"Spool {msg_id} dead: {rs.error}")
+        remove(join(self.__path, 'new', msg_id + '.json'))
+        replace(
+            join(self.__path, 'new', msg_id + '.eml'),
+            join(self.__path, 'dead', msg_id + '.eml')
+        )
+        self.__write_meta('dead', msg_id, meta)
+        return None
+
+    def __remove(self, folder: str, name: str):
+        try:
+            remove(join(self.__path, folder, name))
+        except FileNotFoundError:
+            pass
+
+    def start(self):
+        if self.__thread is not None:
+            return True
+        # Solo un proceso entrega desde el mismo spool, el resto
+        # únicamente encola
+        lockfile = open(join(self.__path, 'lock'), "w")
+        try:
+            fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lockfile.close()
+            logger.info(f"Spool {self.__path} is delivered by other process")
+            return False
+        self.__lockfile = lockfile
+        self.__stop.clear()
+        self.__thread = threading.Thread(
+            target=self.__run,
+            name="Spool-deliver",
+            daemon=True
+        )
+        self.__thread.start()
+        return True
+
+    def __run(self):
+        while not self.__stop.is_set():
+            self.__wake.clear()
+            try:
+                wait = self.deliver()
+            except Exception as e:
+                logger.warning(f"Spool {self.__path}: {e}")
+                wait = self.__poll
+            if wait is None or wait > self.__poll:
+                wait = self.__poll
+            self.__wake.wait(wait)
+
+    def stop(self, timeout: float = None):
+        self.__stop.set()
+        self.__wake.set()
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+            self.__thread = None
+        if self.__lockfile is not None:
+            self.__lockfile.close()
+            self.__lockfile = None
+
+    def close(self):
+        self.stop()
+        if 'session' in self.__smtp.__dict__:
+            try:
+                self.__smtp.close()
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,45 @@
+import json
+from os import makedirs, replace
+from os.path import dirname, isfile
+from typing import NamedTuple
+
+
+class FolderState(NamedTuple):
+    uidvalidity: int = None
+    uid: int = 0
+    modseq: int = None
+
+
+class SyncState:
+    def __init__(self, path: str):
+        self.__path = path
+        self.__data: dict[str, dict[str, dict]] = {}
+        if isfile(path):
+            with open(path, "r") as f:
+                self.__data = json.load(f)
+
+    @property
+    def path(self):
+        return self.__path
+
+    def get(self, account: str, folder: str) -> FolderState:
+        obj = self.__data.get(account, {}).get(folder)
+        if obj is None:
+            return FolderState()
+        return FolderState(**obj)
+
+    def set(self, account: str, folder: str, **kwargs):
+        obj = self.get(account, folder)._replace(**kwargs)
+        self.__data.setdefault(account, {})[folder] = obj._asdict()
+        return obj
+
+    def save(self):
+        fdir = dirname(self.__path)
+        if fdir:
+            makedirs(fdir, exist_ok=True)
+        # Escritura atómica para no corromper el estado
+        # si el proceso muere a mitad
+        tmp = self.__path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.__data, f, indent=1, sort_keys=True)
+        replace(tmp, self.__path)
@@ -0,0 +1,99 @@
+import random
+import re
+import sys
+import timeit
+from email import message_from_bytes
+from email.message import Message
+from pathlib import Path
+from mail.imap import _clean_body
+
+
+WORDS = (
+    "Hola", "mundo", "newsletter", "oferta", "descuento", "clic", "aquí",
+    "café", "precio", "€", "https://example.com/unsubscribe?id=12345",
+    "=====", "Dear", "customer", "order", "#12345", "shipped", "—", "…",
+)
+SEPARATORS = (
+    " ", " ", " ", " ", "  ", "\r\n", "\n", "\n\n", "\t", "\xa0",
+    " ", " ", "\x0c", "\r\n\r\n", " \r\n",
+)
+
+
+def reference(body):
+    # Implementación original, se usa para comprobar que
+    # la salida no cambia
+    if body is None:
+        return None
+    fake_br = re.escape("%$%&·%$·$··&%%$&%$&/")
+    body = body.replace("\n", fake_br)
+    body = re.sub(r"\s", " ", body)
+    body = body.replace(fake_br, "\n")
+    body = body.strip()
+    if len(body) == 0:
+        return None
+    return body
+
+
+def synthetic(size: int, seed: int):
+    rnd = random.Random(seed)
+    arr: list[str] = []
+    total = 0
+    while total < size:
+        w = rnd.choice(WORDS) + rnd.choice(SEPARATORS)
+        arr.append(w)
+        total = total + len(w)
+    return "".join(arr)
+
+
+def text_plain(msg: Message):
+    for part in msg.walk():
+        if part.get_content_type() != "text/plain":
+            continue
+        body = part.get_payload(decode=True)
+        if body:
+            return body.decode(
+                part.get_content_charset() or 'utf-8', 'replace')
+
+
+def corpus(paths: list[str]):
+    bodies: list[str] = []
+    for p in map(Path, paths):
+        files = sorted(p.rglob("*.eml")) if p.is_dir() else [p]
+        for f in files:
+            body = text_plain(message_from_bytes(f.read_bytes()))
+            if body:
+                bodies.append(body)
+    if bodies:
+        return bodies
+    sizes = (200, 2_000, 20_000, 200_000)
+    return [synthetic(s, i) for i, s in enumerate(sizes * 25)]
+
+
+def bench(name, fn, bodies, number):
+    size = sum(len(b) for b in bodies)
+    sec = min(timeit.repeat(
+        lambda: [fn(b) for b in bodies],
+        number=number,
+        repeat=5
+    )) / number
+    print("%-10s %10.0f msgs/s %8.1f MB/s" % (
+        name,
+        len(bodies) / sec,
+        size / sec / 1024 / 1024
+    ))
+    return sec
+
+
+def main(*paths: str):
+    bodies = corpus(list(paths))
+    for b in bodies:
+        if reference(b) != _clean_body(b):
+            sys.exit("Output differs from reference implementation")
+    print(f"{len(bodies)} bodies, {sum(len(b) for b in bodies)} chars")
+    ref = bench("reference", reference, bodies, 3)
+    new = bench("current", _clean_body, bodies, 3)
+    print("speedup x%.2f" % (ref / new))
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
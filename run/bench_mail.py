@@ -0,0 +1,214 @@
+import argparse
+import json
+import multiprocessing
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import NamedTuple
+from mail.config import Config
+from mail.imap import Imap
+from mail.mimepool import MimePool
+from mail.smtp import Smtp, Mail as SmtpMail
+from mail.smtppool import SmtpPool
+from run.fakeserver import (
+    Mix, mailbox, make_cert, client_context, server_context,
+    FakeImapServer, FakeSmtpServer
+)
+
+
+class Result(NamedTuple):
+    name: str
+    msgs: int
+    bytes: int
+    seconds: float
+    peak: int
+
+    def __str__(self):
+        return "%-10s %7d msgs %9.0f msgs/s %8.2f MB/s %8.1f MB peak" % (
+            self.name,
+            self.msgs,
+            self.msgs / self.seconds,
+            self.bytes / self.seconds / 1024 / 1024,
+            self.peak / 1024 / 1024
+        )
+
+
+class Stage:
+    # tracemalloc ralentiza el código medido, con memory=False
+    # los tiempos son más fiables pero no hay pico de memoria
+    memory = True
+
+    def __init__(self, name: str, results: list[Result]):
+        self.name = name
+        self.results = results
+        self.msgs = 0
+        self.bytes = 0
+
+    def __enter__(self):
+        if Stage.memory:
+            tracemalloc.start()
+        self.ini = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        sec = time.perf_counter() - self.ini
+        peak = 0
+        if Stage.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        if exc_type is None:
+            rs = Result(self.name, self.msgs, self.bytes, sec, peak)
+            self.results.append(rs)
+            print(rs)
+
+
+def serve(args: argparse.Namespace, cert: str, key: str, qu):
+    # Los servidores van en otro proceso para que su CPU y su memoria
+    # no se mezclen con las del cliente que se está midiendo
+    ctx = server_context(cert, key)
+    mails = mailbox(args.messages, args.size, args.mix,
+                    args.attachment_size, seed=args.seed)
+    imap = FakeImapServer(ctx, mails)
+    smtp = FakeSmtpServer(ctx)
+    for srv in (imap, smtp):
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+    qu.put((imap.port, smtp.port, sum(len(m) for m in mails)))
+    qu.get()
+
+
+def run(args: argparse.Namespace, imap_port: int, smtp_port: int, size: int):
+    results: list[Result] = []
+    ctx = client_context()
+    imap = Imap(
+        Config(host="127.0.0.1", port=imap_port, user="u", pssw="p"),
+        ssl_context=ctx
+    )
+    with imap:
+        imap.select("INBOX")
+        with Stage("search", results) as st:
+            ids = imap.get_ids("ALL")
+            st.msgs = len(ids)
+        with Stage("fetch", results) as st:
+            mails = list(imap.fetch_many(ids, chunk_size=args.chunk_size))
+            st.msgs = len(mails)
+            st.bytes = size
+        with Stage("parse", results) as st:
+            for m in mails:
+                m.body
+                m.attachments
+            st.msgs = len(mails)
+            st.bytes = size
+        pool = MimePool(args.workers) if args.workers else None
+        with Stage("pipeline", results) as st:
+            # search + fetch + parse solapando red y parseo
+            for m in imap.search(
+                "ALL",
+                chunk_size=args.chunk_size,
+                max_buffered_bytes=args.read_ahead,
+                pool=pool
+            ):
+                m.body
+                m.attachments
+                st.msgs = st.msgs + 1
+            st.bytes = size
+        if pool is not None:
+            pool.close()
+        with Stage("flags", results) as st:
+            imap.seen(*ids)
+            imap.unseen(*ids)
+            st.msgs = len(ids) * 2
+    smtp = Smtp(
+        Config(host="127.0.0.1", port=smtp_port, user="u", pssw="p"),
+        ssl_context=ctx
+    )
+    with smtp:
+        with Stage("send", results) as st:
+            for m in mails[:args.send]:
+                smtp.send(SmtpMail(
+                    to="dest@example.com",
+                    frm="user@example.com",
+                    subject=m.subject,
+                    body=m.body
+                ))
+                st.msgs = st.msgs + 1
+                st.bytes = st.bytes + len(m.body or "")
+        with Stage("send_many", results) as st:
+            rs = smtp.send_many(SmtpMail(
+                to="dest@example.com",
+                frm="user@example.com",
+                subject=m.subject,
+                body=m.body
+            ) for m in mails[:args.send])
+            st.msgs = sum(1 for r in rs if r.ok)
+            st.bytes = sum(len(m.body or "") for m in mails[:args.send])
+    with SmtpPool(
+        Config(host="127.0.0.1", port=smtp_port, user="u", pssw="p"),
+        connections=args.connections,
+        ssl_context=ctx
+    ) as pool:
+        with Stage("smtp_pool", results) as st:
+            rs = pool.send_many(SmtpMail(
+                to="dest@example.com",
+                frm="user@example.com",
+                subject=m.subject,
+                body=m.body
+            ) for m in mails[:args.send])
+            st.msgs = sum(1 for r in rs if r.ok)
+            st.bytes = sum(len(m.body or "") for m in mails[:args.send])
+    return results
+
+
+def main(*argv: str):
+    parser = argparse.ArgumentParser(
+        prog="run/run.sh bench_mail",
+        description="Benchmark against local fake IMAP and SMTP servers"
+    )
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--size", type=int, default=5000,
+                        help="approximate text size of each message")
+    parser.add_argument("--attachment-size", type=int, default=100_000)
+    parser.add_argument("--mix", type=Mix.parse, default=Mix(),
+                        help="plain=6,html=3,attach=1")
+    parser.add_argument("--chunk-size", type=int, default=200)
+    parser.add_argument("--send", type=int, default=100,
+                        help="number of messages sent by SMTP")
+    parser.add_argument("--read-ahead", type=int, default=None,
+                        help="max_buffered_bytes of the pipeline stage")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="decode MIME in a pool of N processes")
+    parser.add_argument("--connections", type=int, default=4,
+                        help="SMTP sessions of the smtp_pool stage")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-memory", action="store_true",
+                        help="do not trace peak memory")
+    parser.add_argument("--json", help="append results to this file")
+    args = parser.parse_args(argv)
+    Stage.memory = not args.no_memory
+    with tempfile.TemporaryDirectory() as tmp:
+        cert, key = make_cert(tmp)
+        qu = multiprocessing.Queue()
+        proc = multiprocessing.Process(
+            target=serve, args=(args, cert, key, qu), daemon=True)
+        proc.start()
+        imap_port, smtp_port, size = qu.get(timeout=120)
+        try:
+            results = run(args, imap_port, smtp_port, size)
+        finally:
+            proc.terminate()
+            proc.join()
+    if args.json:
+        with open(args.json, "a") as f:
+            f.write(json.dumps({
+                "time": time.time(),
+                "args": {
+                    k: (v._asdict() if isinstance(v, Mix) else v)
+                    for k, v in vars(args).items() if k != "json"
+                },
+                "results": [r._asdict() for r in results]
+            }) + "\n")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,682 @@
+import io
+import random
+import re
+import select
+import socketserver
+import ssl
+import subprocess
+import tempfile
+import threading
+import zlib
+from email.message import Message
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.parser import BytesHeaderParser
+from email.utils import formatdate, make_msgid
+from os.path import join
+from typing import BinaryIO, NamedTuple
+
+
+WORDS = (
+    "Hola", "mundo", "newsletter", "oferta", "descuento", "clic", "aquí",
+    "café", "precio", "€", "Dear", "customer", "order", "#12345", "shipped",
+)
+
+re_fetch_item = re.compile(
+    r'BODY(?:\.PEEK)?\[[^\]]*\](?:<\d+\.\d+>)?|[A-Z0-9.\-]+')
+re_fetch_part = re.compile(
+    r'BODY(?:\.PEEK)?\[(?P<section>[^\]]*)\](?:<(?P<ini>\d+)\.(?P<len>\d+)>)?')
+re_section = re.compile(r'\d+(?:\.\d+)*')
+re_mailbox = re.compile(r'"((?:[^"\\]|\\.)*)"|(\S+)')
+re_gm_search = re.compile(
+    r'(X-GM-THRID|X-GM-LABELS|X-GM-RAW) (?:"((?:[^"\\]|\\.)*)"|(\S+))',
+    re.I)
+re_unescape = re.compile(r'\\(.)')
+re_header_field = re.compile(rb'[^\r\n]+\r\n(?:[ \t][^\r\n]*\r\n)*')
+re_changedsince = re.compile(r'\s*\(CHANGEDSINCE (\d+)\)$', re.I)
+re_qresync = re.compile(r'\(QRESYNC \((\d+) (\d+)', re.I)
+
+
+def make_cert(path: str):
+    # Certificado autofirmado solo para las pruebas locales
+    cert = join(path, "cert.pem")
+    key = join(path, "key.pem")
+    subprocess.run([
+        "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+        "-keyout", key, "-out", cert, "-days", "1", "-subj", "/CN=localhost"
+    ], check=True, capture_output=True)
+    return cert, key
+
+
+def client_context():
+    ctx = ssl.create_default_context()
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    return ctx
+
+
+def server_context(cert: str, key: str):
+    ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    ctx.load_cert_chain(cert, key)
+    return ctx
+
+
+class Mix(NamedTuple):
+    plain: int = 6
+    html: int = 3
+    attach: int = 1
+
+    @staticmethod
+    def parse(value: str):
+        obj = {}
+        for kv in value.split(","):
+            k, v = kv.split("=")
+            obj[k.strip()] = int(v)
+        return Mix(**obj)
+
+
+def text(rnd: random.Random, size: int):
+    arr: list[str] = []
+    total = 0
+    while total < size:
+        w = rnd.choice(WORDS) + rnd.choice((" ", " ", " ", "\n"))
+        arr.append(w)
+        total = total + len(w)
+    return "".join(arr)
+
+
+def mailbox(count: int, size: int, mix: Mix, attachment_size: int, seed=1):
+    rnd = random.Random(seed)
+    kinds = [k for k, n in mix._asdict().items() for _ in range(n)]
+    mails: list[bytes] = []
+    for i in range(count):
+        kind = rnd.choice(kinds)
+        body = text(rnd, size)
+        if kind == "plain":
+            msg = MIMEText(body, "plain", "utf-8")
+        elif kind == "html":
+            msg = MIMEMultipart("alternative")
+            msg.attach(MIMEText(body, "plain", "utf-8"))
+            msg.attach(MIMEText(f"<html><body><p>{body}</p></body></html>",
+                                "html", "utf-8"))
+        else:
+            msg = MIMEMultipart()
+            msg.attach(MIMEText(body, "plain", "utf-8"))
+            att = MIMEApplication(rnd.randbytes(attachment_size),
+                                  Name=f"file{i}.bin")
+            att['Content-Disposition'] = f'attachment; filename="file{i}.bin"'
+            msg.attach(att)
+        msg['From'] = f"sender{i % 17}@example.com"
+        msg['To'] = "user@example.com"
+        msg['Subject'] = f"Mensaje {i} {kind}"
+        msg['Date'] = formatdate(1700000000 + i * 60)
+        msg['Message-ID'] = make_msgid(str(i), "example.com")
+        mails.append(msg.as_bytes().replace(b"\r\n", b"\n").replace(
+            b"\n", b"\r\n"))
+    return mails
+
+
+def _entity(raw: bytes):
+    head, _, body = raw.partition(b"\r\n\r\n")
+    return BytesHeaderParser().parsebytes(head + b"\r\n\r\n"), body
+
+
+def _subparts(msg: Message, body: bytes):
+    delim = b"\r\n--" + msg.get_boundary().encode()
+    chunks = (b"\r\n" + body).split(delim)
+    # Se descartan el preámbulo y lo que sigue al delimitador final
+    return [c.split(b"\r\n", 1)[1] for c in chunks[1:-1]]
+
+
+def body_section(raw: bytes, section: str):
+    # Contenido de BODY[1.2...] tal cual está en el mensaje
+    msg, body = _entity(raw)
+    for n in section.split("."):
+        if msg.get_content_maintype() != "multipart":
+            continue
+        msg, body = _entity(_subparts(msg, body)[int(n) - 1])
+    return body
+
+
+def body_structure(raw: bytes):
+    msg, body = _entity(raw)
+    if msg.get_content_maintype() == "multipart":
+        parts = "".join(body_structure(p) for p in _subparts(msg, body))
+        return f'({parts} "{msg.get_content_subtype().upper()}")'
+    params = " ".join(
+        f'"{k.upper()}" "{v}"' for k, v in msg.get_params([])[1:])
+    enc = msg.get("Content-Transfer-Encoding", "7bit").upper()
+    typ = msg.get_content_maintype().upper()
+    fields = (f'"{typ}" "{msg.get_content_subtype().upper()}" '
+              f'{f"({params})" if params else "NIL"} NIL NIL "{enc}" '
+              f'{len(body)}')
+    if typ == "TEXT":
+        fields = fields + " %d" % body.count(b"\n")
+    disp = "NIL"
+    if msg.get_content_disposition() is not None:
+        name = msg.get_param("filename", header="content-disposition")
+        name = "NIL" if name is None else f'("FILENAME" "{name}")'
+        disp = f'("{msg.get_content_disposition().upper()}" {name})'
+    return f'({fields} NIL {disp})'
+
+
+class _Message:
+    def __init__(self, uid: int, raw: bytes, modseq: int = 1):
+        self.uid = uid
+        self.raw = raw
+        self.flags: set[str] = set()
+        self.modseq = modseq
+        # Extensiones de GMail (X-GM-EXT-1)
+        self.gmid = 10 ** 6 + uid
+        self.thrid = self.gmid
+        self.labels: set[str] = set()
+
+
+class _Inflate(io.RawIOBase):
+    def __init__(self, file):
+        self.__file = file
+        self.__inflate = zlib.decompressobj(-zlib.MAX_WBITS)
+        self.__pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        while not self.__pending:
+            data = self.__file.read1(65536)
+            if not data:
+                return 0
+            self.__pending = self.__inflate.decompress(data)
+        size = min(len(buf), len(self.__pending))
+        buf[:size] = self.__pending[:size]
+        self.__pending = self.__pending[size:]
+        return size
+
+
+class _ImapHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        self.request = self.server.context.wrap_socket(
+            self.request, server_side=True)
+        super().setup()
+        self.deflate = None
+
+    def send(self, data: bytes):
+        if self.deflate is not None:
+            data = self.deflate.compress(data)
+            data = data + self.deflate.flush(zlib.Z_SYNC_FLUSH)
+        self.wfile.write(data)
+
+    def handle(self):
+        self.selected = None
+        self.readonly = False
+        self.enabled: set[str] = set()
+        caps = " ".join(self.server.capabilities)
+        self.send(f'* OK [CAPABILITY {caps}] Fake IMAP ready\r\n'.encode())
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            with self.server.lock:
+                self.server.commands.append(line.decode().rstrip("\r\n"))
+            args = line.decode().rstrip("\r\n").split(" ", 2)
+            tag = args[0]
+            cmd = args[1].upper() if len(args) > 1 else ""
+            rest = args[2] if len(args) > 2 else ""
+            uid = cmd == "UID"
+            if uid:
+                cmd, _, rest = rest.partition(" ")
+                cmd = cmd.upper()
+            mth = getattr(self, "do_" + cmd, None)
+            if mth is None:
+                self.send(f'{tag} BAD unknown command\r\n'.encode())
+                continue
+            rt = mth(rest, uid)
+            if rt is False:
+                self.send(f'{tag} BAD\r\n'.encode())
+                continue
+            if isinstance(rt, str):
+                self.send(f'{tag} NO {rt}\r\n'.encode())
+                continue
+            self.send(f'{tag} OK {cmd} completed\r\n'.encode())
+            self.wfile.flush()
+            if cmd == "COMPRESS" and self.deflate is None:
+                # RFC 4978: lo que sigue al OK ya va comprimido
+                self.deflate = zlib.compressobj(
+                    6, zlib.DEFLATED, -zlib.MAX_WBITS)
+                self.rfile = io.BufferedReader(_Inflate(self.rfile))
+            if cmd == "LOGOUT":
+                return
+
+    @property
+    def messages(self) -> list[_Message]:
+        return self.server.messages
+
+    def do_CAPABILITY(self, rest, uid):
+        caps = " ".join(self.server.capabilities)
+        self.send(f'* CAPABILITY {caps}\r\n'.encode())
+
+    def do_ENABLE(self, rest, uid):
+        # Como en RFC 5161, ENABLE solo vale antes de seleccionar carpeta
+        if self.selected is not None:
+            return False
+        exts = [e for e in rest.upper().split()
+                if e in self.server.capabilities]
+        self.enabled.update(exts)
+        self.send(f'* ENABLED {" ".join(exts)}\r\n'.encode())
+
+    def do_LOGIN(self, rest, uid):
+        pass
+
+    def do_COMPRESS(self, rest, uid):
+        if "COMPRESS=DEFLATE" not in self.server.capabilities:
+            return False
+        if self.deflate is not None:
+            return "compression already active"
+
+    def do_NOOP(self, rest, uid):
+        # Avisa de los mensajes que han llegado desde el SELECT
+        if self.selected is not None and len(self.messages) != self.exists:
+            self.exists = len(self.messages)
+            self.send(f'* {self.exists} EXISTS\r\n'.encode())
+
+    def do_IDLE(self, rest, uid):
+        self.send(b'+ idling\r\n')
+        while True:
+            # Los mensajes que llegan durante IDLE se avisan al momento
+            self.do_NOOP(rest, uid)
+            if self.request.pending() or select.select(
+                    [self.request], [], [], 0.05)[0]:
+                break
+        line = self.rfile.readline().decode().rstrip("\r\n")
+        with self.server.lock:
+            self.server.commands.append(line)
+        if line.upper() != "DONE":
+            return False
+
+    def do_LOGOUT(self, rest, uid):
+        self.send(b'* BYE\r\n')
+
+    def do_CLOSE(self, rest, uid):
+        # CLOSE borra los \Deleted salvo si se abrió con EXAMINE
+        if not self.readonly:
+            self.do_EXPUNGE(rest, uid, notify=False)
+        self.selected = None
+
+    def do_UNSELECT(self, rest, uid):
+        self.selected = None
+
+    def do_EXPUNGE(self, rest, uid, notify=True):
+        with self.server.lock:
+            for i in reversed(range(len(self.messages))):
+                msg = self.messages[i]
+                if "\\Deleted" not in msg.flags:
+                    continue
+                del self.messages[i]
+                self.server.vanished.append(
+                    (msg.uid, self.server.next_modseq()))
+                if not notify:
+                    continue
+                if "QRESYNC" in self.enabled:
+                    self.send(f'* VANISHED {msg.uid}\r\n'.encode())
+                else:
+                    self.send(f'* {i + 1} EXPUNGE\r\n'.encode())
+
+    def do_LIST(self, rest, uid):
+        for flags, name in self.server.folders:
+            self.send(f'* LIST ({flags}) "/" "{name}"\r\n'.encode())
+
+    def do_SELECT(self, rest, uid, readonly=False):
+        m = re_mailbox.match(rest)
+        name = m.group(1) if m.group(1) is not None else m.group(2)
+        if name not in (f[1] for f in self.server.folders):
+            self.selected = None
+            return "no such folder"
+        self.selected = rest
+        self.readonly = readonly
+        self.exists = len(self.messages)
+        self.send(f'* {self.exists} EXISTS\r\n'.encode())
+        self.send(
+            f'* OK [UIDVALIDITY {self.server.uidvalidity}] UIDs valid\r\n'
+            .encode())
+        if "CONDSTORE" not in self.server.capabilities:
+            return
+        self.send(
+            f'* OK [HIGHESTMODSEQ {self.server.modseq}] Highest\r\n'
+            .encode())
+        m = re_qresync.search(rest)
+        if m is None or "QRESYNC" not in self.enabled:
+            return
+        if int(m.group(1)) != self.server.uidvalidity:
+            return
+        since = int(m.group(2))
+        gone = [str(u) for u, mod in self.server.vanished if mod > since]
+        if gone:
+            self.send(f'* VANISHED (EARLIER) {",".join(gone)}\r\n'.encode())
+        for i, msg in enumerate(self.messages):
+            if msg.modseq > since:
+                self.send(f'* {i + 1} FETCH ({self.__flags(msg)})\r\n'
+                          .encode())
+
+    def do_EXAMINE(self, rest, uid):
+        return self.do_SELECT(rest, uid, readonly=True)
+
+    def __ids(self, msg_set: str, uid: bool):
+        # Devuelve índices (base 0) de los mensajes del conjunto
+        if len(self.messages) == 0:
+            return []
+        top = self.messages[-1].uid if uid else len(self.messages)
+        wanted: set[int] = set()
+        for rng in msg_set.split(","):
+            ini, _, end = rng.partition(":")
+            ini = top if ini == "*" else int(ini)
+            end = ini if end == "" else (top if end == "*" else int(end))
+            if ini > end:
+                ini, end = end, ini
+            wanted.update(range(ini, end + 1))
+        if uid:
+            return [i for i, m in enumerate(self.messages) if m.uid in wanted]
+        return sorted(i - 1 for i in wanted if 0 < i <= len(self.messages))
+
+    def do_SEARCH(self, rest, uid):
+        words = rest.split()
+        ids = range(len(self.messages))
+        if len(words) >= 2 and words[0].upper() == "UID":
+            ids = self.__ids(words[1], True)
+        m = re_gm_search.match(rest)
+        if m is not None:
+            ids = [i for i in ids if self.__gm_match(self.messages[i], m)]
+        nums = [
+            str(self.messages[i].uid if uid else i + 1) for i in ids
+        ]
+        self.send((" ".join(["* SEARCH"] + nums) + "\r\n").encode())
+
+    def __gm_match(self, msg: _Message, m: re.Match):
+        key = m.group(1).upper()
+        value = m.group(2) if m.group(2) is not None else m.group(3)
+        value = re_unescape.sub(r'\1', value)
+        if key == "X-GM-THRID":
+            return msg.thrid == int(value)
+        if key == "X-GM-LABELS":
+            return value in msg.labels
+        # X-GM-RAW: basta con que el texto aparezca en el mensaje
+        return value.lower().encode() in msg.raw.lower()
+
+    def __flags(self, msg: _Message):
+        return (f'UID {msg.uid} FLAGS ({" ".join(sorted(msg.flags))}) '
+                f'MODSEQ ({msg.modseq})')
+
+    def do_FETCH(self, rest, uid):
+        msg_set, _, items = rest.partition(" ")
+        since = 0
+        m = re_changedsince.search(items)
+        if m is not None:
+            since = int(m.group(1))
+            items = items[:m.start()]
+        items = re_fetch_item.findall(items.upper())
+        if uid and "UID" not in items:
+            items.insert(0, "UID")
+        for i in self.__ids(msg_set, uid):
+            msg = self.messages[i]
+            if msg.modseq <= since:
+                continue
+            out = [f'* {i + 1} FETCH ('.encode()]
+            for n, item in enumerate(items):
+                if n > 0:
+                    out.append(b' ')
+                out.append(self.__item(msg, item))
+            out.append(b')\r\n')
+            self.send(b''.join(out))
+
+    def __item(self, msg: _Message, item: str):
+        if item == "UID":
+            return f'UID {msg.uid}'.encode()
+        if item == "FLAGS":
+            return f'FLAGS ({" ".join(sorted(msg.flags))})'.encode()
+        if item == "RFC822.SIZE":
+            return f'RFC822.SIZE {len(msg.raw)}'.encode()
+        if item == "MODSEQ":
+            return f'MODSEQ ({msg.modseq})'.encode()
+        if item == "X-GM-MSGID":
+            return f'X-GM-MSGID {msg.gmid}'.encode()
+        if item == "X-GM-THRID":
+            return f'X-GM-THRID {msg.thrid}'.encode()
+        if item == "X-GM-LABELS":
+            labels = " ".join(
+                lb if lb.startswith("\\") else f'"{lb}"'
+                for lb in sorted(msg.labels))
+            return f'X-GM-LABELS ({labels})'.encode()
+        if item == "INTERNALDATE":
+            return b'INTERNALDATE "14-Nov-2023 22:13:20 +0000"'
+        if item == "BODYSTRUCTURE":
+            return f'BODYSTRUCTURE {body_structure(msg.raw)}'.encode()
+        if item == "RFC822":
+            return b'RFC822 {%d}\r\n' % len(msg.raw) + msg.raw
+        m = re_fetch_part.fullmatch(item)
+        if m is None:
+            return f'{item} NIL'.encode()
+        data = msg.raw
+        section = m.group("section")
+        if section == "HEADER":
+            data = data.split(b"\r\n\r\n", 1)[0] + b"\r\n\r\n"
+        elif section == "TEXT":
+            data = data.split(b"\r\n\r\n", 1)[-1]
+        elif section.startswith("HEADER.FIELDS"):
+            data = self.__header_fields(data, section)
+        elif re_section.fullmatch(section):
+            data = body_section(data, section)
+        key = f'BODY[{section}]'
+        if m.group("ini") is not None:
+            ini = int(m.group("ini"))
+            data = data[ini:ini + int(m.group("len"))]
+            key = key + f'<{ini}>'
+        return key.encode() + b' {%d}\r\n' % len(data) + data
+
+    def __header_fields(self, raw: bytes, section: str):
+        names = section.partition("(")[2].rstrip(")").split()
+        head = raw.split(b"\r\n\r\n", 1)[0] + b"\r\n"
+        fields = [
+            f for f in re_header_field.findall(head)
+            if f.split(b":", 1)[0].decode().upper() in names
+        ]
+        return b"".join(fields) + b"\r\n"
+
+    def do_STORE(self, rest, uid):
+        msg_set, command, flags = rest.split(" ", 2)
+        flags = set(flags.strip("()").split())
+        silent = command.upper().endswith(".SILENT")
+        ids = self.__ids(msg_set, uid)
+        if any(self.messages[i].uid in self.server.locked for i in ids):
+            return "cannot change flags"
+        for i in ids:
+            msg = self.messages[i]
+            if command.startswith("+"):
+                msg.flags.update(flags)
+            elif command.startswith("-"):
+                msg.flags.difference_update(flags)
+            else:
+                msg.flags = set(flags)
+            with self.server.lock:
+                msg.modseq = self.server.next_modseq()
+            if not silent:
+                self.send(f'* {i + 1} FETCH ({self.__flags(msg)})\r\n'
+                          .encode())
+
+
+class _Counter:
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data: bytes):
+        self.size = self.size + len(data)
+
+    def tell(self):
+        return self.size
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        self.request = self.server.context.wrap_socket(
+            self.request, server_side=True)
+        super().setup()
+
+    def reply(self, line: str):
+        self.wfile.write((line + "\r\n").encode())
+        self.wfile.flush()
+
+    def handle(self):
+        self.reply("220 localhost Fake SMTP ready")
+        count = 0
+        bdat = None
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            cmd = line.decode().strip().split(" ", 1)[0].upper()
+            if cmd in ("EHLO", "HELO"):
+                self.reply("250-localhost")
+                self.reply("250-8BITMIME")
+                self.reply("250-PIPELINING")
+                if self.server.chunking:
+                    self.reply("250-CHUNKING")
+                self.reply("250 AUTH PLAIN LOGIN")
+            elif cmd == "AUTH" and self.server.reject_auth:
+                with self.server.lock:
+                    self.server.auth_failures = self.server.auth_failures + 1
+                self.reply("535 5.7.8 Authentication credentials invalid")
+            elif cmd == "AUTH":
+                self.reply("235 2.7.0 Authentication successful")
+            elif cmd == "MAIL" and self.server.limit and (
+                count >= self.server.limit
+            ):
+                self.reply("421 4.7.0 Too many messages for this connection")
+                return
+            elif cmd == "MAIL" and self.server.take_busy():
+                self.reply("451 4.7.1 Rate limited, try again later")
+            elif cmd == "RCPT" and "reject" in line.decode().lower():
+                self.reply("550 5.1.1 User unknown")
+            elif cmd == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = self.server.new_data()
+                while True:
+                    line = self.rfile.readline()
+                    if not line or line == b".\r\n":
+                        break
+                    if line.startswith(b".."):
+                        line = line[1:]
+                    data.write(line)
+                count = count + 1
+                self.server.add_data(data, self.client_address)
+                self.reply("250 2.0.0 Ok: queued")
+            elif cmd == "BDAT":
+                args = line.decode().split()
+                if bdat is None:
+                    bdat = self.server.new_data()
+                size = int(args[1])
+                while size > 0:
+                    chunk = self.rfile.read(min(size, 65536))
+                    bdat.write(chunk)
+                    size = size - len(chunk)
+                if len(args) > 2 and args[2].upper() == "LAST":
+                    count = count + 1
+                    self.server.add_data(bdat, self.client_address)
+                    bdat = None
+                self.reply("250 2.0.0 Ok")
+            elif cmd == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 Ok")
+
+
+class _TLSServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, handler, context: ssl.SSLContext):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.context = context
+        self.lock = threading.Lock()
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+
+class FakeImapServer(_TLSServer):
+    def __init__(
+        self,
+        context: ssl.SSLContext,
+        mails: list[bytes],
+        capabilities: tuple[str, ...] = ('IMAP4rev1', ),
+        uidvalidity: int = 1
+    ):
+        super().__init__(_ImapHandler, context)
+        self.capabilities = capabilities
+        self.uidvalidity = uidvalidity
+        self.modseq = 1
+        self.messages = [_Message(i + 1, raw) for i, raw in enumerate(mails)]
+        # Comandos recibidos y UIDs en los que STORE responde NO
+        self.commands: list[str] = []
+        self.locked: set[int] = set()
+        # (flags, nombre) de las carpetas que devuelve LIST,
+        # todas con los mismos mensajes
+        self.folders: list[tuple[str, str]] = [('\\HasNoChildren', 'INBOX')]
+        # (uid, modseq) de los mensajes borrados, para VANISHED
+        self.vanished: list[tuple[int, int]] = []
+
+    def append(self, raw: bytes):
+        with self.lock:
+            uid = self.messages[-1].uid + 1 if self.messages else 1
+            self.messages.append(_Message(uid, raw, self.next_modseq()))
+            return uid
+
+    def next_modseq(self):
+        # Llamar con lock
+        self.modseq = self.modseq + 1
+        return self.modseq
+
+
+class FakeSmtpServer(_TLSServer):
+    def __init__(
+        self,
+        context: ssl.SSLContext,
+        limit: int = None,
+        busy: int = 0,
+        chunking: bool = False,
+        keep: bool = False,
+        reject_auth: bool = False
+    ):
+        super().__init__(_SmtpHandler, context)
+        self.limit = limit
+        self.busy = busy
+        self.chunking = chunking
+        # Mientras reject_auth sea True todos los AUTH fallan con 535
+        self.reject_auth = reject_auth
+        self.auth_failures = 0
+        # Con keep=True se guardan los mensajes recibidos en messages,
+        # si no solo su tamaño en received
+        self.keep = keep
+        self.messages: list[BinaryIO] = []
+        self.received: list[int] = []
+        self.connections: set[tuple] = set()
+
+    def take_busy(self):
+        # Las primeras "busy" transacciones se rechazan con 451
+        with self.lock:
+            if self.busy <= 0:
+                return False
+            self.busy = self.busy - 1
+            return True
+
+    def new_data(self):
+        # En disco para no contar en la memoria del proceso que se mide
+        return tempfile.TemporaryFile() if self.keep else _Counter()
+
+    def add_data(self, data, client_address):
+        with self.lock:
+            self.received.append(data.tell())
+            self.connections.add(client_address)
+            if self.keep:
+                data.seek(0)
+                self.messages.append(data)
@@ -4,4 +4,4 @@ cd ..
 if [ -f .venv/bin/activate ]; then
     source .venv/bin/activate
 fi
-python3 -m "run.$1"
\ No newline at end of file
+python3 -m "run.$1" "${@:2}"
\ No newline at end of file
@@ -0,0 +1,83 @@
+import shutil
+import threading
+import pytest
+from mail.config import Config
+from mail.imap import Imap
+from run.fakeserver import (
+    mailbox, make_cert, client_context, server_context, Mix,
+    FakeImapServer, FakeSmtpServer
+)
+
+
+@pytest.fixture(scope="session")
+def server_ctx(tmp_path_factory):
+    if shutil.which("openssl") is None:
+        pytest.skip("openssl not available")
+    cert, key = make_cert(str(tmp_path_factory.mktemp("cert")))
+    return server_context(cert, key)
+
+
+def serve(srv):
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+@pytest.fixture
+def imap_server(server_ctx):
+    servers = []
+
+    def make(count=5, size=200, mix=Mix(), attachment_size=1000, **kwargs):
+        mails = mailbox(count, size, mix, attachment_size)
+        srv = serve(FakeImapServer(server_ctx, mails, **kwargs))
+        servers.append(srv)
+        return srv
+
+    try:
+        yield make
+    finally:
+        for srv in servers:
+            srv.shutdown()
+            srv.server_close()
+
+
+@pytest.fixture
+def smtp_server(server_ctx):
+    # smtp_server(limit=..., busy=..., chunking=..., keep=...)
+    servers = []
+
+    def make(**kwargs):
+        srv = serve(FakeSmtpServer(server_ctx, **kwargs))
+        servers.append(srv)
+        return srv
+
+    try:
+        yield make
+    finally:
+        for srv in servers:
+            srv.shutdown()
+            srv.server_close()
+
+
+def imap_config(srv, user="u"):
+    return Config(host="127.0.0.1", port=srv.port, user=user, pssw="p")
+
+
+@pytest.fixture
+def imap_client(imap_server):
+    clients = []
+
+    def make(srv=None, cls=Imap, **kwargs):
+        srv = srv or imap_server()
+        imap = cls(imap_config(srv), ssl_context=client_context(), **kwargs)
+        imap.login()
+        clients.append(imap)
+        return imap
+
+    try:
+        yield make
+    finally:
+        for imap in clients:
+            try:
+                imap.session.logout()
+            except Exception:
+                pass
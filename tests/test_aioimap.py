@@ -0,0 +1,85 @@
+import asyncio
+from mail.aioimap import AsyncImap
+from mail.config import Config
+from run.fakeserver import client_context
+
+
+def connect(srv):
+    return AsyncImap(
+        Config(host="127.0.0.1", port=srv.port, user="u", pssw="p"),
+        ssl_context=client_context()
+    )
+
+
+def fetches(srv):
+    return [c for c in srv.commands if ' FETCH ' in c]
+
+
+async def collect(agen):
+    return [m async for m in agen]
+
+
+def test_fetch_many(imap_server):
+    srv = imap_server(count=12)
+    raws = [m.raw for m in srv.messages]
+
+    async def main():
+        async with connect(srv) as imap:
+            await imap.select('INBOX')
+            ids = [str(i).encode() for i in (12, 3, 7, 1, 2, 11, 5, 9, 4)]
+            del srv.commands[:]
+            mails = []
+            async for mail in imap.fetch_many(ids, chunk_size=2, window=3):
+                if not mails:
+                    # Antes de consumir el primer trozo ya se han enviado
+                    # los FETCH de la ventana, pero no más
+                    await asyncio.sleep(0.2)
+                    assert len(fetches(srv)) == 3
+                mails.append(mail)
+            assert len(fetches(srv)) == 5
+            # Se devuelven en el orden pedido, no en el del servidor
+            assert [m.id for m in mails] == ids
+            assert [m.raw for m in mails] == [raws[int(i) - 1] for i in ids]
+
+    asyncio.run(main())
+
+
+def test_gather(imap_server):
+    srv = imap_server(count=8)
+    raws = [m.raw for m in srv.messages]
+
+    async def main():
+        async with connect(srv) as imap:
+            await imap.select('INBOX')
+            # Varias peticiones a la vez por la misma conexión
+            one, many, ids = await asyncio.gather(
+                imap.fetch(b'8'),
+                collect(imap.fetch_many([b'1', b'2', b'3'], chunk_size=1)),
+                imap.get_ids('ALL')
+            )
+            assert one.raw == raws[7]
+            assert [m.raw for m in many] == raws[:3]
+            assert len(ids) == 8
+
+    asyncio.run(main())
+
+
+def test_early_break(imap_server):
+    srv = imap_server(count=10)
+    raws = [m.raw for m in srv.messages]
+
+    async def main():
+        async with connect(srv) as imap:
+            await imap.select('INBOX')
+            ids = [str(i).encode() for i in range(1, 11)]
+            mails = imap.fetch_many(ids, chunk_size=1, window=4)
+            async for mail in mails:
+                break
+            await mails.aclose()
+            # Las respuestas de lo que quedó en vuelo no se mezclan
+            # con las de los comandos siguientes
+            mail = await imap.fetch(b'6')
+            assert mail.raw == raws[5]
+            assert len(await imap.get_ids('ALL')) == 10
+
+    asyncio.run(main())
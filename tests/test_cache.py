@@ -0,0 +1,33 @@
+import time
+from mail.cache import MailCache
+
+KEY = ("acc", "INBOX", 7)
+
+
+def test_cache(tmp_path):
+    path = str(tmp_path / "cache.db")
+    with MailCache(path, max_bytes=1000) as cache:
+        for uid in range(1, 11):
+            cache.put(*KEY, uid, "(RFC822)", bytes([uid]) * 100)
+            time.sleep(0.002)
+        assert cache.size == 1000
+        # Reemplazar descuenta el tamaño anterior
+        cache.put(*KEY, 10, "(RFC822)", b"x" * 40)
+        assert cache.size == 940
+        cache.put(*KEY, 10, "(RFC822)", b"x" * 100)
+        assert cache.size == 1000
+        # Leer actualiza la fecha de acceso
+        assert cache.get(*KEY, 1, "(RFC822)") == b"\x01" * 100
+        time.sleep(0.002)
+        cache.put(*KEY, 11, "(RFC822)", b"y" * 100)
+        # Al pasarse se desalojan los menos usados hasta el 90%
+        assert cache.size == 900
+        uids = cache.get_many(*KEY, range(1, 12), "(RFC822)")
+        assert sorted(uids) == [1, 4, 5, 6, 7, 8, 9, 10, 11]
+        assert cache.get_many(*KEY, [1], "(BODY[])") == {}
+        assert cache.get("acc", "INBOX", 8, 1, "(RFC822)") is None
+    with MailCache(path, max_bytes=1000) as cache:
+        assert cache.size == 900
+        assert cache.get(*KEY, 11, "(RFC822)") == b"y" * 100
+        cache.clear()
+        assert cache.size == 0
@@ -0,0 +1,60 @@
+from mail.dedup import SeenMessages
+
+
+def test_seen(tmp_path):
+    path = str(tmp_path / "seen.db")
+    with SeenMessages(path) as seen:
+        assert "<a@x>" not in seen
+        seen.add_many(("<a@x>", b" <b@x>\r\n", None, ""))
+        assert "<a@x>" in seen
+        assert b"<b@x>" in seen
+        assert None not in seen
+        assert len(seen) == 2
+    seen = SeenMessages(path)
+    assert "<b@x>" in seen
+    assert "<c@x>" not in seen
+    seen.close()
+    assert "<a@x>" not in SeenMessages()
+
+
+def body_fetches(srv):
+    # FETCH de cuerpos (no los de solo Message-ID)
+    return [
+        c.split(' ', 1)[1] for c in srv.commands
+        if 'FETCH' in c and 'HEADER.FIELDS' not in c
+    ]
+
+
+def test_search_unique(tmp_path, imap_server, imap_client):
+    srv = imap_server(count=5)
+    # Copia del 2, mismo Message-ID
+    srv.append(srv.messages[1].raw)
+    imap = imap_client(srv)
+    imap.select('INBOX')
+    path = str(tmp_path / "seen.db")
+    with SeenMessages(path) as seen:
+        mails = list(imap.search_unique('ALL', seen=seen))
+        assert [m.id for m in mails] == [b'1', b'2', b'3', b'4', b'5']
+        assert len(seen) == 5
+    srv.append(b"Message-ID: <nuevo@example.com>\r\n"
+               b"Subject: nuevo\r\n\r\nhola\r\n")
+    del srv.commands[:]
+    # En otra ejecución solo se descarga el que no se había visto
+    with SeenMessages(path) as seen:
+        mails = list(imap.search_unique('ALL', seen=seen))
+        assert [m.subject for m in mails] == ["nuevo"]
+    assert body_fetches(srv) == ['FETCH 7 (RFC822)']
+
+
+def test_fetch_unique_uid(tmp_path, imap_server, imap_client):
+    srv = imap_server(count=4)
+    imap = imap_client(srv)
+    imap.select('INBOX')
+    with SeenMessages(str(tmp_path / "seen.db")) as seen:
+        uids = ['1', '2', '3', '4']
+        mails = list(imap.fetch_unique(uids[:2], seen, uid=True))
+        assert [m.uid for m in mails] == [1, 2]
+        del srv.commands[:]
+        mails = list(imap.fetch_unique(uids, seen, uid=True))
+        assert [m.uid for m in mails] == [3, 4]
+    assert body_fetches(srv) == ['UID FETCH 3:4 (RFC822)']
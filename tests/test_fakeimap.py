@@ -0,0 +1,287 @@
+import threading
+import time
+import pytest
+from mail.imap import Mail, LazyMail, GMail
+from mail.cache import MailCache
+from mail.imap import StoreException
+from mail.syncstate import SyncState
+from run.fakeserver import Mix
+
+QRESYNC = ('IMAP4rev1', 'ENABLE', 'UNSELECT', 'CONDSTORE', 'QRESYNC')
+CONDSTORE = ('IMAP4rev1', 'CONDSTORE')
+GMAIL = ('IMAP4rev1', 'X-GM-EXT-1')
+
+
+def test_resync_qresync(tmp_path, imap_server, imap_client):
+    srv = imap_server(count=5, capabilities=QRESYNC)
+    imap = imap_client(srv)
+    writer = imap_client(srv)
+    state = SyncState(str(tmp_path / "state.json"))
+    # Con una carpeta ya seleccionada (sync, pool...) ENABLE
+    # no es válido y hay que salir de ella antes
+    list(imap.sync(state, 'INBOX'))
+    rs = imap.resync(state)
+    assert rs.full and rs.vanished == ()
+    assert sorted(rs.flags) == [1, 2, 3, 4, 5]
+    assert rs.modseq == srv.modseq
+    assert state.get(imap.account, 'INBOX').uid == 5
+    writer.select('INBOX')
+    writer.seen('2', '4', uid=True)
+    writer.delete('3', uid=True)
+    writer.session.expunge()
+    rs = imap.resync(state)
+    assert not rs.full
+    assert rs.flags == {2: ('\\Seen', ), 4: ('\\Seen', )}
+    assert rs.vanished == (3, )
+    assert rs.modseq == srv.modseq
+    assert state.get(imap.account, 'INBOX').modseq == srv.modseq
+    rs = imap.resync(state)
+    assert (rs.flags, rs.vanished) == ({}, ())
+
+
+def test_resync_condstore(tmp_path, imap_server, imap_client):
+    srv = imap_server(count=4, capabilities=CONDSTORE)
+    imap = imap_client(srv)
+    writer = imap_client(srv)
+    state = SyncState(str(tmp_path / "state.json"))
+    rs = imap.resync(state)
+    assert rs.full and len(rs.flags) == 4
+    writer.select('INBOX')
+    writer.seen('1', uid=True)
+    rs = imap.resync(state)
+    # Sin QRESYNC los cambios se piden con CHANGEDSINCE
+    assert not rs.full
+    assert rs.flags == {1: ('\\Seen', )}
+    assert rs.vanished == ()
+    srv.uidvalidity = 2
+    rs = imap.resync(state)
+    assert rs.full and len(rs.flags) == 4
+    assert state.get(imap.account, 'INBOX').uid == 0
+
+
+def test_idle_noop_poll(imap_server, imap_client):
+    srv = imap_server(count=5)
+    imap = imap_client(srv)
+    imap.select('INBOX')
+    srv.append(srv.messages[0].raw)
+    # Sin IDLE se hace NOOP y el EXISTS del SELECT no cuenta como nuevo
+    events = list(imap.idle(timeout=0.3, poll=0.1))
+    assert [(e.type, e.num) for e in events] == [('EXISTS', 6)]
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_idle(imap_server, imap_client, compress):
+    srv = imap_server(count=5, capabilities=(
+        'IMAP4rev1', 'IDLE', 'COMPRESS=DEFLATE'))
+    imap = imap_client(srv, compress=compress)
+    assert imap.session.compressed == compress
+    imap.select('INBOX')
+    del srv.commands[:]
+    threading.Timer(0.2, srv.append, (srv.messages[0].raw, )).start()
+    start = time.monotonic()
+    events = imap.idle(timeout=10)
+    # El EXISTS despierta al que espera sin agotar el timeout
+    assert next(events) == ('EXISTS', 6, None)
+    assert time.monotonic() - start < 5
+    events.close()
+    commands = [c.split(' ', 1)[-1] for c in srv.commands]
+    assert commands == ['CAPABILITY', 'IDLE', 'DONE']
+    imap.noop()
+    del srv.commands[:]
+    # Se renueva el IDLE antes de que lo corte el servidor
+    assert list(imap.idle(timeout=0.5, renew=0.2)) == []
+    commands = [c.split(' ', 1)[-1] for c in srv.commands]
+    assert commands == ['CAPABILITY'] + ['IDLE', 'DONE'] * 3
+
+
+def test_fetch_many_cached(tmp_path, imap_server, imap_client):
+    srv = imap_server(count=5)
+    raws = {m.uid: m.raw for m in srv.messages}
+    cache = MailCache(str(tmp_path / "cache.db"))
+    imap = imap_client(srv, cache=cache)
+    imap.select('INBOX')
+    imap.delete('1')
+    imap.session.expunge()
+    # Tras borrar el primero los números de secuencia ya no son UID
+    mails = list(imap.fetch_many(['1', '3']))
+    assert [(m.id, m.uid) for m in mails] == [('1', 2), ('3', 4)]
+    assert [m.raw for m in mails] == [raws[2], raws[4]]
+    cached = cache.get_many(imap.account, 'INBOX', 1, raws, '(RFC822)')
+    assert sorted(cached) == [2, 4]
+    # Con el contenido en caché no se vuelve a pedir al servidor
+    for msg in srv.messages:
+        msg.raw = b'Subject: cambiado\r\n\r\n'
+    mails = list(imap.fetch_many(['2', '4'], uid=True))
+    assert [(m.id, m.uid) for m in mails] == [(None, 2), (None, 4)]
+    assert [m.raw for m in mails] == [raws[2], raws[4]]
+    mails = list(imap.fetch_many(['1', '2']))
+    assert [m.raw for m in mails] == [raws[2], b'Subject: cambiado\r\n\r\n']
+    cache.close()
+
+
+def test_store_many(imap_server, imap_client):
+    srv = imap_server(count=10)
+    imap = imap_client(srv)
+    imap.select('INBOX')
+    ids = [str(i) for i in range(10, 0, -1)]
+    del srv.commands[:]
+    assert imap.store_many(ids, '+FLAGS', '\\Flagged', chunk_size=4) == ()
+    stores = [c.split(' ', 1)[1] for c in srv.commands]
+    # Un STORE por trozo, en el orden recibido
+    assert stores == [
+        'STORE 7:10 +FLAGS (\\Flagged)',
+        'STORE 3:6 +FLAGS (\\Flagged)',
+        'STORE 1:2 +FLAGS (\\Flagged)',
+    ]
+    assert all(m.flags == {'\\Flagged'} for m in srv.messages)
+    del srv.commands[:]
+    imap.seen('3', '1', '2', uid=True)
+    assert [c.split(' ', 1)[1] for c in srv.commands] == [
+        'UID STORE 1:3 +FLAGS.SILENT \\Seen'
+    ]
+    assert [len(m.flags) for m in srv.messages[:4]] == [2, 2, 2, 1]
+
+
+def test_store_many_failures(imap_server, imap_client):
+    srv = imap_server(count=10)
+    imap = imap_client(srv)
+    imap.select('INBOX')
+    srv.locked = {6}
+    ids = [str(i) for i in range(1, 11)]
+    failures = imap.store_many(ids, '+FLAGS', '\\Seen', chunk_size=4,
+                               raise_errors=False)
+    # Falla un trozo y se sigue con los demás
+    assert [f[0] for f in failures] == ['5:8']
+    assert isinstance(failures[0][1], StoreException)
+    flagged = [m.uid for m in srv.messages if m.flags]
+    assert flagged == [1, 2, 3, 4, 9, 10]
+    with pytest.raises(StoreException) as e:
+        imap.store_many(ids, '-FLAGS', '\\Seen', chunk_size=3, uid=True)
+    assert [f[0] for f in e.value.failures] == ['4:6']
+    flagged = [m.uid for m in srv.messages if m.flags]
+    assert flagged == [4]
+
+
+def test_compress(imap_server, imap_client):
+    srv = imap_server(count=20, size=5000,
+                      capabilities=('IMAP4rev1', 'COMPRESS=DEFLATE'))
+    raws = [m.raw for m in srv.messages]
+    imap = imap_client(srv, compress=True)
+    assert imap.session.compressed
+    imap.select('INBOX')
+    mails = list(imap.fetch_many(imap.get_ids('ALL')))
+    assert [m.raw for m in mails] == raws
+    traffic = imap.traffic
+    # data_* es lo que ve imaplib y wire_* lo que va por el socket
+    assert traffic.data_in > sum(len(r) for r in raws)
+    assert traffic.wire_in < traffic.data_in / 2
+    assert traffic.wire_out > 0 and traffic.data_out > 0
+    # Sin la extensión se sigue sin comprimir
+    plain = imap_client(imap_server(count=1), compress=True)
+    assert not plain.session.compressed
+    plain.select('INBOX')
+    assert plain.traffic.wire_in == plain.traffic.data_in
+
+
+def test_lazy_mail(tmp_path, imap_server, imap_client):
+    srv = imap_server(count=2, mix=Mix(plain=0, html=0, attach=1),
+                      attachment_size=20000)
+    full = [Mail.from_bytes(m.raw) for m in srv.messages]
+    imap = imap_client(srv)
+    imap.select('INBOX')
+    mails = list(imap.search('ALL', lazy=True))
+    assert all(isinstance(m, LazyMail) for m in mails)
+    fetches = [c.split(' ', 1)[1] for c in srv.commands if 'FETCH' in c]
+    assert fetches == ['FETCH 1:2 (UID BODY.PEEK[HEADER] BODYSTRUCTURE)']
+    del srv.commands[:]
+    assert mails[1].body == full[1].body
+    att = mails[1].attachments[0]
+    assert att.name == "file1.bin"
+    target = att.save(str(tmp_path / "out") + "/", chunk_size=8192)
+    with open(target, "rb") as f:
+        assert f.read() == full[1].attachments[0].bytes
+    # Solo el texto entero y el adjunto a trozos, nada del resto
+    size = att.part.size
+    assert [c.split(' ', 1)[1] for c in srv.commands] == [
+        'UID FETCH 2 (BODY.PEEK[1])'
+    ] + [
+        f'UID FETCH 2 (BODY.PEEK[2]<{off}.8192>)'
+        for off in range(0, size + 1, 8192)
+    ]
+
+
+def sent(srv):
+    return [c.split(' ', 1)[1] for c in srv.commands]
+
+
+def gmail_server(imap_server, **kwargs):
+    srv = imap_server(capabilities=GMAIL, **kwargs)
+    srv.folders = [
+        ('\\HasNoChildren', 'INBOX'),
+        ('\\All \\HasNoChildren', '[Gmail]/Todos'),
+        ('\\HasNoChildren \\Trash', '[Gmail]/Papelera'),
+    ]
+    return srv
+
+
+def test_gmail_folders(tmp_path, imap_server, imap_client):
+    srv = gmail_server(imap_server, count=2)
+    path = str(tmp_path / "gmail.json")
+    gm = imap_client(srv, cls=GMail, folders=path)
+    del srv.commands[:]
+    gm.select('ALL')
+    assert sent(srv) == ['LIST "" *', 'SELECT "[Gmail]/Todos"']
+    # Otra sesión usa los nombres guardados en disco sin LIST
+    gm = imap_client(srv, cls=GMail, folders=path)
+    del srv.commands[:]
+    gm.select('TRASH')
+    assert sent(srv) == ['SELECT "[Gmail]/Papelera"']
+    # Si la carpeta guardada ya no existe se vuelve a listar
+    srv.folders[2] = ('\\HasNoChildren \\Trash', '[Gmail]/Trash')
+    gm = imap_client(srv, cls=GMail, folders=path)
+    del srv.commands[:]
+    gm.select('TRASH')
+    assert sent(srv) == [
+        'SELECT "[Gmail]/Papelera"', 'LIST "" *', 'SELECT "[Gmail]/Trash"'
+    ]
+    assert gm.gmfolders['TRASH'] == '"[Gmail]/Trash"'
+
+
+def test_gmail_fetch_new(imap_server, imap_client):
+    srv = gmail_server(imap_server, count=6)
+    thrid = srv.messages[0].thrid
+    for n in (0, 2, 4):
+        srv.messages[n].thrid = thrid
+    for n in (1, 2):
+        srv.messages[n].labels = {'Proyecto', '\\Inbox'}
+    gm = imap_client(srv, cls=GMail)
+    gm.select('ALL')
+    del srv.commands[:]
+    known = set()
+    mails = list(gm.thread(thrid, known=known))
+    assert [(g.msgid, m.id) for g, m in mails] == [
+        (10 ** 6 + 1, b'1'), (10 ** 6 + 3, b'3'), (10 ** 6 + 5, b'5')
+    ]
+    assert mails[1][0].labels == ('Proyecto', '\\Inbox')
+    assert sent(srv) == [
+        f'SEARCH X-GM-THRID {thrid}',
+        'FETCH 1,3,5 (UID X-GM-MSGID X-GM-THRID X-GM-LABELS)',
+        'FETCH 1,3,5 (RFC822)',
+    ]
+    del srv.commands[:]
+    # El 3 ya se descargó con el hilo y solo se pide el cuerpo del 2
+    mails = list(gm.label('Proyecto', known=known))
+    assert [m.id for g, m in mails] == [b'2']
+    assert sent(srv) == [
+        'SEARCH X-GM-LABELS "Proyecto"',
+        'FETCH 2:3 (UID X-GM-MSGID X-GM-THRID X-GM-LABELS)',
+        'FETCH 2 (RFC822)',
+    ]
+    del srv.commands[:]
+    assert list(gm.fetch_new([b'1', b'2', b'3'], known=known)) == []
+    assert sent(srv) == [
+        'FETCH 1:3 (UID X-GM-MSGID X-GM-THRID X-GM-LABELS)'
+    ]
+    del srv.commands[:]
+    assert gm.get_ids('Mensaje 4') == (b'5', )
+    assert sent(srv) == ['SEARCH X-GM-RAW "Mensaje 4"']
@@ -0,0 +1,102 @@
+import base64
+import quopri
+from mail.imapdata import (
+    to_msg_set, from_msg_set, iter_chunks, parse_fetch, first_literal,
+    parse_bodystructure, StreamDecoder
+)
+
+
+def test_msg_set():
+    assert to_msg_set([]) == ""
+    assert to_msg_set([b'3']) == "3"
+    ids = [str(i).encode() for i in range(1, 201)] + [b'205']
+    ids = ids + [str(i).encode() for i in range(310, 401)]
+    assert to_msg_set(reversed(ids)) == "1:200,205,310:400"
+    assert to_msg_set([1, 2, 2, 4]) == "1:2,4"
+
+
+def test_from_msg_set():
+    assert from_msg_set("") == tuple()
+    assert from_msg_set(b"1:3,7,10:9") == (1, 2, 3, 7, 9, 10)
+    assert from_msg_set(to_msg_set([5, 1, 2, 8])) == (1, 2, 5, 8)
+
+
+def test_chunks():
+    assert list(iter_chunks(range(5), 2)) == [(0, 1), (2, 3), (4, )]
+
+
+def test_parse_fetch():
+    data = [
+        (b'1 (UID 10 RFC822 {5}', b'Hello'),
+        b')',
+        b'2 (FLAGS (\\Seen) UID 11)',
+        (b'3 (BODY[HEADER.FIELDS (MESSAGE-ID)] {3}', b'abc'),
+        (b' BODY[1]<0> {2}', b'de'),
+        b' X-GM-LABELS ("\\\\Inbox" "a \\"b\\"") ENVELOPE (NIL "(x)"))',
+    ]
+    rsp = parse_fetch(data)
+    assert [n for n, _ in rsp] == [1, 2, 3]
+    assert rsp[0][1] == {'UID': '10', 'RFC822': b'Hello'}
+    assert first_literal(rsp[0][1]) == b'Hello'
+    assert rsp[1][1] == {'FLAGS': ['\\Seen'], 'UID': '11'}
+    assert first_literal(rsp[1][1]) is None
+    v = rsp[2][1]
+    assert v['BODY[HEADER.FIELDS (MESSAGE-ID)]'] == b'abc'
+    assert v['BODY[1]<0>'] == b'de'
+    assert v['X-GM-LABELS'] == ['\\Inbox', 'a "b"']
+    assert v['ENVELOPE'] == [None, '(x)']
+    # Los corchetes pueden ir en cualquier parte de un átomo
+    rsp = parse_fetch([b'1 (X-GM-LABELS (\\Inbox [Gmail]/Starred "x") UID 3)'])
+    assert rsp[0][1] == {
+        'X-GM-LABELS': ['\\Inbox', '[Gmail]/Starred', 'x'],
+        'UID': '3'
+    }
+
+
+BODYSTRUCTURE = (
+    b'1 (BODYSTRUCTURE ((("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL '
+    b'"QUOTED-PRINTABLE" 12 1 NIL NIL NIL NIL)("TEXT" "HTML" '
+    b'("CHARSET" "utf-8") NIL NIL "7BIT" 30 1 NIL NIL NIL NIL) '
+    b'"ALTERNATIVE" ("BOUNDARY" "b1") NIL NIL NIL)'
+    b'("APPLICATION" "PDF" ("NAME" "a.pdf") NIL NIL "BASE64" 8 NIL '
+    b'("ATTACHMENT" ("FILENAME" "a.pdf")) NIL NIL) '
+    b'"MIXED" ("BOUNDARY" "b0") NIL NIL NIL))'
+)
+
+
+def test_parse_bodystructure():
+    rsp = parse_fetch([BODYSTRUCTURE])
+    st = parse_bodystructure(rsp[0][1]['BODYSTRUCTURE'])
+    assert st.content_type == "multipart/mixed"
+    parts = {p.section: p for p in st.walk()}
+    assert parts["1"].content_type == "multipart/alternative"
+    assert parts["1.1"].content_type == "text/plain"
+    assert parts["1.1"].charset == "utf-8"
+    assert parts["1.1"].decode(b'caf=C3=A9 =\r\nok') == 'café ok'.encode()
+    assert parts["1.2"].content_type == "text/html"
+    assert parts["2"].filename == "a.pdf"
+    assert parts["2"].disposition == "attachment"
+    assert parts["2"].size == 8
+    assert parts["2"].decode(b'aGVs\r\nbG8=') == b'hello'
+
+    single = parse_bodystructure(
+        ["TEXT", "PLAIN", None, None, None, "7BIT", "3", "1"])
+    assert single.section == "1"
+    assert single.charset is None
+
+
+def test_stream_decoder():
+    raw = bytes(range(256)) * 50
+    b64 = base64.encodebytes(raw).replace(b'\n', b'\r\n')
+    qp = quopri.encodestring(raw)
+    for enc, data in (
+        ('base64', b64),
+        ('quoted-printable', qp),
+        ('7bit', raw)
+    ):
+        for size in (1, 3, 7, 100, len(data)):
+            dec = StreamDecoder(enc)
+            out = b''.join(
+                dec.feed(data[i:i + size]) for i in range(0, len(data), size)
+            ) + dec.flush()
+            assert out == raw, (enc, size)
@@ -0,0 +1,64 @@
+from datetime import date
+from mail.imap import Mail
+from mail.index import MailIndex, IndexHit, tokenize
+from mail.syncstate import SyncState
+
+
+def mk_mail(uid: int, subject: str, sender: str, body: str, dt: str):
+    raw = (
+        f"Subject: {subject}\r\nFrom: {sender}\r\nDate: {dt}\r\n"
+        "Content-Type: text/plain; charset=utf-8\r\n\r\n"
+        f"{body}\r\n"
+    )
+    return Mail.from_bytes(raw.encode('utf-8'), uid=uid)
+
+
+def test_tokenize():
+    assert tokenize("Factura-Número 12 a") == {"factura", "numero", "12"}
+
+
+def test_index(tmp_path):
+    path = str(tmp_path / "index.db")
+    with MailIndex(path) as idx:
+        idx.add_many((
+            mk_mail(1, "Factura enero", "Shop <shop@x.com>", "importe total",
+                    "Mon, 15 Jan 2024 10:00:00 +0000"),
+            mk_mail(2, "Hola", "Ana <ana@y.com>", "adjunto la factura",
+                    "Tue, 16 Jan 2024 10:00:00 +0000"),
+            mk_mail(3, "Factura 2023", "Shop <shop@x.com>", "otra",
+                    "Fri, 15 Dec 2023 10:00:00 +0000"),
+        ), "acc", "INBOX", 7)
+    with MailIndex(path) as idx:
+        assert [h.uid for h in idx.search(text="factura")] == [1, 2, 3]
+        assert [h.uid for h in idx.search(subject="factura")] == [1, 3]
+        assert idx.search(
+            subject="factura",
+            sender="shop@x.com",
+            since=date(2024, 1, 1)
+        ) == (IndexHit("acc", "INBOX", 1), )
+        assert idx.search(text="importe", folder="Sent") == tuple()
+        idx.add(mk_mail(1, "Nuevo", "a@b.c", "x",
+                        "Mon, 15 Jan 2024 10:00:00 +0000"), "acc", "INBOX", 8)
+        assert [h.uid for h in idx.search(text="factura")] == []
+        idx.add(mk_mail(1, "Otro", "a@b.c", "x",
+                        "Mon, 15 Jan 2024 10:00:00 +0000"), "acc", "INBOX", 8)
+        assert [h.uid for h in idx.search(subject="nuevo")] == []
+        assert [h.uid for h in idx.search(subject="otro")] == [1]
+
+
+def test_update(tmp_path, imap_server, imap_client):
+    srv = imap_server(count=5)
+    imap = imap_client(srv)
+    state = SyncState(str(tmp_path / "state.json"))
+    with MailIndex(str(tmp_path / "index.db")) as idx:
+        assert idx.update(imap, state, chunk_size=2) == 5
+        hits = idx.search(subject="mensaje")
+        assert [h.uid for h in hits] == [1, 2, 3, 4, 5]
+        assert len(idx.search(text="customer")) > 0
+        assert idx.update(imap, state) == 0
+        assert len(idx.search(subject="mensaje")) == 5
+        # Carpeta recreada y vacía: lo indexado ya no vale
+        srv.uidvalidity = 2
+        srv.messages.clear()
+        assert idx.update(imap, state) == 0
+        assert idx.search(subject="mensaje") == tuple()
@@ -0,0 +1,100 @@
+import re
+from email import message_from_bytes
+from mail.imap import Mail, Envelope, GMailId
+from mail.imapdata import parse_fetch
+
+
+def reference_body(body):
+    fake_br = re.escape("%$%&·%$·$··&%%$&%$&/")
+    body = body.replace("\n", fake_br)
+    body = re.sub(r"\s", " ", body)
+    body = body.replace(fake_br, "\n")
+    body = body.strip()
+    if len(body) == 0:
+        return None
+    return body
+
+
+def mk_mail(body: str):
+    raw = "Content-Type: text/plain; charset=utf-8\n"
+    raw = raw + "Content-Transfer-Encoding: 8bit\n\n" + body
+    return Mail(message_from_bytes(raw.encode('utf-8')))
+
+
+def test_body():
+    for body in (
+        "hola\tmundo\r\n\r\n  adiós\xa0amigo   \x0c\x0b fin",
+        "\n\n linea   \r\n",
+        " \t\r\n ",
+        "sin espacios",
+    ):
+        mail = mk_mail(body)
+        assert mail.body == reference_body(body.rstrip())
+
+
+def test_lazy_parse():
+    raw = (
+        b"Subject: =?utf-8?q?caf=C3=A9?=\r\n"
+        b"From: Alguien <a@example.com>\r\n"
+        b"Date: Tue, 1 Oct 2024 10:00:00 +0200\r\n"
+        b"Content-Type: text/plain; charset=utf-8\r\n\r\n"
+        b"hola\r\n"
+    )
+    mail = Mail.from_bytes(raw, id=b'1')
+    assert mail.subject == "café"
+    assert mail.sender == "a@example.com"
+    assert mail.sent_date.year == 2024
+    assert 'msg' not in mail.__dict__
+    assert mail.body == "hola"
+    assert mail.msg['Subject'] == "=?utf-8?q?caf=C3=A9?="
+
+
+def test_lazy_headers_only():
+    body = b"x" * 1000 + b"\r\n"
+    for eol in (b"\r\n", b"\n"):
+        raw = eol.join([b"Subject: grande", b"X-Otra: si", b"", body * 1000])
+        mail = Mail.from_bytes(raw, id=b'1')
+        assert mail.subject == "grande"
+        assert mail.headers['X-Otra'] == "si"
+        assert mail.headers.get_payload() == ""
+        assert 'msg' not in mail.__dict__
+
+
+def test_envelope():
+    data = [
+        b'12 (UID 99 RFC822.SIZE 4321 FLAGS (\\Seen) '
+        b'INTERNALDATE "17-Jul-1996 02:44:25 -0700" ENVELOPE ('
+        b'"Wed, 17 Jul 1996 02:23:25 -0700 (PDT)" "=?utf-8?q?caf=C3=A9?=" '
+        b'(("Terry Gray" NIL "gray" "example.com")) NIL NIL NIL NIL NIL NIL '
+        b'"<B27397@example.com>"))'
+    ]
+    num, values = parse_fetch(data)[0]
+    env = Envelope.from_fetch(values, id=b'12')
+    assert not hasattr(env, '__dict__')
+    assert (env.uid, env.size, env.flags) == (99, 4321, ('\\Seen', ))
+    assert env.sender == "gray@example.com"
+    assert env.subject == "café"
+    assert env.date.hour == 2 and env.date.minute == 23
+    assert env.message_id == "<B27397@example.com>"
+    # Sin fecha en ENVELOPE se usa INTERNALDATE, sin depender del locale
+    for internaldate, expected in (
+        (" 7-Jul-1996 02:44:25 -0700", "1996-07-07T02:44:25-07:00"),
+        ("17-Foo-1996 02:44:25 -0700", None),
+        ("30-Feb-1996 02:44:25 +0000", None),
+    ):
+        env = Envelope.from_fetch({'INTERNALDATE': internaldate})
+        assert (env.date and env.date.isoformat()) == expected
+
+
+def test_gmail_id():
+    data = [
+        b'4 (UID 12 X-GM-MSGID 1278455344230334865 '
+        b'X-GM-THRID 1266894439832287888'
+        b' X-GM-LABELS ("\\\\Inbox" "\\\\Sent" Foo))',
+    ]
+    num, values = parse_fetch(data)[0]
+    gm = GMailId.from_fetch(values, id=b'4')
+    assert gm.uid == 12
+    assert gm.msgid == 1278455344230334865
+    assert gm.thrid == 1266894439832287888
+    assert gm.labels == ('\\Inbox', '\\Sent', 'Foo')
@@ -0,0 +1,35 @@
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from mail.imap import Mail
+from mail.mimepool import MimePool
+
+
+def mk_raw(i: int):
+    msg = MIMEMultipart()
+    msg['Subject'] = f"Asunto {i} ñ"
+    msg['From'] = "Yo <yo@example.com>"
+    msg['Date'] = "Tue, 14 Nov 2023 22:13:20 +0000"
+    msg.attach(MIMEText(f"Hola  mundo {i}\n", "plain", "utf-8"))
+    att = MIMEApplication(bytes(range(256)) * i, Name=f"f{i}.bin")
+    att['Content-Disposition'] = f'attachment; filename="f{i}.bin"'
+    msg.attach(att)
+    return msg.as_bytes()
+
+
+def test_mimepool():
+    raws = [mk_raw(i) for i in range(1, 8)]
+    with MimePool(workers=2, batch=3) as pool:
+        mails = list(pool.decode(
+            Mail.from_bytes(r, id=str(i)) for i, r in enumerate(raws)
+        ))
+    assert [m.id for m in mails] == [str(i) for i in range(7)]
+    for m, r in zip(mails, raws):
+        # Todo se ha rellenado en el pool sin parsear aquí
+        assert 'msg' not in m.__dict__
+        ref = Mail.from_bytes(r)
+        assert m.body == ref.body
+        assert m.subject == ref.subject
+        assert m.sender == ref.sender
+        assert m.sent_date == ref.sent_date
+        assert m.attachments == ref.attachments
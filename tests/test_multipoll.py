@@ -0,0 +1,64 @@
+import socket
+import time
+from mail.fetchmail import FetchMail
+from mail.multipoll import MultiPoll
+from run.fakeserver import client_context
+
+
+def fetchmail(*ports: int):
+    # Lo mismo que devolvería fetchmail --configdump
+    fm = FetchMail()
+    fm.__dict__['config'] = {'servers': [{
+        'pollname': '127.0.0.1',
+        'protocol': 'IMAP',
+        'service': port,
+        'users': [{
+            'remote': f'user{port}',
+            'password': 'p',
+            'ssl': True,
+            'localnames': [],
+            'mailboxes': []
+        }]
+    } for port in ports]}
+    return fm
+
+
+def closed_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def test_multipoll_errors(imap_server):
+    ok1 = imap_server(count=3)
+    ok2 = imap_server(count=4)
+    ko = closed_port()
+    mp = MultiPoll(fetchmail(ok1.port, ko, ok2.port),
+                   ssl_context=client_context())
+    got = list(mp.search('ALL'))
+    # La cuenta que falla no impide leer las demás
+    count = {}
+    for item, mail in got:
+        count[item.port] = count.get(item.port, 0) + 1
+    assert count == {ok1.port: 3, ok2.port: 4}
+    assert [item.port for item in mp.errors] == [ko]
+    assert isinstance(mp.errors[next(iter(mp.errors))], OSError)
+
+
+def test_multipoll_stop(imap_server):
+    servers = [imap_server(count=200, size=100) for _ in range(2)]
+    mp = MultiPoll(fetchmail(*(s.port for s in servers)),
+                   ssl_context=client_context())
+    ini = time.monotonic()
+    results = mp.search('ALL', chunk_size=10, buffer=5)
+    for n, (item, mail) in enumerate(results):
+        if n == 2:
+            break
+    results.close()
+    # Al cerrar el generador los hilos dejan de descargar
+    assert time.monotonic() - ini < 5
+    fetches = [
+        c for s in servers for c in s.commands if ' FETCH ' in c
+    ]
+    assert len(fetches) < 10
+    assert mp.errors == {}
@@ -0,0 +1,51 @@
+import pytest
+from mail.config import Config
+from mail.pool import ImapPool
+from run.fakeserver import client_context
+
+
+def selects(srv):
+    return [
+        c for c in srv.commands if c.split(' ')[1] in ('SELECT', 'EXAMINE')
+    ]
+
+
+def test_pool_limit(imap_server):
+    srv = imap_server()
+    config = Config(host="127.0.0.1", port=srv.port, user="u", pssw="p")
+    with ImapPool(max_connections=2, keepalive=0,
+                  ssl_context=client_context()) as pool:
+        a = pool.acquire(config)
+        b = pool.acquire(config)
+        assert a is not b
+        with pytest.raises(TimeoutError):
+            pool.acquire(config, timeout=0.2)
+        pool.release(a)
+        assert pool.acquire(config, timeout=0.2) is a
+        # Una sesión muerta se sustituye por otra nueva
+        pool.release(b)
+        b.session.shutdown()
+        c = pool.acquire(config, timeout=0.2)
+        assert c is not b
+        assert c.noop()[0] == 'OK'
+        with pytest.raises(TimeoutError):
+            pool.acquire(config, timeout=0.2)
+        pool.release(c, discard=True)
+        pool.release(a)
+        assert pool.acquire(config, timeout=0.2) is a
+        assert pool.acquire(config, timeout=0.2) not in (a, c)
+
+
+def test_pool_select(imap_server):
+    srv = imap_server()
+    config = Config(host="127.0.0.1", port=srv.port, user="u", pssw="p")
+    with ImapPool(max_connections=1, keepalive=0,
+                  ssl_context=client_context()) as pool:
+        for _ in range(3):
+            with pool.session(config, 'INBOX') as imap:
+                assert imap.folder == 'INBOX'
+        # La carpeta ya estaba seleccionada, no se repite el SELECT
+        assert len(selects(srv)) == 1
+        with pool.session(config, 'INBOX', readonly=True) as imap:
+            assert imap.readonly
+        assert len(selects(srv)) == 2
@@ -0,0 +1,44 @@
+import threading
+import pytest
+from mail.readahead import read_ahead
+
+
+def test_read_ahead():
+    items = [bytes(10) for _ in range(50)]
+    prepared: list[int] = []
+    assert list(read_ahead(
+        items,
+        25,
+        prepare=lambda b: prepared.append(len(b))
+    )) == items
+    assert len(prepared) == 50
+
+
+def test_backpressure():
+    produced = []
+    lock = threading.Lock()
+
+    def source():
+        for i in range(100):
+            with lock:
+                produced.append(i)
+            yield bytes(10)
+
+    it = read_ahead(source(), 30)
+    next(it)
+    threading.Event().wait(0.2)
+    # 1 consumido + como mucho 3 en el buffer + 1 descargado esperando
+    assert len(produced) <= 5
+    it.close()
+    assert len(produced) < 100
+
+
+def test_error():
+    def source():
+        yield b'a'
+        raise ValueError("boom")
+
+    it = read_ahead(source(), 100)
+    assert next(it) == b'a'
+    with pytest.raises(ValueError):
+        next(it)
@@ -0,0 +1,166 @@
+import os
+import threading
+import tracemalloc
+from email import message_from_bytes
+import smtplib
+import pytest
+from mail.config import Config
+from mail.smtp import Smtp, Mail
+from mail.smtppool import SmtpPool, TokenBucket
+from run.fakeserver import client_context
+
+
+def test_send_many(smtp_server):
+    srv = smtp_server(limit=3)
+    smtp = Smtp(
+        Config(host="127.0.0.1", port=srv.port, user="u", pssw="p"),
+        ssl_context=client_context()
+    )
+    mails = [
+        Mail(to=f"user{i}@example.com", subject=f"s{i}", body="hola")
+        for i in range(7)
+    ]
+    mails.insert(2, Mail(to="reject@example.com", subject="ko"))
+    rs = smtp.send_many(mails)
+    assert [r.ok for r in rs] == [True, True, False] + [True] * 5
+    assert rs[2].refused
+    assert len(srv.received) == 7
+    # El servidor corta tras 3 mensajes y a partir de ahí se respeta
+    assert len(srv.connections) == 3
+    smtp.close()
+
+
+def test_send_many_files(tmp_path, smtp_server):
+    srv = smtp_server(keep=True)
+    att = tmp_path / "adjunto.bin"
+    att.write_bytes(os.urandom(1000))
+    smtp = Smtp(
+        Config(host="127.0.0.1", port=srv.port, user="u", pssw="p"),
+        ssl_context=client_context()
+    )
+    mails = [
+        Mail(to=f"user{i}@example.com", subject=f"s{i}", body="hola",
+             attachments=(str(att), ) if i % 2 else ())
+        for i in range(7)
+    ]
+    mails.append(Mail(to="reject@example.com", attachments=(str(att), )))
+    mails.append(Mail(to=(), attachments=(str(att), )))
+    rs = smtp.send_many(mails, max_per_connection=2)
+    assert [r.ok for r in rs] == [True] * 7 + [False, False]
+    assert rs[7].refused and isinstance(rs[8].error, ValueError)
+    # Los adjuntos en disco también cuentan para max_per_connection
+    assert len(srv.received) == 7
+    assert len(srv.connections) == 4
+    msg = message_from_bytes(srv.messages[1].read())
+    assert msg.get_payload(1).get_payload(decode=True) == att.read_bytes()
+    smtp.close()
+
+
+@pytest.mark.parametrize("files", [False, True])
+def test_send_after_421(tmp_path, smtp_server, files):
+    srv = smtp_server(limit=1)
+    att = tmp_path / "adjunto.bin"
+    att.write_bytes(b"datos")
+    attachments = (str(att), ) if files else ()
+    mails = [
+        Mail(to=f"user{i}@example.com", subject=f"s{i}",
+             attachments=attachments)
+        for i in range(3)
+    ]
+    with Smtp(Config(host="127.0.0.1", port=srv.port, user="u", pssw="p"),
+              ssl_context=client_context()) as smtp:
+        smtp.send(mails[0])
+        with pytest.raises(smtplib.SMTPSenderRefused) as e:
+            smtp.send(mails[1])
+        assert e.value.smtp_code == 421
+        # La sesión cerrada por el servidor no se reutiliza
+        smtp.send(mails[2])
+    assert len(srv.received) == 2
+    assert len(srv.connections) == 2
+
+
+def test_smtp_pool(smtp_server):
+    srv = smtp_server(busy=2)
+    config = Config(host="127.0.0.1", port=srv.port, user="pool", pssw="p")
+    mails = [
+        Mail(to=f"user{i}@example.com", subject=f"s{i}", body="hola")
+        for i in range(12)
+    ]
+    with SmtpPool(
+        config,
+        connections=3,
+        per_minute=6000,
+        burst=3,
+        backoff=0.01,
+        ssl_context=client_context()
+    ) as pool:
+        rs = pool.send_many(mails)
+        assert [r.msg for r in rs] == mails
+        assert all(r.ok for r in rs)
+        assert pool.per_minute < 6000
+    assert len(srv.received) == 12
+    # Un pool nuevo no hereda el ritmo penalizado del anterior...
+    with SmtpPool(config, per_minute=6000, burst=3) as pool:
+        assert pool.per_minute == 6000
+    # ... salvo que se le pase el mismo bucket
+    bucket = TokenBucket(6000)
+    bucket.penalize()
+    with SmtpPool(config, bucket=bucket) as pool:
+        assert pool.bucket is bucket and pool.per_minute == 3000
+    with pytest.raises(ValueError):
+        SmtpPool(config, per_minute=60, bucket=bucket)
+
+
+def test_smtp_pool_closed(smtp_server):
+    srv = smtp_server()
+    config = Config(host="127.0.0.1", port=srv.port, user="u", pssw="p")
+    mails = [
+        Mail(to=f"user{i}@example.com", subject=f"s{i}", body="hola")
+        for i in range(3)
+    ]
+    pool = SmtpPool(config, connections=1, per_minute=1,
+                    ssl_context=client_context())
+    rs = []
+    th = threading.Thread(target=lambda: rs.extend(pool.send_many(mails)))
+    th.start()
+    for _ in range(200):
+        if srv.received:
+            break
+        th.join(0.05)
+    pool.close()
+    th.join(10)
+    # Lo que esperaba turno en el bucket no se envía tras cerrar
+    assert [r.ok for r in rs] == [True, False, False]
+    assert "closed" in str(rs[1].error)
+    assert len(srv.received) == 1
+
+
+@pytest.mark.parametrize("chunking", [False, True])
+def test_send_stream(tmp_path, smtp_server, chunking):
+    srv = smtp_server(chunking=chunking, keep=True)
+    att = tmp_path / "big.bin"
+    content = os.urandom(3 * 1024 * 1024 + 7)
+    att.write_bytes(content)
+    mail = Mail(
+        to="user@example.com",
+        subject="adjunto ñ",
+        body="hola\n.linea con punto\n",
+        attachments=(str(att), )
+    )
+    smtp = Smtp(
+        Config(host="127.0.0.1", port=srv.port, user="u@example.com",
+               pssw="p"),
+        ssl_context=client_context()
+    )
+    with smtp:
+        tracemalloc.start()
+        smtp.send_stream(mail, chunk_size=256 * 1024)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    # Nunca está el adjunto entero en memoria (ni en bytes ni en base64)
+    assert peak < len(content)
+    msg = message_from_bytes(srv.messages[0].read())
+    assert msg['From'] == "u@example.com"
+    assert msg.get_payload(0).get_payload() == "hola\r\n.linea con punto\r\n"
+    assert msg.get_payload(1).get_filename() == "big.bin"
+    assert msg.get_payload(1).get_payload(decode=True) == content
@@ -0,0 +1,91 @@
+import re
+import time
+from mail.config import Config
+from mail.smtp import Mail
+from mail.spool import Spool
+from run.fakeserver import client_context
+
+re_bare_lf = re.compile(rb'(?<!\r)\n')
+
+
+def wait_for(cond, timeout=10):
+    end = time.monotonic() + timeout
+    while not cond():
+        if time.monotonic() > end:
+            raise TimeoutError()
+        time.sleep(0.05)
+
+
+def test_spool(tmp_path, smtp_server):
+    srv = smtp_server(busy=2)
+    config = Config(host="127.0.0.1", port=srv.port, user="u", pssw="p")
+    path = str(tmp_path / "spool")
+    # Encolado sin entregar (como si el proceso muriese antes)
+    spool = Spool(path, config, start=False, ssl_context=client_context())
+    for i in range(4):
+        spool.enqueue(Mail(to=f"user{i}@example.com", subject=f"s{i}"))
+    ko = spool.enqueue(Mail(to="reject@example.com", subject="ko"))
+    spool.close()
+    assert len(spool.pending) == 5
+    assert srv.received == []
+    with Spool(path, config, backoff=0.05,
+               ssl_context=client_context()) as spool:
+        wait_for(lambda: len(spool.pending) == 0)
+        assert spool.dead == (ko, )
+        assert "reject@example.com" in spool.error(ko)
+    assert len(srv.received) == 4
+
+
+def test_spool_auth_failure(tmp_path, smtp_server):
+    srv = smtp_server(reject_auth=True)
+    config = Config(host="127.0.0.1", port=srv.port, user="u", pssw="p")
+    path = str(tmp_path / "spool")
+    with Spool(path, config, backoff=0.05, max_attempts=2,
+               ssl_context=client_context()) as spool:
+        ids = [
+            spool.enqueue(Mail(to=f"user{i}@example.com", subject=f"s{i}"))
+            for i in range(3)
+        ]
+        wait_for(lambda: srv.auth_failures >= 6)
+        # Un 535 al conectar no es culpa de los mensajes, siguen en cola
+        # sin gastar intentos
+        assert spool.pending == tuple(ids)
+        assert spool.dead == ()
+        assert "535" in spool.error(ids[0])
+        srv.reject_auth = False
+        wait_for(lambda: len(spool.pending) == 0)
+        assert spool.dead == ()
+    assert len(srv.received) == 3
+
+
+def test_spool_crlf(tmp_path, smtp_server):
+    srv = smtp_server(keep=True)
+    config = Config(host="127.0.0.1", port=srv.port, user="u", pssw="p")
+    path = tmp_path / "spool"
+    with Spool(str(path), config, start=False,
+               ssl_context=client_context()) as spool:
+        msg_id = spool.enqueue(Mail(
+            to="user@example.com", subject="s", body="uno\ndos\n"))
+        stored = (path / "new" / (msg_id + ".eml")).read_bytes()
+        assert spool.deliver() is None
+    # Un \n suelto lo rechazan los relays estrictos
+    assert re_bare_lf.search(stored) is None
+    assert re_bare_lf.search(srv.messages[0].read()) is None
+
+
+def test_spool_crash(tmp_path, smtp_server):
+    srv = smtp_server()
+    config = Config(host="127.0.0.1", port=srv.port, user="u", pssw="p")
+    path = tmp_path / "spool"
+    with Spool(str(path), config, start=False,
+               ssl_context=client_context()) as spool:
+        ids = [
+            spool.enqueue(Mail(to=f"user{i}@example.com", subject=f"s{i}"))
+            for i in range(3)
+        ]
+        # Como si el proceso muriese tras mover el .eml a dead/
+        (path / "new" / (ids[0] + ".eml")).rename(
+            path / "dead" / (ids[0] + ".eml"))
+        assert spool.deliver() is None
+        assert spool.pending == () and spool.dead == ()
+    assert len(srv.received) == 2
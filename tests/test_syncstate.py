@@ -0,0 +1,12 @@
+from mail.syncstate import SyncState, FolderState
+
+
+def test_syncstate(tmp_path):
+    path = str(tmp_path / "sub" / "state.json")
+    st = SyncState(path)
+    assert st.get("a@h", "INBOX") == FolderState()
+    st.set("a@h", "INBOX", uidvalidity=7, uid=10)
+    st.save()
+    st = SyncState(path)
+    assert st.get("a@h", "INBOX") == FolderState(uidvalidity=7, uid=10)
+    assert st.get("a@h", "Sent") == FolderState()